@@ -0,0 +1,93 @@
+"""
+Microbenchmark comparing `encode_message()` with the previous implementation,
+which concatenated bytes objects and parsed the code string on every call.
+
+Usage:
+    python -m benchmarks.encoder
+"""
+
+import timeit
+
+from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
+from coap_server.utils.parser import encode_message, encode_message_into
+
+
+def encode_message_concat(message: CoapMessage) -> bytes:
+    """Previous implementation (without extended option handling)."""
+
+    data = bytes()
+    first_byte = (
+        (message.header_version << 6)
+        | (message.header_type << 4)
+        | message.header_token_length
+    )
+    class_, code = message.header_code.value.split(".", 1)
+    second_byte = (int(class_) << 5) | int(code)
+    mid_high = (message.header_mid >> 8) & 0xFF
+    mid_low = message.header_mid & 0xFF
+    data += bytes([first_byte, second_byte, mid_high, mid_low]) + message.token
+
+    prev_option = 0
+    for option, value in message.options.items():
+        option_delta = option.value - prev_option
+        data += bytes([option_delta << 4 | len(value)])
+        data += value
+        prev_option = option.value
+
+    if message.payload:
+        data += bytes([0xFF])
+        data += message.payload
+
+    return data
+
+
+MESSAGES = {
+    "temperature": CoapMessage(
+        header_version=1,
+        header_type=2,
+        header_token_length=4,
+        header_code=CoapCode.CONTENT,
+        header_mid=1337,
+        token=b"1234",
+        options={},
+        payload=b"21",
+    ),
+    "with option": CoapMessage(
+        header_version=1,
+        header_type=2,
+        header_token_length=4,
+        header_code=CoapCode.CONTENT,
+        header_mid=1337,
+        token=b"1234",
+        options={CoapOption.CONTENT_FORMAT: b"\x32"},
+        payload=b'{"name": "Sensor 1", "temperature": 21}',
+    ),
+}
+
+
+def main():
+    number = 200000
+    buffer = bytearray(1500)
+    print(f"{'message':>12} {'concat':>10} {'encode':>10} {'into':>10}")
+
+    for name, message in MESSAGES.items():
+        assert encode_message_concat(message) == encode_message(message)
+
+        concat = timeit.timeit(
+            lambda: encode_message_concat(message), number=number
+        )
+        encode = timeit.timeit(lambda: encode_message(message), number=number)
+        into = timeit.timeit(
+            lambda: encode_message_into(message, buffer), number=number
+        )
+
+        print(
+            f"{name:>12} "
+            f"{concat / number * 1e9:>7.0f} ns "
+            f"{encode / number * 1e9:>7.0f} ns "
+            f"{into / number * 1e9:>7.0f} ns"
+        )
+
+
+if __name__ == "__main__":
+    main()
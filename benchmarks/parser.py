@@ -0,0 +1,80 @@
+"""
+Microbenchmark comparing `parse_message()` with the previous implementation,
+which re-sliced the remaining buffer after every decoded option byte.
+
+Usage:
+    python -m benchmarks.parser
+"""
+
+import timeit
+
+from coap_server.utils.constants import CoapCode, CoapOption
+from coap_server.utils.parser import parse_message
+
+HEADER = b"D\x01\x0591234"
+
+
+def parse_options_slicing(data: bytes) -> dict[CoapOption, bytes]:
+    """Option decoding loop of the previous, copying implementation."""
+
+    options = data[4 + (0x0F & data[0]) :]
+    options_parsed: dict[CoapOption, bytes] = {}
+    option_code = 0
+    while options and options[0] != 0xFF:
+        delta, length = (options[0] & 0xF0) >> 4, options[0] & 0x0F
+        options = options[1:]
+
+        if delta == 13:
+            delta = options[0] + 13
+            options = options[1:]
+        elif delta == 14:
+            delta = (options[0] << 8) + options[1] + 269
+            options = options[2:]
+
+        if length == 13:
+            length = options[0] + 13
+            options = options[1:]
+        elif length == 14:
+            length = (options[0] << 8) + options[1] + 269
+            options = options[2:]
+
+        option_code += delta
+        options_parsed[CoapOption(option_code)] = options[:length]
+        options = options[length:]
+
+    return options_parsed
+
+
+def make_message(num_options: int, value_length: int = 10) -> bytes:
+    """GET request with `num_options` repeated Uri-Query options."""
+
+    value = b"q" * value_length
+    # option number 15 has to be encoded with an extended delta
+    first = bytes([13 << 4 | value_length, CoapOption.URI_QUERY.value - 13])
+    first += value
+    repeated = bytes([value_length]) + value
+    return HEADER + first + repeated * (num_options - 1)
+
+
+def main():
+    print(f"{'options':>8} {'bytes':>7} {'slicing':>12} {'cursor':>12}")
+
+    for num_options in (10, 100, 1000, 5000):
+        data = make_message(num_options)
+        assert parse_message(data).header_code == CoapCode.GET
+
+        number = max(1, 20000 // num_options)
+        slicing = timeit.timeit(
+            lambda: parse_options_slicing(data), number=number
+        )
+        cursor = timeit.timeit(lambda: parse_message(data), number=number)
+
+        print(
+            f"{num_options:>8} {len(data):>7} "
+            f"{slicing / number * 1e6:>9.1f} us "
+            f"{cursor / number * 1e6:>9.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Memory used per sensor by the in-memory stores, measured with tracemalloc.
+
+Usage:
+    pytest benchmarks/test_memory.py -s
+"""
+
+import gc
+import tracemalloc
+
+import pytest
+
+from coap_server.storage import SensorStore
+
+SENSORS = 100_000
+
+
+def make_sensors(unique_names):
+    return {
+        i: {
+            "name": f"Sensor {i}" if unique_names else "Sensor",
+            "temperature": 20,
+        }
+        for i in range(1, SENSORS + 1)
+    }
+
+
+def bytes_per_sensor(build) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        objects = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(objects) == SENSORS
+    return size / SENSORS
+
+
+@pytest.mark.parametrize("unique_names", [True, False])
+def test_memory_per_sensor(unique_names):
+    plain = bytes_per_sensor(lambda: make_sensors(unique_names))
+    compact = bytes_per_sensor(lambda: SensorStore(make_sensors(unique_names)))
+
+    print(
+        f"\nunique names: {unique_names}, dict: {plain:.0f} B/sensor, "
+        f"SensorStore: {compact:.0f} B/sensor"
+    )
+    assert compact < plain / 2
@@ -0,0 +1,78 @@
+"""
+Microbenchmarks of the request hot path, run with pytest-benchmark.
+
+Usage:
+    pytest benchmarks/
+    pytest benchmarks/ --benchmark-compare  # against the saved run
+"""
+
+import json
+
+import pytest
+
+from coap_server.request_handler import RequestHandler
+from coap_server.resources.sensors import SensorsResource
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    CoapType,
+)
+from coap_server.utils.parser import encode_message, parse_message
+
+pytest.importorskip("pytest_benchmark")
+
+CLIENT = ("127.0.0.1", 40000)
+
+
+def make_request(code, uri, payload=b""):
+    return CoapMessage(
+        header_version=1,
+        header_type=CoapType.CON,
+        header_token_length=4,
+        header_code=code,
+        header_mid=1337,
+        token=b"1234",
+        options={CoapOption.URI_PATH: uri},
+        payload=payload,
+    )
+
+
+@pytest.fixture
+def handler():
+    sensors = {
+        i: {"name": f"Sensor {i}", "temperature": 20} for i in range(1, 101)
+    }
+    return RequestHandler({"sensors": SensorsResource(sensors)})
+
+
+def test_parse_message(benchmark):
+    data = encode_message(make_request(CoapCode.GET, b"/sensors/1"))
+
+    benchmark(parse_message, data)
+
+
+def test_encode_message(benchmark):
+    response = make_request(
+        CoapCode.CONTENT,
+        b"/sensors/1",
+        json.dumps({"name": "Sensor 1", "temperature": 20}).encode(),
+    )
+
+    benchmark(encode_message, response)
+
+
+@pytest.mark.parametrize(
+    "code, uri, payload",
+    [
+        (CoapCode.GET, b"/sensors/1", b""),
+        (CoapCode.GET, b"/sensors/1/temperature", b""),
+        (CoapCode.PUT, b"/sensors/1/temperature", b"21"),
+        (CoapCode.GET, b"/sensors/1000", b""),
+    ],
+    ids=["get", "get-temperature", "put-temperature", "not-found"],
+)
+def test_handle_request(benchmark, handler, code, uri, payload):
+    data = encode_message(make_request(code, uri, payload))
+
+    benchmark(handler.handle_request, data, CLIENT)
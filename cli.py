@@ -10,8 +10,20 @@ from urllib.parse import urlparse
 
 import typer
 
-from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
-from coap_server.utils.parser import encode_message, parse_message
+from coap_server.blockwise import decode_block, encode_block
+from coap_server.multicast import address_family
+from coap_server.utils.constants import (
+    MAX_MESSAGE_SIZE,
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    Options,
+)
+from coap_server.utils.parser import (
+    encode_message,
+    parse_message,
+    uri_options,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -53,6 +65,8 @@ def request(
     host = parsed_uri.hostname
     port = parsed_uri.port or 5683
     path = parsed_uri.path
+    if parsed_uri.query:
+        path += "?" + parsed_uri.query
 
     logger.info(f"Sending {method.upper()} request to {host}:{port}{path}")
 
@@ -71,7 +85,7 @@ def request(
         )
 
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        with socket.socket(address_family(host), socket.SOCK_DGRAM) as sock:
             coap_request = CoapMessage(
                 header_version=1,
                 header_type=0,
@@ -79,7 +93,7 @@ def request(
                 header_code=method_map[method.upper()],
                 header_mid=1337,
                 token=b"1234",
-                options={CoapOption.URI_PATH: path.encode()},
+                options=Options(uri_options(path)),
                 payload=data.encode() if data else b"",
             )
 
@@ -88,14 +102,46 @@ def request(
             sock.sendto(encode_message(coap_request), (host, port))
             logger.info("Request sent, waiting for response...")
 
-            response_data = sock.recv(1024)
+            response_data = sock.recv(MAX_MESSAGE_SIZE)
             response = parse_message(response_data)
 
+            # Fetch the remaining blocks of a large response
+            payload = bytes(response.payload)
+            block2 = response.options.get(CoapOption.BLOCK2)
+            while block2 is not None and decode_block(block2)[1]:
+                num, _, szx = decode_block(block2)
+                sock.sendto(
+                    encode_message(
+                        CoapMessage(
+                            header_version=1,
+                            header_type=0,
+                            header_token_length=4,
+                            header_code=CoapCode.GET,
+                            header_mid=1337 + num + 1,
+                            token=b"1234",
+                            options=Options(
+                                [
+                                    *uri_options(path),
+                                    (
+                                        CoapOption.BLOCK2,
+                                        encode_block(num + 1, False, szx),
+                                    ),
+                                ]
+                            ),
+                            payload=b"",
+                        )
+                    ),
+                    (host, port),
+                )
+                response = parse_message(sock.recv(MAX_MESSAGE_SIZE))
+                payload += response.payload
+                block2 = response.options.get(CoapOption.BLOCK2)
+
             logger.info(f"Response Code: {response.header_code}")
-            logger.debug(f"Response Data: {response.payload.decode()}")
+            logger.debug(f"Response Data: {payload.decode()}")
 
             typer.echo(f"Response Code: {response.header_code}")
-            typer.echo(f"Data: {response.payload.decode()}")
+            typer.echo(f"Data: {payload.decode()}")
 
     except socket.timeout:
         logger.error("Request timed out")
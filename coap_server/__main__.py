@@ -3,22 +3,115 @@ Main script launching example CoAP server.
 """
 
 import logging
-from typing import MutableMapping
+from typing import MutableMapping, Optional
 
 import typer
 
-from coap_server.logger import logger
+from coap_server.bench import (
+    DEFAULT_MIX,
+    LoadGenerator,
+    parse_mix,
+    run_benchmark,
+)
+from coap_server.cache import CACHE_SIZE
+from coap_server.executor import DEADLINE, QUEUE_SIZE, BoundedExecutor
+from coap_server.history import History
+from coap_server.logger import configure_logging, logger
+from coap_server.multicast import all_coap_nodes
+from coap_server.ratelimit import RateLimiter
 from coap_server.resources.base_resource import BaseResource
 from coap_server.resources.sensors import SensorsResource
-from coap_server.server import CoAPServer
+from coap_server.server import CoAPServer, ServerMode
+from coap_server.storage import (
+    SensorStore,
+    StorageKind,
+    Store,
+    open_store,
+)
+from coap_server.utils.constants import DEFAULT_LEISURE
+from coap_server.workers import SharedObjectsManager, WorkerPool
 
 app = typer.Typer()
 
 
 @app.command()
 def start(
-    host: str = typer.Option("127.0.0.1", help="The host to connect to"),
+    host: str = typer.Option(
+        "127.0.0.1",
+        help="The host to connect to, an IPv6 address binds an IPv6 socket "
+        "(:: accepts both IPv4 and IPv6 clients)",
+    ),
     port: int = typer.Option(5683, help="The port to connect to"),
+    mode: ServerMode = typer.Option(
+        ServerMode.SYNC,
+        help="I/O model: blocking loop (sync), asyncio event loop or "
+        "batched receive and send (batch)",
+    ),
+    multicast: bool = typer.Option(
+        False,
+        help="Join the All-CoAP-Nodes groups (224.0.1.187 and ff0x::fd) "
+        "available for the host",
+    ),
+    interface: Optional[str] = typer.Option(
+        None,
+        help="Network interface joining the groups, required for the "
+        "link-local ff02::fd (default: chosen by the system)",
+    ),
+    leisure: float = typer.Option(
+        DEFAULT_LEISURE,
+        help="Responses to group requests are delayed randomly by up to "
+        "this many seconds",
+    ),
+    workers: int = typer.Option(
+        1, help="Number of worker processes sharing the port (SO_REUSEPORT)"
+    ),
+    threads: int = typer.Option(
+        0,
+        help="Threads running resource methods, so that a method blocking "
+        "on I/O doesn't stop receiving (asyncio mode only, 0 runs them "
+        "inline)",
+    ),
+    queue_size: int = typer.Option(
+        QUEUE_SIZE,
+        help="Requests waiting for a thread at most, further ones are "
+        "answered with 5.03",
+    ),
+    deadline: float = typer.Option(
+        DEADLINE,
+        help="Seconds to handle a request in a thread, answered with 5.03 "
+        "afterwards",
+    ),
+    client_rate: float = typer.Option(
+        0,
+        help="Requests per second allowed from a single client address, "
+        "further ones are answered with 4.29 (0 means no limit)",
+    ),
+    client_burst: Optional[float] = typer.Option(
+        None,
+        help="Requests a client may send at once (default: a second worth)",
+    ),
+    global_rate: float = typer.Option(
+        0,
+        help="Requests per second admitted from all the clients together, "
+        "further ones are answered with 5.03 (0 means no limit)",
+    ),
+    cache_size: int = typer.Option(
+        CACHE_SIZE,
+        help="Bytes of cached responses to GET requests (0 disables the "
+        "cache)",
+    ),
+    log_queue: bool = typer.Option(
+        False, help="Write logs from a background thread"
+    ),
+    storage: StorageKind = typer.Option(
+        StorageKind.MEMORY,
+        help="Where the sensors are kept: in memory only (memory or compact "
+        "columns), in memory with a write-ahead log (wal) or in a SQLite "
+        "database (sqlite)",
+    ),
+    data_dir: str = typer.Option(
+        "data", help="Directory of the persistent storage"
+    ),
     verbose: int = typer.Option(
         2,
         "--verbose",
@@ -33,20 +126,133 @@ def start(
 
     log_levels = [logging.WARNING, logging.INFO, logging.DEBUG]
     log_level = log_levels[min(verbose, len(log_levels) - 1)]
-    logger.setLevel(log_level)
-    logger.info(f"Starting CoAP Server on {host}:{port}")
+    configure_logging(log_level, use_queue=log_queue)
+    logger.info("Starting CoAP Server on %s:%s", host, port)
+
+    objects: MutableMapping[int, MutableMapping[str, str | int]] = {
+        1: {"name": "Sensor 1", "temperature": 21},
+        2: {"name": "Sensor 2", "temperature": 25},
+    }
 
+    manager = None
+    if workers > 1:
+        # keep the sensors in a single process shared by all the workers
+        manager = SharedObjectsManager()
+        manager.start()
+
+    store: Store | None = None
+    if storage == StorageKind.COMPACT:
+        if manager is not None:
+            objects = manager.SensorStore(objects)  # type: ignore
+        else:
+            objects = SensorStore(objects)
+    elif storage != StorageKind.MEMORY:
+        if manager is not None:
+            opened: Store = manager.Store(storage, data_dir)  # type: ignore
+        else:
+            opened = open_store(storage, data_dir)
+        if len(opened) == 0:
+            # the example sensors are stored on the first start only
+            opened.update(objects)
+        objects = store = opened
+    elif manager is not None:
+        objects = manager.SharedObjects(objects)  # type: ignore
+
+    history = History()
+    if manager is not None:
+        history = manager.History()  # type: ignore
     routes: MutableMapping[str, BaseResource] = {
-        "sensors": SensorsResource(
-            {
-                1: {"name": "Sensor 1", "temperature": 21},
-                2: {"name": "Sensor 2", "temperature": 25},
-            }
-        ),
+        "sensors": SensorsResource(objects, history),
     }
 
-    server = CoAPServer(routes, host, port)
-    server.start()
+    executor = None
+    if threads > 0:
+        if mode != ServerMode.ASYNCIO:
+            raise typer.BadParameter("--threads requires --mode asyncio")
+        executor = BoundedExecutor(threads, queue_size, deadline)
+
+    limiter = None
+    if client_rate > 0 or global_rate > 0:
+        limiter = RateLimiter(client_rate, client_burst, global_rate)
+
+    groups = all_coap_nodes(host, interface) if multicast else []
+
+    try:
+        if workers > 1:
+            pool = WorkerPool(
+                routes,
+                host,
+                port,
+                mode,
+                workers,
+                executor=executor,
+                limiter=limiter,
+                cache_size=cache_size,
+                groups=groups,
+                interface=interface,
+                leisure=leisure,
+            )
+            pool.start()
+            pool.wait()
+        else:
+            server = CoAPServer(
+                routes,
+                host,
+                port,
+                mode,
+                executor=executor,
+                limiter=limiter,
+                cache_size=cache_size,
+                groups=groups,
+                interface=interface,
+                leisure=leisure,
+            )
+            server.start()
+    finally:
+        if store is not None:
+            store.close()
+        if manager is not None:
+            manager.shutdown()
+
+
+@app.command()
+def bench(
+    host: str = typer.Option("127.0.0.1", help="The host of the server"),
+    port: int = typer.Option(5683, help="The port of the server"),
+    mode: ServerMode = typer.Option(
+        ServerMode.SYNC, help="I/O model of the benchmarked server"
+    ),
+    workers: int = typer.Option(
+        1, help="Number of worker processes of the benchmarked server"
+    ),
+    external: bool = typer.Option(
+        False, help="Benchmark an already running server instead"
+    ),
+    duration: float = typer.Option(10.0, help="Duration in seconds"),
+    concurrency: int = typer.Option(16, help="Number of parallel clients"),
+    mix: str = typer.Option(DEFAULT_MIX, help="Weights of request methods"),
+    payload_size: int = typer.Option(
+        64, help="Size of POST and PUT payloads in bytes"
+    ),
+    sensors: int = typer.Option(100, help="Number of sensors to query"),
+):
+    """
+    Benchmark the CoAP server with a mix of requests.
+    """
+
+    configure_logging(logging.WARNING)
+    try:
+        request_mix = parse_mix(mix)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+    generator = LoadGenerator(
+        host, port, request_mix, concurrency, payload_size, sensors
+    )
+    report = run_benchmark(
+        generator, duration, mode, workers, start_server=not external
+    )
+    typer.echo(str(report))
 
 
 app(prog_name="coap-server")
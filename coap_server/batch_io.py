@@ -0,0 +1,262 @@
+"""
+Module providing batched datagram I/O for `ServerMode.BATCH`.
+
+`BatchIO` drains all the datagrams queued on a non-blocking socket into
+a ring of preallocated buffers with `recvfrom_into()`, and is available on
+every platform. On Linux, `MultiMessageIO` receives and sends a whole batch
+with a single `recvmmsg()` / `sendmmsg()` call (through ctypes), so the
+number of syscalls doesn't grow with the number of datagrams.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import struct
+import sys
+
+from coap_server.utils.constants import MAX_MESSAGE_SIZE, Address
+
+# Datagrams received and sent at most with a single call
+BATCH_SIZE = 64
+
+# Size of struct sockaddr_storage
+SOCKADDR_SIZE = 128
+
+SOCKADDR_IN = struct.Struct("=H2s4s")
+SOCKADDR_IN6 = struct.Struct("=H2s4s16sI")
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+def load_libc() -> ctypes.CDLL | None:
+    """Returns the C library if it provides recvmmsg() and sendmmsg()."""
+
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+
+    if not hasattr(libc, "recvmmsg") or not hasattr(libc, "sendmmsg"):
+        return None
+    return libc
+
+
+def decode_sockaddr(data: bytes | memoryview) -> Address:
+    """Converts struct sockaddr_in(6) into the address used by `socket`."""
+
+    family = SOCKADDR_IN.unpack_from(data)[0]
+    if family == socket.AF_INET:
+        _, port, host = SOCKADDR_IN.unpack_from(data)
+        return socket.inet_ntop(socket.AF_INET, host), int.from_bytes(
+            port, "big"
+        )
+
+    _, port, flowinfo, host, scope_id = SOCKADDR_IN6.unpack_from(data)
+    return (
+        socket.inet_ntop(socket.AF_INET6, host),
+        int.from_bytes(port, "big"),
+        int.from_bytes(flowinfo, "big"),
+        scope_id,
+    )
+
+
+def encode_sockaddr(family: int, addr: Address) -> bytes:
+    """Counterpart of `decode_sockaddr()`."""
+
+    port = addr[1].to_bytes(2, "big")
+    if family == socket.AF_INET:
+        return SOCKADDR_IN.pack(
+            family, port, socket.inet_pton(family, addr[0])
+        )
+
+    flowinfo = addr[2] if len(addr) > 2 else 0
+    scope_id = addr[3] if len(addr) > 3 else 0
+    return SOCKADDR_IN6.pack(
+        family,
+        port,
+        flowinfo.to_bytes(4, "big"),
+        socket.inet_pton(family, addr[0]),
+        scope_id,
+    )
+
+
+class BatchIO:
+    """
+    Receives and sends datagrams in batches, one syscall per datagram.
+
+    The socket is switched to non-blocking mode. Received datagrams are
+    copied out of the ring of buffers, since parsed requests keep views into
+    the data and may outlive the batch (e.g. registered observers).
+    """
+
+    def __init__(self, sock: socket.socket, batch_size: int = BATCH_SIZE):
+        self.sock = sock
+        self.batch_size = batch_size
+        self.buffers = [bytearray(MAX_MESSAGE_SIZE) for _ in range(batch_size)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        sock.setblocking(False)
+
+    def wait(self, timeout: float) -> bool:
+        """Waits until datagrams can be received, returns False on timeout."""
+
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        return bool(readable)
+
+    def receive(self) -> list[tuple[bytes, Address]]:
+        """Returns the queued datagrams, at most `batch_size` of them."""
+
+        datagrams = []
+        for view in self.views:
+            try:
+                size, addr = self.sock.recvfrom_into(view)
+            except BlockingIOError:
+                break
+            datagrams.append((bytes(view[:size]), addr))
+        return datagrams
+
+    def send(self, datagrams: list[tuple[bytes, Address]]):
+        for data, addr in datagrams:
+            self.send_one(data, addr)
+
+    def send_one(self, data: bytes, addr: Address):
+        while True:
+            try:
+                self.sock.sendto(data, addr)
+                return
+            except BlockingIOError:
+                # send buffer is full, wait until it drains
+                select.select([], [self.sock], [], 1.0)
+
+
+class MultiMessageIO(BatchIO):
+    """`BatchIO` using recvmmsg() and sendmmsg() (Linux only)."""
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        libc: ctypes.CDLL,
+        batch_size: int = BATCH_SIZE,
+    ):
+        super().__init__(sock, batch_size)
+        self.libc = libc
+        self.names = ctypes.create_string_buffer(SOCKADDR_SIZE * batch_size)
+        self.iovecs = (iovec * batch_size)()
+        self.messages = (mmsghdr * batch_size)()
+
+        # ctypes views of the ring buffers, the datagrams are received into
+        self.c_buffers = [
+            (ctypes.c_char * len(buffer)).from_buffer(buffer)
+            for buffer in self.buffers
+        ]
+
+        names = ctypes.addressof(self.names)
+        for i, c_buffer in enumerate(self.c_buffers):
+            self.iovecs[i].iov_base = ctypes.addressof(c_buffer)
+            self.iovecs[i].iov_len = len(c_buffer)
+            header = self.messages[i].msg_hdr
+            header.msg_name = names + i * SOCKADDR_SIZE
+            header.msg_iov = ctypes.pointer(self.iovecs[i])
+            header.msg_iovlen = 1
+
+        # separate headers for sending, pointing to the outgoing data
+        self.out_iovecs = (iovec * batch_size)()
+        self.out_messages = (mmsghdr * batch_size)()
+        for i in range(batch_size):
+            self.out_messages[i].msg_hdr.msg_iov = ctypes.pointer(
+                self.out_iovecs[i]
+            )
+            self.out_messages[i].msg_hdr.msg_iovlen = 1
+
+    def receive(self) -> list[tuple[bytes, Address]]:
+        for message in self.messages:
+            message.msg_hdr.msg_namelen = SOCKADDR_SIZE
+
+        count = self.libc.recvmmsg(
+            self.sock.fileno(),
+            self.messages,
+            self.batch_size,
+            socket.MSG_DONTWAIT,
+            None,
+        )
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(error, os.strerror(error))
+
+        names = memoryview(self.names)
+        return [
+            (
+                bytes(self.views[i][: self.messages[i].msg_len]),
+                decode_sockaddr(
+                    names[i * SOCKADDR_SIZE : (i + 1) * SOCKADDR_SIZE]
+                ),
+            )
+            for i in range(count)
+        ]
+
+    def send(self, datagrams: list[tuple[bytes, Address]]):
+        family = self.sock.family
+        for start in range(0, len(datagrams), self.batch_size):
+            batch = datagrams[start : start + self.batch_size]
+            # keep references, so the buffers aren't freed before the call
+            names = [encode_sockaddr(family, addr) for _, addr in batch]
+            for i, (data, _) in enumerate(batch):
+                self.out_iovecs[i].iov_base = ctypes.cast(
+                    ctypes.c_char_p(data), ctypes.c_void_p
+                )
+                self.out_iovecs[i].iov_len = len(data)
+                header = self.out_messages[i].msg_hdr
+                header.msg_name = ctypes.cast(
+                    ctypes.c_char_p(names[i]), ctypes.c_void_p
+                )
+                header.msg_namelen = len(names[i])
+
+            sent = self.libc.sendmmsg(
+                self.sock.fileno(),
+                self.out_messages,
+                len(batch),
+                socket.MSG_DONTWAIT,
+            )
+            # the rest (e.g. when the send buffer is full) is sent one by one
+            for data, addr in batch[max(sent, 0) :]:
+                self.send_one(data, addr)
+
+
+def batch_io(sock: socket.socket, batch_size: int = BATCH_SIZE) -> BatchIO:
+    """Returns the most efficient batched I/O available on the platform."""
+
+    libc = load_libc()
+    if libc is None:
+        return BatchIO(sock, batch_size)
+    return MultiMessageIO(sock, libc, batch_size)
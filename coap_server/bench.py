@@ -0,0 +1,308 @@
+"""
+Module providing the load generator used by `coap-server bench`.
+
+`LoadGenerator` runs `concurrency` closed-loop clients on an asyncio event
+loop. Every client sends a request, waits for the response (or `timeout`)
+and sends the next one, picking the method according to the request mix.
+The results are collected into a `Report` with throughput, latency
+percentiles and loss rate.
+
+Message IDs of a client wrap after 65536 requests, after which the server
+would answer from its deduplication cache, so long runs should use more
+clients.
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import MutableMapping
+
+from coap_server.resources.base_resource import BaseResource
+from coap_server.resources.sensors import SensorsResource
+from coap_server.server import ServerMode
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    CoapType,
+    Options,
+)
+from coap_server.utils.parser import (
+    CODES_BY_BYTE,
+    encode_message,
+    parse_message,
+    uri_options,
+)
+from coap_server.workers import SharedObjectsManager, WorkerPool
+
+DEFAULT_MIX = "GET=70,POST=10,PUT=15,DELETE=5"
+
+METHODS = {
+    "GET": CoapCode.GET,
+    "POST": CoapCode.POST,
+    "PUT": CoapCode.PUT,
+    "DELETE": CoapCode.DELETE,
+}
+
+
+def parse_mix(text: str) -> dict[CoapCode, int]:
+    """Parses a request mix such as `GET=70,PUT=30` into method weights."""
+
+    mix = {}
+    for item in text.split(","):
+        method, _, weight = item.partition("=")
+        if method.strip().upper() not in METHODS or not weight.isdigit():
+            raise ValueError(f"Invalid request mix: {text}")
+        mix[METHODS[method.strip().upper()]] = int(weight)
+
+    if not any(mix.values()):
+        raise ValueError(f"Invalid request mix: {text}")
+    return mix
+
+
+def make_sensors(
+    count: int,
+) -> MutableMapping[int, MutableMapping[str, str | int]]:
+    """Sensors with IDs from 1 to `count` targeted by the requests."""
+
+    return {
+        i: {"name": f"Sensor {i}", "temperature": 20}
+        for i in range(1, count + 1)
+    }
+
+
+@dataclass
+class Report:
+    """Results of a benchmark run."""
+
+    duration: float
+    sent: int = 0
+    # latencies of the answered requests, in seconds
+    latencies: list[float] = field(default_factory=list)
+    codes: Counter = field(default_factory=Counter)
+
+    @property
+    def received(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def throughput(self) -> float:
+        return self.received / self.duration if self.duration else 0.0
+
+    @property
+    def loss_rate(self) -> float:
+        return 1 - self.received / self.sent if self.sent else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Returns the q-th quantile (0-1) of latencies, in seconds."""
+
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def __str__(self) -> str:
+        codes = ", ".join(
+            f"{code.value}: {count}"
+            for code, count in sorted(
+                self.codes.items(), key=lambda item: item[0].value
+            )
+        )
+        return "\n".join(
+            [
+                f"Requests:   {self.sent} sent, {self.received} answered "
+                f"in {self.duration:.1f} s",
+                f"Throughput: {self.throughput:.0f} req/s",
+                f"Latency:    p50 {self.percentile(0.5) * 1e3:.2f} ms, "
+                f"p99 {self.percentile(0.99) * 1e3:.2f} ms, "
+                f"p99.9 {self.percentile(0.999) * 1e3:.2f} ms",
+                f"Loss rate:  {self.loss_rate:.2%}",
+                f"Responses:  {codes}",
+            ]
+        )
+
+
+class ClientProtocol(asyncio.DatagramProtocol):
+    """Matches responses to the pending requests by token."""
+
+    def __init__(self):
+        self.pending: dict[bytes, asyncio.Future] = {}
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 4:
+            return
+        token = data[4 : 4 + (data[0] & 0x0F)]
+        future = self.pending.pop(token, None)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+
+class LoadGenerator:
+    """
+    Sends requests to a CoAP server with the given mix and concurrency.
+
+    GET and PUT requests target `/sensors/{id}` with IDs between 1 and
+    `sensors`, so the data set doesn't shrink during the run. POST requests
+    create new sensors and DELETE requests remove them in the order of
+    creation, by the IDs from the Location-Path of the responses. Until
+    there is a sensor to remove, a GET request is sent instead of DELETE.
+    Payloads of POST and PUT requests are padded to about `payload_size`
+    bytes.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 5683,
+        mix: dict[CoapCode, int] | None = None,
+        concurrency: int = 16,
+        payload_size: int = 64,
+        sensors: int = 100,
+        timeout: float = 1.0,
+    ):
+        self.host = host
+        self.port = port
+        self.mix = mix or parse_mix(DEFAULT_MIX)
+        self.concurrency = concurrency
+        self.sensors = sensors
+        self.timeout = timeout
+        # IDs of the created sensors which haven't been deleted yet
+        self.created: deque[int] = deque()
+
+        padding = payload_size - len(self.sensor(""))
+        self.payload = self.sensor("x" * max(0, padding))
+
+    def sensor(self, name: str) -> bytes:
+        return json.dumps({"name": name, "temperature": 20}).encode()
+
+    def make_request(self, code: CoapCode, mid: int, token: bytes) -> bytes:
+        if code == CoapCode.DELETE and not self.created:
+            code = CoapCode.GET
+
+        if code == CoapCode.POST:
+            uri, payload = "/sensors", self.payload
+        elif code == CoapCode.DELETE:
+            uri, payload = f"/sensors/{self.created.popleft()}", b""
+        else:
+            sensor_id = random.randint(1, self.sensors)
+            uri = f"/sensors/{sensor_id}"
+            payload = self.payload if code == CoapCode.PUT else b""
+
+        return encode_message(
+            CoapMessage(
+                header_version=1,
+                header_type=CoapType.CON,
+                header_token_length=len(token),
+                header_code=code,
+                header_mid=mid,
+                token=token,
+                options=Options(uri_options(uri)),
+                payload=payload,
+            )
+        )
+
+    async def run(self, duration: float) -> Report:
+        """Runs the clients for `duration` seconds and returns the report."""
+
+        report = Report(duration)
+        start = time.monotonic()
+        deadline = start + duration
+        await asyncio.gather(
+            *(self.client(deadline, report) for _ in range(self.concurrency))
+        )
+        # includes waiting for the last responses
+        report.duration = time.monotonic() - start
+        return report
+
+    async def client(self, deadline: float, report: Report):
+        """Closed-loop client sending requests until the deadline."""
+
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            ClientProtocol, remote_addr=(self.host, self.port)
+        )
+        codes = list(self.mix)
+        weights = list(self.mix.values())
+
+        try:
+            mid = random.randrange(0x10000)
+            sent = 0
+            while time.monotonic() < deadline:
+                mid = (mid + 1) & 0xFFFF
+                # every client has its own socket, so tokens may repeat
+                token = sent.to_bytes(4, "big")
+                sent += 1
+
+                code = random.choices(codes, weights)[0]
+                future = loop.create_future()
+                protocol.pending[token] = future
+
+                start = time.perf_counter()
+                transport.sendto(self.make_request(code, mid, token))
+                report.sent += 1
+                try:
+                    data = await asyncio.wait_for(future, self.timeout)
+                except asyncio.TimeoutError:
+                    protocol.pending.pop(token, None)
+                    continue
+
+                report.latencies.append(time.perf_counter() - start)
+                response_code = CODES_BY_BYTE.get(data[1], CoapCode.EMPTY)
+                report.codes[response_code] += 1
+                if response_code == CoapCode.CREATED:
+                    self.track(data)
+        finally:
+            transport.close()
+
+    def track(self, data: bytes):
+        """Remembers the ID of the sensor created by a POST request."""
+
+        location = parse_message(data).options.all(CoapOption.LOCATION_PATH)
+        if location and bytes(location[-1]).isdigit():
+            self.created.append(int(bytes(location[-1])))
+
+
+def run_benchmark(
+    generator: LoadGenerator,
+    duration: float,
+    mode: ServerMode = ServerMode.SYNC,
+    workers: int = 1,
+    start_server: bool = True,
+) -> Report:
+    """
+    Runs the load generator against a server started in other processes.
+
+    With `start_server` set to False, an already running server is used.
+    """
+
+    if not start_server:
+        return asyncio.run(generator.run(duration))
+
+    objects = make_sensors(generator.sensors)
+    history = None
+    manager = None
+    if workers > 1:
+        manager = SharedObjectsManager()
+        manager.start()
+        objects = manager.SharedObjects(objects)  # type: ignore
+        history = manager.History()  # type: ignore
+
+    routes: MutableMapping[str, BaseResource] = {
+        "sensors": SensorsResource(objects, history)
+    }
+    pool = WorkerPool(
+        routes, generator.host, generator.port, mode, max(workers, 1)
+    )
+    # the load generator shouldn't compete with the server for the GIL, so
+    # even a single server runs in a separate process
+    pool.start()
+
+    try:
+        return asyncio.run(generator.run(duration))
+    finally:
+        pool.shutdown()
+        if manager is not None:
+            manager.shutdown()
@@ -0,0 +1,402 @@
+"""
+Module providing block-wise transfers of CoAP (RFC 7959).
+
+Responses whose payload doesn't fit into a single block are split using the
+Block2 option. The full representation is kept per client and URI, so it is
+rendered only once and the following blocks are served from the cache.
+Requests uploaded block by block with the Block1 option are assembled before
+being passed to the resource.
+
+Responses with a `stream` are never rendered as a whole: only the requested
+block is encoded, and the position in the stream is kept per client and URI,
+so a client fetching the blocks in order causes the payload to be encoded
+only once.
+"""
+
+import json
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass, field, replace
+from typing import Iterator, TypeVar
+
+from coap_server.utils.constants import (
+    Address,
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    OptionValue,
+)
+from coap_server.utils.construct_response import construct_response
+from coap_server.utils.parser import decode_uint, encode_uint
+
+# Largest block size exponent (block size is 2 ** (szx + 4) bytes), 1024 B
+MAX_SZX = 6
+
+# Largest request payload assembled from Block1 blocks
+MAX_BODY_SIZE = 64 * 1024
+
+# Transfers remembered at most, and for how long (in seconds)
+MAX_TRANSFERS = 1000
+TRANSFER_LIFETIME = 30.0
+
+
+def block_size(szx: int) -> int:
+    return 1 << (szx + 4)
+
+
+def encode_block(num: int, more: bool, szx: int) -> bytes:
+    """Encode the value of Block1 or Block2 option."""
+
+    return encode_uint(num << 4 | more << 3 | szx)
+
+
+def decode_block(value: bytes | memoryview) -> tuple[int, bool, int]:
+    """Decode the value of Block1 or Block2 option into (num, more, szx)."""
+
+    block = decode_uint(value)
+    return block >> 4, bool(block & 0x08), block & 0x07
+
+
+@dataclass
+class Upload:
+    """Request payload assembled from Block1 blocks received so far."""
+
+    expires_at: float
+    payload: bytearray = field(default_factory=bytearray)
+
+
+@dataclass
+class Download:
+    """Full response whose blocks are requested with Block2 option."""
+
+    expires_at: float
+    response: CoapMessage
+
+
+@dataclass
+class Stream:
+    """Position in a streamed response whose blocks are requested."""
+
+    expires_at: float
+    chunks: Iterator[bytes]
+    # offset of `buffer` in the full payload
+    offset: int = 0
+    buffer: bytearray = field(default_factory=bytearray)
+    done: bool = False
+
+    def read(self, start: int, size: int) -> tuple[bytes, bool]:
+        """Returns `size` bytes from `start` and whether more bytes follow."""
+
+        while True:
+            # bytes before the block aren't needed anymore
+            skip = min(start - self.offset, len(self.buffer))
+            if skip > 0:
+                del self.buffer[:skip]
+                self.offset += skip
+            if self.done or self.offset + len(self.buffer) > start + size:
+                break
+
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.done = True
+            else:
+                self.buffer += chunk
+
+        begin = start - self.offset
+        block = bytes(self.buffer[begin : begin + size])
+        return block, self.offset + len(self.buffer) > start + size
+
+
+Transfer = TypeVar("Transfer", Upload, Download, Stream)
+
+
+class BlockwiseTransfers:
+    """
+    Keeps the state of block-wise transfers of all the clients.
+
+    Transfers are keyed on the client address and URI, since the blocks of
+    a single transfer may be requested with different tokens. At most
+    `max_transfers` of each kind are kept; the oldest ones are evicted first.
+    """
+
+    def __init__(
+        self,
+        max_transfers: int = MAX_TRANSFERS,
+        lifetime: float = TRANSFER_LIFETIME,
+        max_body_size: int = MAX_BODY_SIZE,
+    ):
+        self.max_transfers = max_transfers
+        self.lifetime = lifetime
+        self.max_body_size = max_body_size
+        self.uploads: OrderedDict[tuple[Address, str], Upload] = OrderedDict()
+        self.downloads: OrderedDict[tuple[Address, str], Download] = (
+            OrderedDict()
+        )
+        self.streams: OrderedDict[tuple[Address, str], Stream] = OrderedDict()
+
+    def receive(
+        self, request: CoapMessage, remote: Address | None
+    ) -> tuple[CoapMessage | None, CoapMessage | None]:
+        """
+        Handles the block options of a request.
+
+        Returns either the (possibly assembled) request which should be
+        passed to the resource, or the response to send back right away.
+        """
+
+        if remote is None:
+            return request, None
+
+        block1 = request.options.get(CoapOption.BLOCK1)
+        block2 = request.options.get(CoapOption.BLOCK2)
+        if block1 is None and block2 is None:
+            return request, None
+
+        try:
+            # transfers are kept by the URI
+            request.uri
+        except UnicodeDecodeError:
+            return None, self.error(
+                request, CoapCode.BAD_REQUEST, "Invalid URI"
+            )
+
+        if block1 is not None:
+            return self.upload(request, remote, *decode_block(block1))
+
+        if block2 is not None and request.header_code == CoapCode.GET:
+            num, _, szx = decode_block(block2)
+            download = self.downloads.get((remote, request.uri))
+            if (
+                num > 0
+                and download is not None
+                and download.expires_at > time.monotonic()
+            ):
+                return None, self.block(
+                    request, download.response, num, min(szx, MAX_SZX)
+                )
+
+        return request, None
+
+    def upload(
+        self,
+        request: CoapMessage,
+        remote: Address,
+        num: int,
+        more: bool,
+        szx: int,
+    ) -> tuple[CoapMessage | None, CoapMessage | None]:
+        """Collects a Block1 block and returns the assembled request."""
+
+        key = (remote, request.uri)
+        now = time.monotonic()
+        size = block_size(szx)
+
+        upload: Upload | None
+        if num == 0:
+            self.uploads.pop(key, None)
+            upload = self.remember(
+                self.uploads, key, Upload(now + self.lifetime)
+            )
+        else:
+            upload = self.uploads.get(key)
+
+        if (
+            upload is None
+            or upload.expires_at <= now
+            or len(upload.payload) != num * size
+        ):
+            # blocks are missing or out of order
+            self.uploads.pop(key, None)
+            return None, self.error(
+                request,
+                CoapCode.REQUEST_ENTITY_INCOMPLETE,
+                "Request body incomplete",
+            )
+
+        upload.payload += request.payload
+        upload.expires_at = now + self.lifetime
+        if len(upload.payload) > self.max_body_size:
+            del self.uploads[key]
+            return None, self.error(
+                request,
+                CoapCode.REQUEST_ENTITY_TOO_LARGE,
+                "Request body too large",
+                {CoapOption.SIZE1: encode_uint(self.max_body_size)},
+            )
+
+        if more:
+            return None, construct_response(
+                request,
+                CoapCode.CONTINUE,
+                b"",
+                options={CoapOption.BLOCK1: encode_block(num, True, szx)},
+            )
+
+        del self.uploads[key]
+        return replace(
+            request,
+            options=request.options.without(CoapOption.BLOCK1),
+            payload=bytes(upload.payload),
+        ), None
+
+    def respond(
+        self,
+        request: CoapMessage,
+        response: CoapMessage,
+        remote: Address | None,
+    ) -> CoapMessage:
+        """
+        Adds the block options to a response of the resource.
+
+        Payloads larger than the block size requested by the client (or the
+        largest one supported) are split, and the first requested block is
+        returned. The remaining ones are served by `receive()`.
+        """
+
+        block1 = request.options.get(CoapOption.BLOCK1)
+        if block1 is not None:
+            response = replace(
+                response,
+                options=response.options.updated({CoapOption.BLOCK1: block1}),
+            )
+
+        num, szx = 0, MAX_SZX
+        block2 = request.options.get(CoapOption.BLOCK2)
+        if block2 is not None:
+            num, _, szx = decode_block(block2)
+            szx = min(szx, MAX_SZX)
+
+        if response.stream is not None:
+            if remote is not None:
+                return self.stream(request, response, remote, num, szx)
+            # without a client to keep the position for, render it whole
+            response = replace(
+                response,
+                payload=b"".join(response.stream()),
+                stream=None,
+            )
+
+        if (
+            block2 is None and len(response.payload) <= block_size(szx)
+        ) or not response.header_code.value.startswith("2."):
+            return response
+
+        if remote is not None and request.header_code == CoapCode.GET:
+            key = (remote, request.uri)
+            self.downloads.pop(key, None)
+            self.remember(
+                self.downloads,
+                key,
+                Download(time.monotonic() + self.lifetime, response),
+            )
+
+        return self.block(request, response, num, szx)
+
+    def stream(
+        self,
+        request: CoapMessage,
+        response: CoapMessage,
+        remote: Address,
+        num: int,
+        szx: int,
+    ) -> CoapMessage:
+        """
+        Returns a single block of a streamed response.
+
+        The stream is restarted if the client asks for an earlier block than
+        the last one. Responses which fit into a single block are sent
+        without the Block2 option.
+        """
+
+        assert response.stream is not None
+        key = (remote, request.uri)
+        now = time.monotonic()
+        size = block_size(szx)
+        start = num * size
+
+        self.downloads.pop(key, None)
+        stream = self.streams.get(key)
+        if stream is None or stream.expires_at <= now or start < stream.offset:
+            self.streams.pop(key, None)
+            stream = self.remember(
+                self.streams,
+                key,
+                Stream(now + self.lifetime, response.stream()),
+            )
+        stream.expires_at = now + self.lifetime
+
+        payload, more = stream.read(start, size)
+        if not more:
+            del self.streams[key]
+        if not payload and num > 0:
+            return self.error(
+                request, CoapCode.BAD_OPTION, f"Block {num} out of range"
+            )
+
+        options = response.options
+        if num > 0 or more:
+            options = options.updated(
+                {CoapOption.BLOCK2: encode_block(num, more, szx)}
+            )
+        return replace(response, options=options, payload=payload, stream=None)
+
+    def block(
+        self, request: CoapMessage, response: CoapMessage, num: int, szx: int
+    ) -> CoapMessage:
+        """Returns a single block of the full response."""
+
+        size = block_size(szx)
+        start = num * size
+        if start >= len(response.payload) and num > 0:
+            return self.error(
+                request, CoapCode.BAD_OPTION, f"Block {num} out of range"
+            )
+
+        payload = response.payload[start : start + size]
+        more = start + size < len(response.payload)
+        options = {CoapOption.BLOCK2: encode_block(num, more, szx)}
+        if num == 0:
+            options[CoapOption.SIZE2] = encode_uint(len(response.payload))
+
+        return replace(
+            response,
+            header_type=request.header_type,
+            header_token_length=request.header_token_length,
+            header_mid=request.header_mid,
+            token=request.token,
+            options=response.options.updated(options),
+            payload=payload,
+        )
+
+    def remember(
+        self,
+        transfers: "OrderedDict[tuple[Address, str], Transfer]",
+        key: tuple[Address, str],
+        transfer: Transfer,
+    ) -> Transfer:
+        """Adds a transfer, evicting expired ones and the oldest ones."""
+
+        now = time.monotonic()
+        while transfers:
+            oldest = transfers[next(iter(transfers))]
+            if oldest.expires_at > now and len(transfers) < self.max_transfers:
+                break
+            transfers.popitem(last=False)
+
+        transfers[key] = transfer
+        return transfer
+
+    def error(
+        self,
+        request: CoapMessage,
+        code: CoapCode,
+        message: str,
+        options: Mapping[CoapOption, OptionValue] | None = None,
+    ) -> CoapMessage:
+        return construct_response(
+            request,
+            code,
+            json.dumps({"error": message}).encode("ascii"),
+            options=options,
+        )
@@ -0,0 +1,229 @@
+"""
+Module providing the cache of encoded responses to GET requests.
+
+Responses are cached by the URI and the Accept option of the request, so
+repeated reads of the same URI skip routing, the resource and encoding of
+the response. A hit only patches the message ID and token of the request
+into the cached bytes.
+
+Only representations returned by `BaseResource.represent()` (2.05 Content
+responses with an ETag) are cached, since their resources report their
+changes. They are kept for Max-Age seconds (60 if the response has no such
+option, RFC 7252 section 5.10.5) unless the resource reports a change of
+their path first, or the version of its objects changes (e.g. when they are
+shared with other processes). Requests with other options than the URI and
+Accept ones (e.g. ETag, Observe or Block2) bypass the cache.
+
+The cache holds at most `max_size` bytes of responses, the least recently
+used ones are evicted first.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+from coap_server.observe import observed_path
+from coap_server.resources.base_resource import BaseResource
+from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
+
+# Bytes of encoded responses kept at most
+CACHE_SIZE = 1 << 20
+
+# Max-Age of responses without the option, in seconds
+DEFAULT_MAX_AGE = 60
+
+# Options which may be present in requests answered from the cache
+KEY_OPTIONS = frozenset(
+    option.value
+    for option in (
+        CoapOption.URI_HOST,
+        CoapOption.URI_PORT,
+        CoapOption.URI_PATH,
+        CoapOption.URI_QUERY,
+        CoapOption.ACCEPT,
+    )
+)
+
+# URI and the Accept option of the request
+CacheKey = tuple[str, bytes | None]
+
+
+@dataclass(eq=False)
+class CachedResponse:
+    """Encoded response, without the header and token of the request."""
+
+    code: int
+    tail: bytes
+    expires_at: float
+    # route of the request, for the metrics
+    pattern: str
+    resource: BaseResource
+    # version of the objects of the resource when the response was rendered
+    version: int
+
+
+@dataclass(eq=False)
+class CacheMiss:
+    """Request not found in the cache, see `ResponseCache.miss()`."""
+
+    key: CacheKey
+    generation: int
+    pattern: str
+    resource: BaseResource
+    version: int
+
+
+def cache_key(request: CoapMessage) -> CacheKey | None:
+    """Returns the key of the request, None if it can't be cached."""
+
+    if request.header_code != CoapCode.GET:
+        return None
+    for number in request.options.index:
+        if number not in KEY_OPTIONS:
+            return None
+
+    try:
+        uri = request.uri
+    except UnicodeDecodeError:
+        # answered with 4.00 Bad Request by the handler
+        return None
+    accept = request.options.get(CoapOption.ACCEPT)
+    return uri, None if accept is None else bytes(accept)
+
+
+class ResponseCache:
+    """
+    Encoded responses by the URI and Accept option, see the module.
+
+    Resources may report changes from threads of an executor, so the cache
+    is guarded by a lock.
+    """
+
+    def __init__(
+        self,
+        max_size: int = CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.clock = clock
+        self.entries: OrderedDict[CacheKey, CachedResponse] = OrderedDict()
+        self.keys_by_path: dict[str, set[CacheKey]] = {}
+        self.size = 0
+        # incremented by every change, so responses rendered before it
+        # aren't cached afterwards
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: CacheKey) -> CachedResponse | None:
+        """Returns the cached response, unless it has expired."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= self.clock():
+                self.remove_locked(key)
+                return None
+            self.entries.move_to_end(key)
+
+        # may be a call to another process, so it's done without the lock
+        if entry.resource.version() != entry.version:
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    self.remove_locked(key)
+            return None
+        return entry
+
+    def miss(
+        self, key: CacheKey, pattern: str, resource: BaseResource
+    ) -> CacheMiss:
+        """Remembers the state before the response to the key is rendered."""
+
+        return CacheMiss(
+            key, self.generation, pattern, resource, resource.version()
+        )
+
+    def put(self, miss: CacheMiss, response: CoapMessage, encoded: bytes):
+        """Caches the encoded response, if it's a cacheable one."""
+
+        options = response.options
+        if (
+            response.header_code != CoapCode.CONTENT
+            or CoapOption.ETAG not in options
+            or CoapOption.BLOCK2 in options
+            or CoapOption.OBSERVE in options
+        ):
+            return
+
+        max_age = options.uint(CoapOption.MAX_AGE, DEFAULT_MAX_AGE)
+        tail = encoded[4 + len(response.token) :]
+        if max_age == 0 or len(tail) > self.max_size:
+            return
+
+        entry = CachedResponse(
+            encoded[1],
+            tail,
+            self.clock() + max_age,
+            miss.pattern,
+            miss.resource,
+            miss.version,
+        )
+        with self.lock:
+            if miss.generation != self.generation:
+                # the objects have changed while the response was rendered
+                return
+
+            self.remove_locked(miss.key)
+            self.entries[miss.key] = entry
+            self.keys_by_path.setdefault(
+                observed_path(miss.key[0]), set()
+            ).add(miss.key)
+            self.size += len(tail)
+            while self.size > self.max_size:
+                self.remove_locked(next(iter(self.entries)))
+
+    def changed(self, *paths: str):
+        """Drops the responses of the changed paths."""
+
+        with self.lock:
+            self.generation += 1
+            for path in paths:
+                keys = self.keys_by_path.get(observed_path(path), ())
+                for key in list(keys):
+                    self.remove_locked(key)
+
+    def remove_locked(self, key: CacheKey):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        self.size -= len(entry.tail)
+        path = observed_path(key[0])
+        keys = self.keys_by_path[path]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_path[path]
+
+
+def patch(data: bytes, code: int, tail: bytes) -> bytes:
+    """
+    Returns an encoded response to the request encoded in `data`.
+
+    `code` and `tail` (options and payload) are taken from a response to
+    an identical request, e.g. a cached one.
+    """
+
+    token_end = 4 + (data[0] & 0x0F)
+    # the type and token length are the same as in the request
+    return b"".join(
+        (
+            bytes((data[0], code, data[2], data[3])),
+            data[4:token_end],
+            tail,
+        )
+    )
@@ -0,0 +1,172 @@
+"""
+Module providing the executor of blocking resource methods.
+
+Without an executor, resource methods run inline in the receive loop, so
+a method blocking on I/O stops the server from reading the socket, and
+datagrams are dropped once the kernel buffer is full. `BoundedExecutor`
+runs them in a pool of threads instead. The server uses it in the asyncio
+mode, whose event loop keeps receiving while the methods run.
+
+Calls wait for a free thread in a queue of limited size, and every request
+has a deadline counted from its arrival. When the queue is full or the
+deadline passes, `ServiceUnavailableError` is raised, so the server sheds
+load with 5.03 Service Unavailable instead of buffering without limit.
+Calls whose deadline passed while they were queued are not run at all.
+"""
+
+import asyncio
+import math
+import queue
+import threading
+import time
+from concurrent import futures
+from typing import Any, Callable
+
+from coap_server.logger import logger
+from coap_server.utils.exceptions import ServiceUnavailableError
+
+# Threads running resource methods
+THREADS = 8
+
+# Calls waiting for a free thread at most
+QUEUE_SIZE = 64
+
+# Seconds since the arrival of a request until it has to be answered
+DEADLINE = 5.0
+
+Call = tuple[futures.Future, Callable[..., Any], tuple[Any, ...]]
+
+
+class BoundedExecutor:
+    """
+    Pool of `threads` threads with a queue of at most `queue_size` calls.
+
+    Threads are started by the first call, so an executor created before
+    the worker processes are forked runs its threads in the worker.
+    """
+
+    def __init__(
+        self,
+        threads: int = THREADS,
+        queue_size: int = QUEUE_SIZE,
+        deadline: float = DEADLINE,
+    ):
+        self.size = threads
+        self.queue_size = queue_size
+        self.deadline = deadline
+        # unbounded, so that stopping the threads never blocks; the size is
+        # checked by `submit()`
+        self.calls: queue.SimpleQueue[Call | None] = queue.SimpleQueue()
+        # calls queued or running
+        self.pending = 0
+        self.threads: list[threading.Thread] = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.size:
+                thread = threading.Thread(
+                    target=self.work,
+                    name=f"resource-{len(self.threads)}",
+                    daemon=True,
+                )
+                thread.start()
+                self.threads.append(thread)
+
+    def work(self):
+        while True:
+            call = self.calls.get()
+            if call is None:
+                return
+
+            future, function, args = call
+            if not future.set_running_or_notify_cancel():
+                # the deadline has passed while the call was queued
+                continue
+            try:
+                result = function(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def finished(self, future: futures.Future):
+        # called once the call is done or cancelled, so it no longer
+        # occupies the queue even before a thread skips it
+        with self.lock:
+            self.pending -= 1
+
+    def rejected(self, reason: str) -> ServiceUnavailableError:
+        # the queue is drained within a deadline at the latest
+        return ServiceUnavailableError(reason, math.ceil(self.deadline))
+
+    def submit(self, function: Callable[..., Any], *args) -> futures.Future:
+        """Queues the call, raises ServiceUnavailableError if it's full."""
+
+        if len(self.threads) < self.size:
+            self.start()
+
+        with self.lock:
+            if self.pending >= self.size + self.queue_size:
+                logger.warning("Executor queue full, rejecting request")
+                raise self.rejected("Too many pending requests")
+            self.pending += 1
+
+        future: futures.Future = futures.Future()
+        future.add_done_callback(self.finished)
+        self.calls.put((future, function, args))
+        return future
+
+    def remaining(self, start: float | None) -> float:
+        """Seconds left until the deadline of a request arrived at `start`."""
+
+        if start is None:
+            return self.deadline
+        return max(0.0, start + self.deadline - time.perf_counter())
+
+    def call(
+        self, function: Callable[..., Any], arg: Any, start: float | None
+    ) -> Any:
+        """
+        Runs the function in the pool and waits for its result.
+
+        `start` is the `time.perf_counter()` value when the request arrived.
+        """
+
+        future = self.submit(function, arg)
+        done, _ = futures.wait([future], self.remaining(start))
+        if not done:
+            future.cancel()
+            logger.warning("Deadline of %r passed", function)
+            raise self.rejected("Request not handled in time")
+        return future.result()
+
+    async def call_async(
+        self, function: Callable[..., Any], arg: Any, start: float | None
+    ) -> Any:
+        """Counterpart of `call()` which doesn't block the event loop."""
+
+        future = asyncio.wrap_future(self.submit(function, arg))
+        done, _ = await asyncio.wait([future], timeout=self.remaining(start))
+        if not done:
+            # cancels the call too, unless it's already running
+            future.cancel()
+            logger.warning("Deadline of %r passed", function)
+            raise self.rejected("Request not handled in time")
+        return future.result()
+
+    def shutdown(self):
+        """Cancels the queued calls and stops the threads once idle."""
+
+        while True:
+            try:
+                call = self.calls.get_nowait()
+            except queue.Empty:
+                break
+            if call is not None:
+                call[0].cancel()
+
+        with self.lock:
+            for _ in self.threads:
+                self.calls.put(None)
+            self.threads = []
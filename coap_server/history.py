@@ -0,0 +1,241 @@
+"""
+Module providing the temperature history of sensors.
+
+Every sensor has two ring buffers of fixed capacity, kept in arrays:
+- the latest `HISTORY_SIZE` samples (timestamp and temperature),
+- aggregates (count, sum, minimum and maximum) of the samples of every
+  `RESOLUTION` seconds, for the latest `HISTORY_BUCKETS` of such periods.
+
+The aggregates are updated by every recorded sample, so aggregation queries
+combine at most one bucket per `RESOLUTION` seconds of the requested range,
+no matter how many samples were recorded. Both buffers are ordered by time,
+so the start of the range is found by bisection.
+
+The history is kept in memory only.
+"""
+
+import threading
+import time
+from array import array
+from collections.abc import Callable, Mapping
+from enum import Enum
+
+# Samples kept per sensor
+HISTORY_SIZE = 256
+
+# Seconds aggregated into a single bucket
+RESOLUTION = 60
+
+# Buckets kept per sensor (a day)
+HISTORY_BUCKETS = 1440
+
+# Range of temperatures, which are kept in int32 columns
+MIN_TEMPERATURE = -(1 << 31)
+MAX_TEMPERATURE = (1 << 31) - 1
+
+
+class Aggregate(str, Enum):
+    """Enum representing aggregation functions of history queries."""
+
+    MIN = "min"
+    MAX = "max"
+    AVG = "avg"
+
+
+class Ring:
+    """
+    Columns of the latest `capacity` rows, the oldest ones are overwritten.
+
+    Rows are addressed by their position from the oldest one. The columns
+    grow up to the capacity, so sparse histories don't take the full size.
+    """
+
+    def __init__(self, capacity: int, *typecodes: str):
+        self.capacity = capacity
+        self.columns = tuple(array(typecode) for typecode in typecodes)
+        # position of the oldest row in the columns once they're full
+        self.start = 0
+
+    def __len__(self) -> int:
+        return len(self.columns[0])
+
+    def index(self, position: int) -> int:
+        """Returns the index into the columns of the row at `position`."""
+
+        return (self.start + position) % self.capacity
+
+    def last(self) -> int:
+        """Returns the index into the columns of the newest row."""
+
+        return self.index(len(self) - 1)
+
+    def append(self, *row: float):
+        if len(self) < self.capacity:
+            for column, value in zip(self.columns, row):
+                column.append(value)  # type: ignore[arg-type]
+            return
+
+        for column, value in zip(self.columns, row):
+            column[self.start] = value  # type: ignore[call-overload]
+        self.start = (self.start + 1) % self.capacity
+
+    def bisect(self, column: int, value: float) -> int:
+        """Position of the first row whose (sorted) `column` is >= value."""
+
+        values = self.columns[column]
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if values[self.index(middle)] < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class SensorHistory:
+    """Samples and aggregates of a single sensor, see the module."""
+
+    def __init__(self, size: int, buckets: int, resolution: int):
+        self.resolution = resolution
+        self.samples = Ring(size, "d", "i")
+        # bucket number (start / resolution), count, sum, minimum, maximum
+        self.buckets = Ring(buckets, "q", "q", "q", "i", "i")
+
+    def record(self, timestamp: float, temperature: int):
+        times = self.samples.columns[0]
+        if len(self.samples):
+            # the clock may go backwards, the buffers have to stay sorted
+            timestamp = max(timestamp, times[self.samples.last()])
+        self.samples.append(timestamp, temperature)
+
+        number = int(timestamp // self.resolution)
+        numbers, counts, sums, minimums, maximums = self.buckets.columns
+        if len(self.buckets):
+            last = self.buckets.last()
+            if numbers[last] == number:
+                counts[last] += 1
+                sums[last] += temperature
+                minimums[last] = min(minimums[last], temperature)
+                maximums[last] = max(maximums[last], temperature)
+                return
+        self.buckets.append(number, 1, temperature, temperature, temperature)
+
+    def since(self, since: float) -> list[tuple[float, int]]:
+        """Samples recorded at or after `since`, oldest first."""
+
+        times, temperatures = self.samples.columns
+        indexes = map(
+            self.samples.index,
+            range(self.samples.bisect(0, since), len(self.samples)),
+        )
+        return [(times[i], temperatures[i]) for i in indexes]
+
+    def aggregate(
+        self, since: float, window: int, function: Aggregate
+    ) -> list[tuple[float, float]]:
+        """
+        Aggregates of every `window` seconds from `since`, oldest first.
+
+        Windows are aligned to multiples of `window` (a multiple of the
+        resolution), `since` is rounded down to a multiple of the resolution.
+        """
+
+        numbers, counts, sums, minimums, maximums = self.buckets.columns
+        per_window = window // self.resolution
+        first = self.buckets.bisect(0, since // self.resolution)
+
+        # count, sum, minimum and maximum by start of the window
+        windows: dict[int, list[int]] = {}
+        for position in range(first, len(self.buckets)):
+            i = self.buckets.index(position)
+            start = numbers[i] // per_window * window
+            values = windows.get(start)
+            if values is None:
+                windows[start] = [counts[i], sums[i], minimums[i], maximums[i]]
+            else:
+                values[0] += counts[i]
+                values[1] += sums[i]
+                values[2] = min(values[2], minimums[i])
+                values[3] = max(values[3], maximums[i])
+
+        return [
+            (start, result(function, *values))
+            for start, values in windows.items()
+        ]
+
+
+def result(
+    function: Aggregate, count: int, total: int, low: int, high: int
+) -> float:
+    """Value of the aggregation function of a window."""
+
+    match function:
+        case Aggregate.MIN:
+            return low
+        case Aggregate.MAX:
+            return high
+        case Aggregate.AVG:
+            return total / count
+
+
+class History:
+    """
+    Temperature history of all the sensors.
+
+    Like the objects of resources, the history can be shared by worker
+    processes through `SharedObjectsManager`.
+    """
+
+    def __init__(
+        self,
+        size: int = HISTORY_SIZE,
+        buckets: int = HISTORY_BUCKETS,
+        resolution: int = RESOLUTION,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.size = size
+        self.buckets = buckets
+        self.resolution = resolution
+        self.clock = clock
+        self.sensors: dict[int, SensorHistory] = {}
+        # requests from the workers are served by threads of the manager
+        self.lock = threading.Lock()
+
+    def record(self, temperatures: Mapping[int, int]):
+        """Records the temperatures of sensors measured now."""
+
+        timestamp = self.clock()
+        with self.lock:
+            for key, temperature in temperatures.items():
+                history = self.sensors.get(key)
+                if history is None:
+                    history = self.sensors[key] = SensorHistory(
+                        self.size, self.buckets, self.resolution
+                    )
+                history.record(timestamp, temperature)
+
+    def forget(self, key: int):
+        """Drops the history of a deleted sensor."""
+
+        with self.lock:
+            self.sensors.pop(key, None)
+
+    def since(self, key: int, since: float) -> list[tuple[float, int]]:
+        with self.lock:
+            history = self.sensors.get(key)
+            return [] if history is None else history.since(since)
+
+    def aggregate(
+        self, key: int, since: float, window: int, function: Aggregate
+    ) -> list[tuple[float, float]]:
+        """Raises ValueError if `window` isn't a multiple of the resolution."""
+
+        if window <= 0 or window % self.resolution:
+            raise ValueError(f"Invalid aggregation window: {window}")
+
+        with self.lock:
+            history = self.sensors.get(key)
+            if history is None:
+                return []
+            return history.aggregate(since, window, function)
@@ -1,10 +1,85 @@
-"""Module providing logging configuration for the CoAP server."""
+"""
+Module providing logging configuration for the CoAP server.
 
+Importing the module doesn't configure anything, the application has to call
+`configure_logging()`. Messages should be logged with %-style arguments, so
+they are formatted only if the level is enabled.
+"""
+
+import atexit
 import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import TextIO
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-)
+FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
 
 logger = logging.getLogger("coap_server")
+logger.addHandler(logging.NullHandler())
+
+# background thread writing the records, if configured with `use_queue`
+listener: QueueListener | None = None
+
+
+def configure_logging(
+    level: int = logging.INFO,
+    use_queue: bool = False,
+    stream: TextIO | None = None,
+):
+    """
+    Sets up logging of the server to `stream` (stderr by default).
+
+    With `use_queue`, records are only put into a queue by the thread which
+    logs them, and written by a background thread, so slow output never
+    blocks handling of requests. Can be called again to reconfigure.
+    """
+
+    global listener
+    shutdown_logging()
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(FORMAT))
+
+    if use_queue:
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        listener = QueueListener(records, handler)
+        listener.start()
+        logger.addHandler(QueueHandler(records))
+    else:
+        logger.addHandler(handler)
+
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def shutdown_logging():
+    """Writes the queued records and stops the background thread."""
+
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def restart_listener():
+    """Starts the background thread again in a forked worker process."""
+
+    global listener
+    if listener is None:
+        return
+
+    # the thread isn't copied by fork, and neither should be the records
+    # queued by the parent
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    for handler in logger.handlers:
+        if isinstance(handler, QueueHandler):
+            handler.queue = records
+    listener = QueueListener(records, *listener.handlers)
+    listener.start()
+
+
+atexit.register(shutdown_logging)
+os.register_at_fork(after_in_child=restart_listener)
@@ -0,0 +1,419 @@
+"""
+Module providing the messaging layer of CoAP (RFC 7252, section 4).
+
+`MessageLayer` sits in front of `RequestHandler` and takes care of message
+types and IDs: confirmable requests are answered with piggybacked ACKs,
+duplicates are answered from a cache instead of being processed again, and
+confirmable messages sent by the server are retransmitted until acknowledged.
+New requests may be rejected by a `RateLimiter` before they reach the handler.
+
+Group requests (sent to a multicast address, RFC 7252, section 8.2) are
+answered after a random delay within the leisure period, so that all the
+servers of a group don't respond at once, and error responses to them are
+suppressed.
+"""
+
+import asyncio
+import heapq
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable
+
+from coap_server.logger import logger
+from coap_server.observe import CON_EVERY, Observer
+from coap_server.ratelimit import RateLimiter, rejection
+from coap_server.request_handler import RequestHandler
+from coap_server.utils.constants import (
+    ACK_RANDOM_FACTOR,
+    ACK_TIMEOUT,
+    DEFAULT_LEISURE,
+    EXCHANGE_LIFETIME,
+    MAX_RETRANSMIT,
+    NON_LIFETIME,
+    Address,
+    CoapType,
+)
+
+# Exchanges remembered for deduplication at most
+MAX_EXCHANGES = 10000
+
+# Time after which an empty ACK is sent for a request which is still being
+# processed, so that the client doesn't retransmit it (asyncio mode only)
+SEPARATE_RESPONSE_DELAY = 1.0
+
+
+@dataclass
+class Exchange:
+    """Request received from a client, remembered for deduplication."""
+
+    expires_at: float
+    # None while the request is still being processed
+    response: bytes | None = None
+
+
+@dataclass(order=True)
+class Transmission:
+    """Confirmable message sent by the server, waiting for an ACK."""
+
+    next_at: float
+    key: tuple[Address, int] = field(compare=False)
+    data: bytes = field(compare=False)
+    timeout: float = field(compare=False)
+    retransmits: int = field(default=0, compare=False)
+    on_timeout: Callable[[], None] | None = field(default=None, compare=False)
+
+
+@dataclass(order=True)
+class Deferred:
+    """Response to a group request, waiting for its leisure to pass."""
+
+    send_at: float
+    data: bytes = field(compare=False)
+    remote: Address = field(compare=False)
+
+
+def empty_message(message_type: CoapType, mid: int) -> bytes:
+    """Encode an empty message (ACK or RST) with the given message ID."""
+
+    return bytes([0x40 | message_type << 4, 0, mid >> 8, mid & 0xFF])
+
+
+def set_type(data: bytes, message_type: CoapType, mid: int) -> bytes:
+    """Return the encoded message with its type and message ID replaced."""
+
+    message = bytearray(data)
+    message[0] = (message[0] & 0xCF) | message_type << 4
+    message[2] = mid >> 8
+    message[3] = mid & 0xFF
+    return bytes(message)
+
+
+class MessageLayer:
+    """
+    Handles message types, deduplication and retransmissions.
+
+    Every request is remembered for EXCHANGE_LIFETIME (CON) or NON_LIFETIME
+    (NON) seconds, keyed on the client address and message ID, together with
+    the encoded response. At most `max_exchanges` are kept; the oldest ones
+    are evicted first. Responses to group requests are delayed by up to
+    `leisure` seconds.
+    """
+
+    def __init__(
+        self,
+        handler: RequestHandler,
+        max_exchanges: int = MAX_EXCHANGES,
+        separate_after: float = SEPARATE_RESPONSE_DELAY,
+        limiter: RateLimiter | None = None,
+        leisure: float = DEFAULT_LEISURE,
+    ):
+        self.handler = handler
+        self.limiter = limiter
+        self.leisure = leisure
+        self.max_exchanges = max_exchanges
+        self.separate_after = separate_after
+        self.exchanges: OrderedDict[tuple[Address, int], Exchange] = (
+            OrderedDict()
+        )
+        self.transmissions: dict[tuple[Address, int], Transmission] = {}
+        # heap of transmissions ordered by the time of next retransmission,
+        # entries of already acknowledged ones are skipped lazily
+        self.schedule: list[Transmission] = []
+        # heap of responses to group requests, sent by `due()`
+        self.deferred: list[Deferred] = []
+        self.mid = random.randrange(0x10000)
+
+    def receive(
+        self, data: bytes, remote: Address, group: bool = False
+    ) -> bytes | None:
+        """
+        Process a datagram and return the reply to send back, if any.
+
+        `group` tells that the datagram was sent to a multicast group, its
+        response is returned by `due()` later.
+        """
+
+        process, reply = self.filter(data, remote, group)
+        if not process:
+            return reply
+
+        response = self.handler.handle_request(data, remote)
+        return self.complete(data, remote, response, group)
+
+    async def receive_async(
+        self,
+        data: bytes,
+        remote: Address,
+        send: Callable[[bytes, Address], None],
+        group: bool = False,
+    ) -> bytes | None:
+        """
+        Counterpart of `receive()` to be used inside of an event loop.
+
+        If a confirmable request isn't handled within `separate_after`
+        seconds, an empty ACK is sent right away with `send`, and the response
+        follows later as a separate confirmable message.
+        """
+
+        process, reply = self.filter(data, remote, group)
+        if not process:
+            return reply
+
+        task = asyncio.ensure_future(
+            self.handler.handle_request_async(data, remote)
+        )
+        if data[0] >> 4 & 0x03 == CoapType.CON:
+            done, _ = await asyncio.wait({task}, timeout=self.separate_after)
+            if not done:
+                mid = data[2] << 8 | data[3]
+                ack = empty_message(CoapType.ACK, mid)
+                exchange = self.exchanges.get((remote, mid))
+                if exchange is not None:
+                    exchange.response = ack
+                send(ack, remote)
+                logger.debug("Sent empty ACK for %s to %s", mid, remote)
+
+                response = await task
+                if response is None:
+                    return None
+                return self.send_confirmable(response, remote)
+
+        return self.complete(data, remote, await task, group)
+
+    def filter(
+        self, data: bytes, remote: Address, group: bool = False
+    ) -> tuple[bool, bytes | None]:
+        """
+        Handles all the datagrams except for new requests.
+
+        Returns whether the datagram is a new request which should be passed
+        to the handler, and otherwise the reply to send back, if any.
+        """
+
+        if len(data) < 4 or data[0] >> 6 != 1:
+            return False, None
+
+        message_type = data[0] >> 4 & 0x03
+        mid = data[2] << 8 | data[3]
+
+        if group and message_type != CoapType.NON:
+            # group requests must be non-confirmable, and nothing (not even
+            # a RST) is sent back to anything else
+            logger.debug("Ignoring message %s to group from %s", mid, remote)
+            return False, None
+
+        if message_type == CoapType.ACK or message_type == CoapType.RST:
+            self.acknowledge(remote, mid, message_type)
+            return False, None
+
+        if data[1] == 0 or data[1] >> 5 != 0:
+            # Empty CON message (ping) or unexpected response is rejected,
+            # NON ones are silently ignored
+            if message_type == CoapType.CON:
+                return False, empty_message(CoapType.RST, mid)
+            return False, None
+
+        key = (remote, mid)
+        now = time.monotonic()
+        exchange = self.exchanges.get(key)
+        if exchange is not None and exchange.expires_at > now:
+            logger.debug("Duplicate message %s from %s", mid, remote)
+            return False, exchange.response
+
+        if self.limiter is not None:
+            rejected = self.limiter.admit(remote[0])
+            if rejected is not None:
+                code, max_age = rejected
+                self.handler.metrics.rejected(code)
+                logger.debug("Rejected message %s from %s", mid, remote)
+                return False, rejection(data, code, max_age)
+
+        self.evict(now)
+        lifetime = (
+            EXCHANGE_LIFETIME if message_type == CoapType.CON else NON_LIFETIME
+        )
+        self.exchanges.pop(key, None)
+        self.exchanges[key] = Exchange(now + lifetime)
+        return True, None
+
+    def complete(
+        self,
+        data: bytes,
+        remote: Address,
+        response: bytes | None,
+        group: bool = False,
+    ) -> bytes | None:
+        """Set the type of the response and remember it for duplicates."""
+
+        mid = data[2] << 8 | data[3]
+        if group:
+            # duplicates aren't answered, the response is already deferred
+            self.defer(response, remote)
+            reply = None
+        elif data[0] >> 4 & 0x03 == CoapType.CON:
+            if response is None:
+                # CON message which couldn't be processed is rejected
+                reply = empty_message(CoapType.RST, mid)
+            else:
+                reply = set_type(response, CoapType.ACK, mid)
+        elif response is not None:
+            reply = set_type(response, CoapType.NON, self.next_mid())
+        else:
+            reply = None
+
+        exchange = self.exchanges.get((remote, mid))
+        if exchange is not None:
+            exchange.response = reply
+        return reply
+
+    def defer(self, response: bytes | None, remote: Address):
+        """
+        Schedule the response to a group request at a random time within
+        the leisure period.
+
+        Error responses are suppressed, since every server of the group
+        would send one, e.g. 4.04 from those without the resource.
+        """
+
+        if response is None or response[1] >> 5 != 2:
+            logger.debug("Suppressed response to group request of %s", remote)
+            return
+
+        send_at = time.monotonic() + random.uniform(0, self.leisure)
+        message = set_type(response, CoapType.NON, self.next_mid())
+        heapq.heappush(self.deferred, Deferred(send_at, message, remote))
+
+    def evict(self, now: float):
+        """Forget expired exchanges and the oldest ones above the limit."""
+
+        exchanges = self.exchanges
+        while exchanges:
+            exchange = exchanges[next(iter(exchanges))]
+            if (
+                exchange.expires_at > now
+                and len(exchanges) < self.max_exchanges
+            ):
+                break
+            exchanges.popitem(last=False)
+
+    def next_mid(self) -> int:
+        self.mid = (self.mid + 1) & 0xFFFF
+        return self.mid
+
+    def send_confirmable(
+        self,
+        data: bytes,
+        remote: Address,
+        on_timeout: Callable[[], None] | None = None,
+    ) -> bytes:
+        """
+        Turn an encoded message into a CON one with a new message ID.
+
+        The message is retransmitted by `due()` with exponential back-off
+        until it is acknowledged, at most MAX_RETRANSMIT times. Afterwards
+        `on_timeout` is called. Returns the message to be sent.
+        """
+
+        mid = self.next_mid()
+        message = set_type(data, CoapType.CON, mid)
+        timeout = random.uniform(ACK_TIMEOUT, ACK_TIMEOUT * ACK_RANDOM_FACTOR)
+        transmission = Transmission(
+            next_at=time.monotonic() + timeout,
+            key=(remote, mid),
+            data=message,
+            timeout=timeout,
+            on_timeout=on_timeout,
+        )
+        self.transmissions[transmission.key] = transmission
+        heapq.heappush(self.schedule, transmission)
+        return message
+
+    def acknowledge(self, remote: Address, mid: int, message_type: int):
+        transmission = self.transmissions.pop((remote, mid), None)
+        if transmission is not None:
+            kind = "ACK" if message_type == CoapType.ACK else "RST"
+            logger.debug("Received %s for %s from %s", kind, mid, remote)
+
+        if message_type == CoapType.RST:
+            # client isn't interested in notifications anymore
+            self.handler.observers.reset(remote, mid)
+
+    def notifications(self) -> list[tuple[bytes, Address]]:
+        """Return the pending notifications for observers, ready to send."""
+
+        return self.send_notifications(self.handler.notifications())
+
+    async def notifications_async(self) -> list[tuple[bytes, Address]]:
+        """Counterpart of `notifications()` to be used inside of event loop."""
+
+        return self.send_notifications(
+            await self.handler.notifications_async()
+        )
+
+    def send_notifications(
+        self, notifications: list[tuple[Observer, bytes]]
+    ) -> list[tuple[bytes, Address]]:
+        """
+        Set types and message IDs of notifications.
+
+        Every CON_EVERY-th notification of an observer is confirmable, and if
+        it isn't acknowledged, the observer is removed.
+        """
+
+        observers = self.handler.observers
+        messages = []
+        for observer, data in notifications:
+            if (observer.notifications + 1) % CON_EVERY == 0:
+                message = self.send_confirmable(
+                    data, observer.remote, partial(observers.remove, observer)
+                )
+            else:
+                message = set_type(data, CoapType.NON, self.next_mid())
+
+            observers.sent(observer, message[2] << 8 | message[3])
+            messages.append((message, observer.remote))
+
+        return messages
+
+    def due(self, now: float | None = None) -> list[tuple[bytes, Address]]:
+        """
+        Return the CON messages which have to be retransmitted now, and the
+        responses to group requests whose time has come.
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        retransmissions = []
+        deferred = self.deferred
+        while deferred and deferred[0].send_at <= now:
+            response = heapq.heappop(deferred)
+            retransmissions.append((response.data, response.remote))
+
+        schedule = self.schedule
+        while schedule and schedule[0].next_at <= now:
+            transmission = heapq.heappop(schedule)
+            if self.transmissions.get(transmission.key) is not transmission:
+                # already acknowledged
+                continue
+
+            remote, mid = transmission.key
+            if transmission.retransmits >= MAX_RETRANSMIT:
+                del self.transmissions[transmission.key]
+                logger.warning(
+                    "Message %s to %s not acknowledged", mid, remote
+                )
+                if transmission.on_timeout is not None:
+                    transmission.on_timeout()
+                continue
+
+            transmission.retransmits += 1
+            transmission.timeout *= 2
+            transmission.next_at = now + transmission.timeout
+            heapq.heappush(schedule, transmission)
+            retransmissions.append((transmission.data, remote))
+
+        return retransmissions
@@ -0,0 +1,205 @@
+"""
+Module providing request metrics of the CoAP server.
+
+`Metrics` counts handled requests by method, route and response code, and
+records their latencies into histograms with fixed buckets. Recording is
+a dictionary lookup and a bisection of a short tuple, so it doesn't
+measurably slow down handling of requests. Routes are the path patterns
+(e.g. `/sensors/{id:int}`), not the requested URIs, so the number of series
+stays bounded.
+
+Metrics are kept per process, every worker exposes its own.
+"""
+
+import json
+from bisect import bisect_left
+
+from coap_server.utils.constants import CoapCode
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+# Route of requests which didn't match any
+UNMATCHED = "<unmatched>"
+
+
+class Histogram:
+    """Counts of observed values falling into each of the buckets."""
+
+    __slots__ = ("counts", "sum")
+
+    def __init__(self):
+        # the last count is for values above the largest bucket
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def merge(self, other: "Histogram"):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """Returns (upper bound, count of values up to it) of the buckets."""
+
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+        total = 0
+        buckets = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the handled requests.
+
+    A single histogram is kept for every method, route and response code,
+    so recording takes one lookup. Request counts and histograms per method
+    and route are aggregated from those when exported.
+    """
+
+    def __init__(self):
+        self.series: dict[tuple[CoapCode, str, CoapCode], Histogram] = {}
+        self.parse_failures = 0
+        # requests rejected by the rate limiter, by response code
+        self.rejections: dict[CoapCode, int] = {}
+
+    def record(
+        self, method: CoapCode, route: str, code: CoapCode, duration: float
+    ):
+        """Records a handled request and its latency in seconds."""
+
+        histogram = self.series.get((method, route, code))
+        if histogram is None:
+            histogram = self.series[method, route, code] = Histogram()
+        histogram.counts[bisect_left(LATENCY_BUCKETS, duration)] += 1
+        histogram.sum += duration
+
+    @property
+    def requests(self) -> dict[tuple[CoapCode, str, CoapCode], int]:
+        """Counts of requests by method, route and response code."""
+
+        return {key: series.count for key, series in self.series.items()}
+
+    @property
+    def latencies(self) -> dict[tuple[CoapCode, str], Histogram]:
+        """Latency histograms by method and route."""
+
+        latencies: dict[tuple[CoapCode, str], Histogram] = {}
+        for (method, route, _), histogram in self.series.items():
+            merged = latencies.setdefault((method, route), Histogram())
+            merged.merge(histogram)
+        return latencies
+
+    def parse_failed(self):
+        self.parse_failures += 1
+
+    def rejected(self, code: CoapCode):
+        self.rejections[code] = self.rejections.get(code, 0) + 1
+
+    def to_json(self) -> bytes:
+        """Returns the metrics serialized as JSON."""
+
+        return json.dumps(
+            {
+                "requests": [
+                    {
+                        "method": method.name,
+                        "route": route,
+                        "code": code.value,
+                        "count": count,
+                    }
+                    for (method, route, code), count in self.requests.items()
+                ],
+                "parse_failures": self.parse_failures,
+                "rejected": {
+                    code.value: count
+                    for code, count in self.rejections.items()
+                },
+                "latency": [
+                    {
+                        "method": method.name,
+                        "route": route,
+                        "buckets": dict(histogram.cumulative()),
+                        "sum": histogram.sum,
+                        "count": histogram.count,
+                    }
+                    for (method, route), histogram in self.latencies.items()
+                ],
+            }
+        ).encode("utf-8")
+
+    def to_prometheus(self) -> bytes:
+        """Returns the metrics in the Prometheus text exposition format."""
+
+        lines = [
+            "# HELP coap_requests_total Requests handled by the server.",
+            "# TYPE coap_requests_total counter",
+        ]
+        for (method, route, code), count in self.requests.items():
+            labels = format_labels(
+                method=method.name, route=route, code=code.value
+            )
+            lines.append(f"coap_requests_total{{{labels}}} {count}")
+
+        lines += [
+            "# HELP coap_parse_failures_total Datagrams which couldn't be "
+            "parsed.",
+            "# TYPE coap_parse_failures_total counter",
+            f"coap_parse_failures_total {self.parse_failures}",
+            "# HELP coap_rejected_total Requests rejected by the rate "
+            "limiter.",
+            "# TYPE coap_rejected_total counter",
+        ]
+        for code, count in self.rejections.items():
+            labels = format_labels(code=code.value)
+            lines.append(f"coap_rejected_total{{{labels}}} {count}")
+
+        lines += [
+            "# HELP coap_request_duration_seconds Latency of the requests.",
+            "# TYPE coap_request_duration_seconds histogram",
+        ]
+        name = "coap_request_duration_seconds"
+        for (method, route), histogram in self.latencies.items():
+            labels = format_labels(method=method.name, route=route)
+            for bound, count in histogram.cumulative():
+                le = format_labels(le=bound)
+                lines.append(f"{name}_bucket{{{labels},{le}}} {count}")
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def format_labels(**labels: str) -> str:
+    """Formats Prometheus labels, escaping the values."""
+
+    return ",".join(
+        '{}="{}"'.format(
+            name,
+            value.replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in labels.items()
+    )
@@ -0,0 +1,176 @@
+"""
+Module providing the sockets of the server: IPv4, IPv6 and multicast groups.
+
+The address family of the server socket follows its host, e.g. `::1` binds
+an IPv6 socket. The wildcard `::` binds a dual-stack one, which accepts IPv4
+clients as well (with IPv4-mapped addresses, `::ffff:192.0.2.1`).
+
+Group requests (RFC 7252, section 8) are received on separate sockets, one
+per joined group and bound to the group address, so the socket a datagram
+arrives on tells whether it was sent to a group. The unicast socket doesn't
+receive the datagrams of the groups (IP_MULTICAST_ALL is disabled on Linux),
+and responses are sent from it, since a multicast address can't be the
+source of a datagram.
+"""
+
+import socket
+import struct
+import sys
+
+from coap_server.utils.constants import Address
+
+# All-CoAP-Nodes groups (RFC 7252, section 12.8)
+ALL_COAP_NODES_IPV4 = "224.0.1.187"
+# link-local, realm-local and site-local scopes of ff0x::fd
+ALL_COAP_NODES_IPV6 = ("ff02::fd", "ff03::fd", "ff05::fd")
+
+# Linux options missing in the socket module; when disabled, a socket only
+# receives datagrams of the groups joined by itself, not by other sockets
+IP_MULTICAST_ALL = 49
+IPV6_MULTICAST_ALL = 29
+
+
+def address_family(host: str) -> socket.AddressFamily:
+    """Returns the address family of a numeric host."""
+
+    return socket.AF_INET6 if ":" in host else socket.AF_INET
+
+
+def needs_interface(group: str) -> bool:
+    """Returns whether the IPv6 group is interface or link-local."""
+
+    address = socket.inet_pton(socket.AF_INET6, group)
+    return address[1] & 0x0F <= 2
+
+
+def check_group(host: str, group: str):
+    """Raises ValueError if a server bound to the host can't join the group."""
+
+    family = address_family(group)
+    if family == socket.AF_INET6 and address_family(host) == socket.AF_INET:
+        raise ValueError(f"IPv6 group {group} requires an IPv6 host")
+    if family == socket.AF_INET and address_family(host) == socket.AF_INET6:
+        if host != "::":
+            raise ValueError(f"IPv4 group {group} requires host ::")
+
+
+def all_coap_nodes(host: str, interface: str | None = None) -> list[str]:
+    """
+    Returns the All-CoAP-Nodes groups a server bound to the host can join.
+
+    Link-local groups are joined only on a given interface.
+    """
+
+    groups = []
+    if address_family(host) == socket.AF_INET or host == "::":
+        groups.append(ALL_COAP_NODES_IPV4)
+    if address_family(host) == socket.AF_INET6:
+        groups += [
+            group
+            for group in ALL_COAP_NODES_IPV6
+            if interface is not None or not needs_interface(group)
+        ]
+    return groups
+
+
+def exclude_groups(sock: socket.socket):
+    """Stops the socket from receiving datagrams of other sockets' groups."""
+
+    if not sys.platform.startswith("linux"):
+        return
+
+    levels = [socket.IPPROTO_IP]
+    if sock.family == socket.AF_INET6:
+        levels.append(socket.IPPROTO_IPV6)
+    for level in levels:
+        option = IP_MULTICAST_ALL
+        if level == socket.IPPROTO_IPV6:
+            option = IPV6_MULTICAST_ALL
+        try:
+            sock.setsockopt(level, option, 0)
+        except OSError:
+            # IPV6_MULTICAST_ALL is available since Linux 4.20
+            pass
+
+
+def server_socket(
+    host: str, port: int, reuse_port: bool = False, groups: bool = False
+) -> socket.socket:
+    """
+    Returns the unicast UDP socket of the server, bound to host:port.
+
+    With `groups`, the port may be shared with the sockets of the groups,
+    joined by this server or by another worker of the pool (`reuse_port`).
+    """
+
+    sock = socket.socket(address_family(host), socket.SOCK_DGRAM)
+    if sock.family == socket.AF_INET6:
+        # the wildcard accepts IPv4 clients too, other hosts only IPv6 ones
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, host != "::")
+    if reuse_port:
+        # allows several processes to listen on the same host:port
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if groups or reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    exclude_groups(sock)
+    sock.bind((host, port))
+    return sock
+
+
+def group_socket(
+    group: str, port: int, interface: str | None = None
+) -> socket.socket:
+    """
+    Returns a socket receiving the datagrams sent to group:port.
+
+    The group is joined on the given interface (by its name), otherwise on
+    the one chosen by the kernel.
+    """
+
+    index = 0 if interface is None else socket.if_nametoindex(interface)
+    family = address_family(group)
+    if family == socket.AF_INET6 and index == 0 and needs_interface(group):
+        raise ValueError(f"Link-local group {group} requires an interface")
+
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if family == socket.AF_INET:
+            sock.bind((group, port))
+            if index:
+                # struct ip_mreqn, selecting the interface by its index
+                request = struct.pack(
+                    "=4s4si", socket.inet_aton(group), bytes(4), index
+                )
+            else:
+                # struct ip_mreq with INADDR_ANY
+                request = socket.inet_aton(group) + bytes(4)
+            sock.setsockopt(
+                socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, request
+            )
+        else:
+            sock.bind((group, port, 0, index))
+            # struct ipv6_mreq
+            request = socket.inet_pton(family, group) + struct.pack(
+                "@I", index
+            )
+            sock.setsockopt(
+                socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, request
+            )
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def reply_address(family: int, addr: Address) -> Address:
+    """
+    Returns the address the unicast socket of the family replies to.
+
+    IPv4 clients of a dual-stack socket have IPv4-mapped addresses, also
+    when their request arrived on the socket of an IPv4 group.
+    """
+
+    if family == socket.AF_INET6 and len(addr) == 2:
+        return f"::ffff:{addr[0]}", addr[1], 0, 0
+    return addr
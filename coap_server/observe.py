@@ -0,0 +1,150 @@
+"""
+Module providing the registry of observers (RFC 7641).
+
+Clients register with a GET request carrying the Observe option. When
+a resource reports a change of some path, all the observed URIs of that path
+are marked as pending. Pending URIs are re-rendered once per batch and
+requested content format, no matter how many clients observe them and how
+many changes happened in between.
+"""
+
+import threading
+from dataclasses import dataclass
+
+from coap_server.utils.constants import Address, CoapMessage, CoapOption
+
+# Observe option values are 24-bit sequence numbers
+MAX_SEQUENCE = 1 << 24
+
+# Every n-th notification is sent as confirmable, so that observers which
+# have gone away are eventually detected and removed
+CON_EVERY = 10
+
+
+def observed_path(uri: str) -> str:
+    """Normalized path of an URI, used to match changes with observers."""
+
+    return "/" + uri.split("?", 1)[0].strip("/")
+
+
+@dataclass(eq=False)
+class Observer:
+    """Client observing a resource."""
+
+    remote: Address
+    token: bytes
+    request: CoapMessage
+    notifications: int = 0
+    # message ID of the last notification, to match RST replies
+    mid: int | None = None
+
+
+class ObserverRegistry:
+    """
+    Observers grouped by the observed URI.
+
+    Observers are keyed on (client address, token) within each URI, so a
+    registration repeated by the client replaces the previous one.
+    """
+
+    def __init__(self):
+        self.observers: dict[str, dict[tuple[Address, bytes], Observer]] = {}
+        self.uris_by_path: dict[str, set[str]] = {}
+        self.sequence: dict[str, int] = {}
+        self.pending: set[str] = set()
+        self.by_mid: dict[tuple[Address, int], Observer] = {}
+        # resources may report changes from threads of an executor
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(observers) for observers in self.observers.values())
+
+    def register(self, request: CoapMessage, remote: Address) -> int:
+        """Add an observer and return the current sequence number."""
+
+        uri = request.uri
+        observers = self.observers.setdefault(uri, {})
+        observers[(remote, request.token)] = Observer(
+            remote, request.token, request
+        )
+        self.uris_by_path.setdefault(observed_path(uri), set()).add(uri)
+        return self.sequence.setdefault(uri, 0)
+
+    def deregister(self, uri: str, remote: Address, token: bytes):
+        observers = self.observers.get(uri)
+        if observers is None:
+            return
+
+        observer = observers.pop((remote, token), None)
+        if observer is not None and observer.mid is not None:
+            self.by_mid.pop((remote, observer.mid), None)
+
+        if not observers:
+            del self.observers[uri]
+            self.sequence.pop(uri, None)
+            self.pending.discard(uri)
+            uris = self.uris_by_path[observed_path(uri)]
+            uris.discard(uri)
+            if not uris:
+                del self.uris_by_path[observed_path(uri)]
+
+    def remove(self, observer: Observer):
+        uri, key = observer.request.uri, (observer.remote, observer.token)
+        # the observer may have registered again in the meantime
+        if self.observers.get(uri, {}).get(key) is observer:
+            self.deregister(uri, observer.remote, observer.token)
+
+    def reset(self, remote: Address, mid: int):
+        """Remove the observer which rejected a notification with RST."""
+
+        observer = self.by_mid.pop((remote, mid), None)
+        if observer is not None:
+            self.remove(observer)
+
+    def changed(self, *paths: str):
+        """Mark all the URIs observed under the given paths as pending."""
+
+        with self.lock:
+            for path in paths:
+                uris = self.uris_by_path.get(observed_path(path))
+                if uris:
+                    self.pending.update(uris)
+
+    def take_pending(self) -> list[tuple[CoapMessage, list[Observer], int]]:
+        """
+        Return the pending URIs to be notified about and clear them.
+
+        For every URI it returns a request used to render the representation
+        once, the observers and the sequence number for the notification.
+        Observers asking for different content formats (Accept) are returned
+        separately, each group with a request of its own.
+        """
+
+        with self.lock:
+            pending, self.pending = self.pending, set()
+
+        batch = []
+        for uri in pending:
+            observers = self.observers.get(uri)
+            if not observers:
+                continue
+
+            sequence = (self.sequence[uri] + 1) % MAX_SEQUENCE
+            self.sequence[uri] = sequence
+            formats: dict[bytes | None, list[Observer]] = {}
+            for observer in observers.values():
+                accept = observer.request.options.get(CoapOption.ACCEPT)
+                key = None if accept is None else bytes(accept)
+                formats.setdefault(key, []).append(observer)
+            for notified in formats.values():
+                batch.append((notified[0].request, notified, sequence))
+        return batch
+
+    def sent(self, observer: Observer, mid: int):
+        """Remember the message ID of the notification sent to observer."""
+
+        if observer.mid is not None:
+            self.by_mid.pop((observer.remote, observer.mid), None)
+        observer.mid = mid
+        observer.notifications += 1
+        self.by_mid[(observer.remote, mid)] = observer
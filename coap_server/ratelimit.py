@@ -0,0 +1,154 @@
+"""
+Module providing per-client rate limiting and admission control.
+
+`RateLimiter` sits in front of the request handler (see `MessageLayer`) and
+keeps a token bucket for every client address and a global one for all the
+requests. A request takes a token from both; when the client has none
+left, it's rejected with 4.29 Too Many Requests (RFC 8516), when the server
+as a whole has none left, with 5.03 Service Unavailable. Both carry the
+Max-Age option with the seconds until a token is available again.
+
+Rejections are encoded straight from the header of the datagram, without
+parsing it. Only confirmable requests are answered, non-confirmable ones are
+dropped, so that floods with spoofed source addresses don't make the server
+send as much as it receives.
+
+Buckets of clients are kept in a table of at most `max_clients` entries,
+evicting the least recently seen client, so memory stays flat no matter how
+many distinct addresses send requests. An evicted client starts with a full
+bucket again; the global bucket still bounds the total rate.
+
+Limits apply per process, every worker has its own buckets.
+"""
+
+import math
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from coap_server.utils.constants import CoapCode, CoapType
+from coap_server.utils.parser import BYTES_BY_CODE, encode_uint
+
+# Clients whose buckets are remembered at most
+MAX_CLIENTS = 10000
+
+
+class Bucket:
+    """Tokens of a token bucket and when they were last counted."""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        """Takes a token, returns 0 or the seconds until one is available."""
+
+        tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return 0.0
+
+        self.tokens = tokens
+        return (1 - tokens) / rate
+
+
+class RateLimiter:
+    """
+    Token buckets refilled with `client_rate` requests per second for every
+    client address and with `global_rate` for all the requests together.
+
+    Buckets hold up to `client_burst` and `global_burst` tokens (by default
+    one second worth of requests). A rate of 0 disables the limit.
+    """
+
+    def __init__(
+        self,
+        client_rate: float = 0,
+        client_burst: float | None = None,
+        global_rate: float = 0,
+        global_burst: float | None = None,
+        max_clients: int = MAX_CLIENTS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.client_rate = client_rate
+        self.client_burst = (
+            max(client_rate, 1) if client_burst is None else client_burst
+        )
+        self.global_rate = global_rate
+        self.global_burst = (
+            max(global_rate, 1) if global_burst is None else global_burst
+        )
+        self.max_clients = max_clients
+        self.clock = clock
+        self.clients: OrderedDict[str, Bucket] = OrderedDict()
+        self.bucket = Bucket(self.global_burst, clock())
+
+    def admit(self, host: str) -> tuple[CoapCode, int] | None:
+        """
+        Takes tokens for a request from the host.
+
+        Returns None if the request is admitted, otherwise the response code
+        and the seconds after which the client may retry.
+        """
+
+        now = self.clock()
+        if self.client_rate > 0:
+            bucket = self.clients.get(host)
+            if bucket is None:
+                if len(self.clients) >= self.max_clients:
+                    self.clients.popitem(last=False)
+                bucket = self.clients[host] = Bucket(self.client_burst, now)
+            else:
+                self.clients.move_to_end(host)
+
+            wait = bucket.take(self.client_rate, self.client_burst, now)
+            if wait:
+                return CoapCode.TOO_MANY_REQUESTS, math.ceil(wait)
+
+        if self.global_rate > 0:
+            wait = self.bucket.take(self.global_rate, self.global_burst, now)
+            if wait:
+                return CoapCode.SERVICE_UNAVAILABLE, math.ceil(wait)
+
+        return None
+
+
+# Option header of Max-Age: delta 14 is encoded as 13 + 1 extended byte
+MAX_AGE_HEADER = 0xD0, 14 - 13
+
+
+def rejection(data: bytes, code: CoapCode, max_age: int) -> bytes | None:
+    """
+    Encodes the reply rejecting a request with the code and Max-Age.
+
+    Confirmable requests are answered with a piggybacked ACK, others get no
+    reply (None).
+    """
+
+    token_length = data[0] & 0x0F
+    if (
+        data[0] >> 4 & 0x03 != CoapType.CON
+        or token_length > 8
+        or len(data) < 4 + token_length
+    ):
+        return None
+
+    value = encode_uint(max_age)
+    return b"".join(
+        (
+            bytes(
+                (
+                    0x40 | CoapType.ACK << 4 | token_length,
+                    BYTES_BY_CODE[code],
+                    data[2],
+                    data[3],
+                )
+            ),
+            data[4 : 4 + token_length],
+            bytes((MAX_AGE_HEADER[0] | len(value), MAX_AGE_HEADER[1])),
+            value,
+        )
+    )
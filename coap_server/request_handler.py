@@ -1,16 +1,59 @@
+import asyncio
+import inspect
 import json
-from typing import Callable, MutableMapping
+import time
+from dataclasses import replace
+from typing import Awaitable, MutableMapping
 
+from coap_server.blockwise import BlockwiseTransfers
+from coap_server.cache import (
+    CACHE_SIZE,
+    CacheKey,
+    CacheMiss,
+    ResponseCache,
+    cache_key,
+    patch,
+)
+from coap_server.executor import BoundedExecutor
 from coap_server.logger import logger
-from coap_server.resources.base_resource import BaseResource
-from coap_server.utils.constants import CoapCode, CoapMessage
+from coap_server.metrics import UNMATCHED, Metrics
+from coap_server.observe import Observer, ObserverRegistry
+from coap_server.resources.base_resource import BaseResource, ResourceMethod
+from coap_server.resources.metrics import MetricsResource
+from coap_server.router import Route, Router
+from coap_server.utils.constants import (
+    Address,
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+)
 from coap_server.utils.construct_response import construct_response
 from coap_server.utils.exceptions import (
+    BadOptionError,
     BadRequestError,
+    MessageFormatError,
     MethodNotAllowedError,
+    NotAcceptableError,
     NotFoundError,
+    ServiceUnavailableError,
+    UnsupportedContentFormatError,
+)
+from coap_server.utils.parser import (
+    CODES_BY_BYTE,
+    decode_uint,
+    encode_message,
+    encode_uint,
+    parse_message,
 )
-from coap_server.utils.parser import encode_message, parse_message
+
+# Mount point of the resource exposing the metrics
+METRICS_ROUTE = ".well-known/metrics"
+
+
+async def resolve(response: Awaitable[CoapMessage]) -> CoapMessage:
+    """Awaits the response of an asynchronous resource, for `asyncio.run()`."""
+
+    return await response
 
 
 class RequestHandler:
@@ -22,68 +65,401 @@ class RequestHandler:
             "name": Resource(),
             ...
         }
+
+    Every resource is mounted under `/name` and handles the paths listed in
+    its `paths` attribute. Metrics of the handled requests are served under
+    `/.well-known/metrics`, unless `routes` mount another resource there.
+
+    Resource methods run inline, unless an `executor` is given. Then regular
+    (blocking) methods run in its threads, see `coap_server.executor`;
+    methods defined with `async def` are still awaited by the event loop.
+
+    Responses to repeated GET requests are served from a cache of at most
+    `cache_size` bytes, see `coap_server.cache` (0 disables it). Inside of
+    an event loop, identical GET requests arriving while one of them is
+    being handled wait for its response instead of being handled again.
     """
 
-    def __init__(self, routes: MutableMapping[str, BaseResource]):
+    def __init__(
+        self,
+        routes: MutableMapping[str, BaseResource],
+        executor: BoundedExecutor | None = None,
+        cache_size: int = CACHE_SIZE,
+    ):
         self.routes = routes
+        self.executor = executor
+        self.cache = ResponseCache(cache_size) if cache_size > 0 else None
+        # responses of GET requests being handled by the event loop
+        self.inflight: dict[CacheKey, asyncio.Future[bytes]] = {}
+        self.metrics = Metrics()
+        self.router = Router(
+            {METRICS_ROUTE: MetricsResource(self.metrics), **routes}
+        )
+        self.observers = ObserverRegistry()
+        self.blocks = BlockwiseTransfers()
+
+        for resource in self.routes.values():
+            resource.listeners.append(self.observers.changed)
+            if self.cache is not None:
+                resource.listeners.append(self.cache.changed)
 
-    def handle_request(self, data: bytes) -> bytes:
-        request = parse_message(data)
-        logger.debug(f"Handling request: {repr(request)}")
+    def handle_request(
+        self, data: bytes, remote: Address | None = None
+    ) -> bytes | None:
+        """
+        Handles a single datagram and returns the encoded response.
 
+        Returns None if the datagram should be ignored (malformed message).
+        The `remote` address is needed to register observers and to keep
+        the state of block-wise transfers.
+        """
+
+        start = time.perf_counter()
         try:
-            for route, res in self.routes.items():
-                if request.uri.lstrip("/").startswith(route):
-                    resource = res
-                    break
-            else:
-                raise NotFoundError
-
-            method = self.get_resource_method(request, resource)
-            response = method(request)
-            logger.info(f"Request to {request.uri} handled successfully")
-
-        except MethodNotAllowedError:
-            logger.warning(f"Method not allowed for {request.uri}")
-            response = construct_response(
-                request,
-                CoapCode.METHOD_NOT_ALLOWED,
-                json.dumps(
-                    {"error": "Method not allowed for this resource"}
-                ).encode("ascii"),
+            request = parse_message(data)
+        except MessageFormatError as e:
+            return self.handle_format_error(e)
+
+        logger.debug("Handling request: %r", request)
+
+        miss = None
+        key = cache_key(request)
+        if key is not None and self.cache is not None:
+            cached, miss = self.lookup(key, request, data, remote, start)
+            if cached is not None:
+                return cached
+
+        assembled, response = self.blocks.receive(request, remote)
+        if assembled is not None:
+            response = self.observe(
+                assembled, self.process(assembled, start), remote
             )
+            response = self.blocks.respond(request, response, remote)
+        # the block-wise layer returns a request to process or a response
+        assert response is not None
+
+        encoded = encode_message(response)
+        if miss is not None:
+            self.cache.put(miss, response, encoded)  # type: ignore
+        return encoded
+
+    async def handle_request_async(
+        self, data: bytes, remote: Address | None = None
+    ) -> bytes | None:
+        """
+        Counterpart of `handle_request()` to be used inside of an event loop.
+
+        Resource methods defined with `async def` are awaited, so they don't
+        block processing of other requests. Identical GET requests received
+        meanwhile share the response (single flight), see `follow()`.
+        """
+
+        start = time.perf_counter()
+        try:
+            request = parse_message(data)
+        except MessageFormatError as e:
+            return self.handle_format_error(e)
+
+        logger.debug("Handling request: %r", request)
 
+        miss = None
+        flight: asyncio.Future[bytes] | None = None
+        key = cache_key(request)
+        if key is not None:
+            if self.cache is not None:
+                cached, miss = self.lookup(key, request, data, remote, start)
+                if cached is not None:
+                    return cached
+
+            leader = self.inflight.get(key)
+            if leader is not None:
+                return await self.follow(leader, request, data, remote, start)
+            flight = asyncio.get_running_loop().create_future()
+            self.inflight[key] = flight
+
+        try:
+            assembled, response = self.blocks.receive(request, remote)
+            if assembled is not None:
+                response = self.observe(
+                    assembled,
+                    await self.process_async(assembled, start),
+                    remote,
+                )
+                response = self.blocks.respond(request, response, remote)
+            # the block-wise layer returns a request to process or a response
+            assert response is not None
+
+            encoded = encode_message(response)
+        except BaseException as e:
+            if flight is not None:
+                flight.set_exception(e)
+                # retrieved, so that it's not logged without followers
+                flight.exception()
+            raise
+        finally:
+            if flight is not None:
+                del self.inflight[key]  # type: ignore
+
+        if flight is not None:
+            flight.set_result(encoded)
+        if miss is not None:
+            self.cache.put(miss, response, encoded)  # type: ignore
+        return encoded
+
+    async def follow(
+        self,
+        leader: asyncio.Future[bytes],
+        request: CoapMessage,
+        data: bytes,
+        remote: Address | None,
+        start: float,
+    ) -> bytes:
+        """Waits for the response to an identical request being handled."""
+
+        logger.debug("Waiting for a response to %s", request.uri)
+        # cancelling the follower doesn't cancel the leader
+        encoded = await asyncio.shield(leader)
+
+        try:
+            pattern = self.router.resolve_path(request.path).pattern
         except NotFoundError:
-            logger.warning(f"Resource not found: {request.uri}")
-            response = construct_response(
-                request,
-                CoapCode.NOT_FOUND,
-                json.dumps({"error": f"Not found: {request.uri}"}).encode(
-                    "ascii"
-                ),
-            )
+            pattern = UNMATCHED
+        self.served(request, remote, pattern, encoded[1], start)
+        return patch(data, encoded[1], encoded[4 + (encoded[0] & 0x0F) :])
+
+    def served(
+        self,
+        request: CoapMessage,
+        remote: Address | None,
+        pattern: str,
+        code: int,
+        start: float,
+    ):
+        """Bookkeeping of a GET answered with a response to another one."""
+
+        if remote is not None:
+            # GET without Observe cancels observation with the token
+            self.cancel(request, remote)
+        self.metrics.record(
+            CoapCode.GET,
+            pattern,
+            CODES_BY_BYTE[code],
+            time.perf_counter() - start,
+        )
+
+    def lookup(
+        self,
+        key: CacheKey,
+        request: CoapMessage,
+        data: bytes,
+        remote: Address | None,
+        start: float,
+    ) -> tuple[bytes | None, CacheMiss | None]:
+        """
+        Looks the request up in the response cache.
+
+        Returns the encoded response if it's cached, otherwise what's needed
+        to cache the response once it's rendered (None if it can't be).
+        """
+
+        assert self.cache is not None
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.served(request, remote, entry.pattern, entry.code, start)
+            logger.debug("Response to %s served from cache", request.uri)
+            return patch(data, entry.code, entry.tail), None
+
+        try:
+            route = self.router.resolve_path(request.path)
+        except NotFoundError:
+            return None, None
+        return None, self.cache.miss(key, route.pattern, route.resource)
+
+    def process(
+        self, request: CoapMessage, start: float | None = None
+    ) -> CoapMessage:
+        """
+        Passes the request to the resource and returns its response.
+
+        If `start` (a `time.perf_counter()` value) is given, the request is
+        recorded in the metrics with the latency since then.
+        """
+
+        pattern = UNMATCHED
+        try:
+            route, request = self.get_resource(request)
+            pattern = route.pattern
+            method = self.get_resource_method(request, route.resource)
+            if self.executor is None or inspect.iscoroutinefunction(method):
+                response = method(request)
+            else:
+                response = self.executor.call(method, request, start)
+            if inspect.isawaitable(response):
+                # asynchronous resource used outside of the event loop
+                response = asyncio.run(resolve(response))
+            logger.info("Request to %s handled successfully", request.uri)
+
+        except Exception as e:
+            response = self.handle_error(request, e)
 
-        except BadRequestError:
-            logger.error(f"Bad request: {request.uri}")
-            response = construct_response(
-                request,
-                CoapCode.BAD_REQUEST,
-                json.dumps({"error": "Invalid payload"}).encode("ascii"),
+        if start is not None:
+            self.metrics.record(
+                request.header_code,
+                pattern,
+                response.header_code,
+                time.perf_counter() - start,
             )
+        return response
+
+    async def process_async(
+        self, request: CoapMessage, start: float | None = None
+    ) -> CoapMessage:
+        """Counterpart of `process()` awaiting asynchronous resources."""
+
+        pattern = UNMATCHED
+        try:
+            route, request = self.get_resource(request)
+            pattern = route.pattern
+            method = self.get_resource_method(request, route.resource)
+            if self.executor is None or inspect.iscoroutinefunction(method):
+                response = method(request)
+            else:
+                response = await self.executor.call_async(
+                    method, request, start
+                )
+            if inspect.isawaitable(response):
+                response = await response
+            logger.info("Request to %s handled successfully", request.uri)
 
         except Exception as e:
-            logger.critical(f"Unexpected error: {repr(e)}")
-            response = construct_response(
-                request,
-                CoapCode.BAD_REQUEST,
-                json.dumps({"error": repr(e)}).encode("ascii"),
+            response = self.handle_error(request, e)
+
+        if start is not None:
+            self.metrics.record(
+                request.header_code,
+                pattern,
+                response.header_code,
+                time.perf_counter() - start,
+            )
+        return response
+
+    def observe(
+        self,
+        request: CoapMessage,
+        response: CoapMessage,
+        remote: Address | None,
+    ) -> CoapMessage:
+        """
+        Registers or deregisters an observer of the requested resource.
+
+        Successful GET with Observe option set to 0 registers the client,
+        any other GET with the same token cancels the registration.
+        """
+
+        if remote is None or request.header_code != CoapCode.GET:
+            return response
+
+        observe = request.options.get(CoapOption.OBSERVE)
+        if (
+            observe is None
+            or decode_uint(observe) != 0
+            or not response.header_code.value.startswith("2.")
+        ):
+            self.cancel(request, remote)
+            return response
+
+        sequence = self.observers.register(request, remote)
+        logger.info("Registered observer %s of %s", remote, request.uri)
+        return replace(
+            response,
+            options=response.options.updated(
+                {CoapOption.OBSERVE: encode_uint(sequence)}
+            ),
+        )
+
+    def cancel(self, request: CoapMessage, remote: Address):
+        """Deregisters the observer with the token of the request, if any."""
+
+        if not self.observers.observers:
+            return
+        try:
+            uri = request.uri
+        except UnicodeDecodeError:
+            # nobody observes it, observers are registered by valid URIs
+            return
+        self.observers.deregister(uri, remote, request.token)
+
+    def notifications(self) -> list[tuple[Observer, bytes]]:
+        """
+        Renders the changed observed resources and returns notifications.
+
+        Every resource is rendered once, regardless of the observer count.
+        """
+
+        notifications = []
+        for request, observers, sequence in self.observers.take_pending():
+            notifications += self.fan_out(
+                self.process(request), observers, sequence
+            )
+        return notifications
+
+    async def notifications_async(self) -> list[tuple[Observer, bytes]]:
+        """Counterpart of `notifications()` awaiting asynchronous resources."""
+
+        notifications = []
+        for request, observers, sequence in self.observers.take_pending():
+            notifications += self.fan_out(
+                await self.process_async(request), observers, sequence
+            )
+        return notifications
+
+    def fan_out(
+        self, response: CoapMessage, observers: list[Observer], sequence: int
+    ) -> list[tuple[Observer, bytes]]:
+        """Encodes the rendered response for each of the observers."""
+
+        success = response.header_code.value.startswith("2.")
+        options = response.options
+        if success:
+            options = options.updated(
+                {CoapOption.OBSERVE: encode_uint(sequence)}
+            )
+
+        notifications = []
+        for observer in observers:
+            notification = replace(
+                response,
+                header_token_length=len(observer.token),
+                token=observer.token,
+                options=options,
             )
+            # large representations are sent in blocks, the first block is
+            # the notification
+            notification = self.blocks.respond(
+                observer.request, notification, observer.remote
+            )
+            notifications.append((observer, encode_message(notification)))
+
+            if not success:
+                # error response ends the observation
+                self.observers.remove(observer)
+
+        return notifications
+
+    def get_resource(self, request: CoapMessage) -> tuple[Route, CoapMessage]:
+        """
+        Returns the route of the resource registered for the request URI.
+
+        The request is returned with the matched path pattern and the path
+        parameters filled in.
+        """
 
-        return encode_message(response)
+        route = self.router.resolve_path(request.path)
+        return route, request.routed(route.path, route.params)
 
     def get_resource_method(
         self, request: CoapMessage, resource: BaseResource
-    ) -> Callable[[CoapMessage], CoapMessage]:
+    ) -> ResourceMethod:
         """Returns the appropriate resource method based on the CoAP request method code."""
 
         if request.header_code == CoapCode.GET:
@@ -96,3 +472,93 @@ class RequestHandler:
             return resource.delete
 
         raise MethodNotAllowedError
+
+    def handle_format_error(self, error: MessageFormatError) -> bytes | None:
+        """Handles a message which couldn't be parsed."""
+
+        self.metrics.parse_failed()
+        match error:
+            case BadOptionError():
+                logger.warning("Bad option: %s", error)
+                return encode_message(
+                    construct_response(
+                        error.request,
+                        CoapCode.BAD_OPTION,
+                        json.dumps({"error": str(error)}).encode("ascii"),
+                    )
+                )
+
+            case _:
+                logger.warning("Ignoring malformed message: %s", error)
+                return None
+
+    def handle_error(
+        self, request: CoapMessage, error: Exception
+    ) -> CoapMessage:
+        """Translates an exception raised during handling into a response."""
+
+        match error:
+            case MethodNotAllowedError():
+                logger.warning("Method not allowed for %s", request.uri)
+                return construct_response(
+                    request,
+                    CoapCode.METHOD_NOT_ALLOWED,
+                    json.dumps(
+                        {"error": "Method not allowed for this resource"}
+                    ).encode("ascii"),
+                )
+
+            case NotFoundError():
+                logger.warning("Resource not found: %s", request.uri)
+                return construct_response(
+                    request,
+                    CoapCode.NOT_FOUND,
+                    json.dumps({"error": f"Not found: {request.uri}"}).encode(
+                        "ascii"
+                    ),
+                )
+
+            case NotAcceptableError():
+                logger.warning("Not acceptable format for %s", request.uri)
+                return construct_response(
+                    request,
+                    CoapCode.NOT_ACCEPTABLE,
+                    json.dumps(
+                        {"error": "Requested content format not available"}
+                    ).encode("ascii"),
+                )
+
+            case UnsupportedContentFormatError():
+                logger.warning("Unsupported content format: %s", request.uri)
+                return construct_response(
+                    request,
+                    CoapCode.UNSUPPORTED_CONTENT_FORMAT,
+                    json.dumps({"error": "Unsupported content format"}).encode(
+                        "ascii"
+                    ),
+                )
+
+            case ServiceUnavailableError():
+                logger.warning("Service unavailable: %s", error)
+                return construct_response(
+                    request,
+                    CoapCode.SERVICE_UNAVAILABLE,
+                    json.dumps({"error": str(error)}).encode("ascii"),
+                    options={CoapOption.MAX_AGE: encode_uint(error.max_age)},
+                )
+
+            case BadRequestError():
+                logger.error("Bad request: %s", request.uri)
+                return construct_response(
+                    request,
+                    CoapCode.BAD_REQUEST,
+                    json.dumps({"error": "Invalid payload"}).encode("ascii"),
+                )
+
+            case _:
+                logger.critical("Unexpected error: %r", error)
+                return construct_response(
+                    request,
+                    CoapCode.BAD_REQUEST,
+                    json.dumps({"error": repr(error)}).encode("ascii"),
+                )
@@ -1,6 +1,48 @@
-from collections.abc import MutableMapping
+import threading
+import zlib
+from collections.abc import (
+    Awaitable,
+    Callable,
+    Iterator,
+    Mapping,
+    MutableMapping,
+)
+from dataclasses import dataclass, replace
+from typing import Any
 
-from coap_server.utils.constants import CoapMessage
+from coap_server.logger import logger
+from coap_server.observe import observed_path
+from coap_server.utils import content_format
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    ContentFormat,
+    OptionValue,
+)
+from coap_server.utils.construct_response import construct_response
+from coap_server.utils.exceptions import (
+    BadRequestError,
+    NotAcceptableError,
+    UnsupportedContentFormatError,
+)
+from coap_server.utils.parser import decode_uint
+
+# Resource methods may be either regular functions or coroutines
+ResourceMethod = Callable[[CoapMessage], CoapMessage | Awaitable[CoapMessage]]
+
+# Cached representations of a single path (e.g. with different queries)
+MAX_REPRESENTATIONS = 64
+
+
+@dataclass(frozen=True)
+class Representation:
+    """Serialized representation of an URI, see `BaseResource.represent()`."""
+
+    payload: bytes
+    etag: bytes
+    # version of the objects the representation was rendered from
+    version: int
 
 
 class BaseResource:
@@ -9,9 +51,200 @@ class BaseResource:
 
     This class should be inherited by all resources.
     Declares basic methods, that should be implemented by child classes.
+
+    Methods can be overridden with `async def` ones, e.g. when the resource
+    has to wait for I/O. Those are awaited by the server running in asyncio
+    mode, without blocking other requests.
+
+    The resource handles the path patterns listed in `paths`, relative to
+    the name it is registered under, e.g. `/{id:int}/temperature`. The
+    pattern matched by a request and the values of its path parameters are
+    available in `request.route` and `request.params`.
+
+    Representations are available in the content formats listed in
+    `formats`; the client chooses one with the Accept option, the first one
+    is the default.
+
+    Child classes overriding `__init__()` have to call `super().__init__()`.
     """
 
     objects: MutableMapping[int, MutableMapping[str, str | int]]
+    paths: tuple[str, ...] = ("/",)
+    formats: tuple[ContentFormat, ...] = (ContentFormat.JSON,)
+
+    def __init__(self):
+        # callbacks notified about changed paths, e.g. to notify observers
+        self.listeners: list[Callable[..., None]] = []
+        # cached representations by path, then by URI and content format
+        self.representations: dict[
+            str, dict[tuple[str, ContentFormat], Representation]
+        ] = {}
+        # methods may run concurrently in threads of an executor
+        self.lock = threading.Lock()
+
+    def changed(self, *paths: str):
+        """Should be called by child classes when the given paths change."""
+
+        for path in paths:
+            self.representations.pop(observed_path(path), None)
+
+        for listener in self.listeners:
+            listener(*paths)
+
+    def version(self) -> int:
+        """Returns a number which changes whenever the objects change."""
+
+        # some resources (e.g. the metrics) have no objects
+        objects = getattr(self, "objects", None)
+        version = getattr(objects, "version", None)
+        if version is not None:
+            # shared objects may be changed by other processes, which don't
+            # invalidate representations cached by this one
+            return version()
+        return 0
+
+    def negotiate(self, request: CoapMessage) -> ContentFormat:
+        """Returns the format of the response requested by the client."""
+
+        accept = request.options.get(CoapOption.ACCEPT)
+        if accept is None:
+            return self.formats[0]
+
+        number = decode_uint(accept)
+        if number not in self.formats:
+            logger.warning("Content format %s not acceptable", number)
+            raise NotAcceptableError
+        return ContentFormat(number)
+
+    def decode_payload(self, request: CoapMessage) -> Any:
+        """Decodes the request payload according to its Content-Format."""
+
+        option = request.options.get(CoapOption.CONTENT_FORMAT)
+        number = self.formats[0] if option is None else decode_uint(option)
+        if number not in self.formats:
+            logger.warning("Unsupported content format %s", number)
+            raise UnsupportedContentFormatError
+
+        try:
+            return content_format.decode(
+                request.payload, ContentFormat(number)
+            )
+        except ValueError:
+            logger.error("Invalid payload of format %s", number)
+            raise BadRequestError
+
+    def encode_response(
+        self,
+        request: CoapMessage,
+        code: CoapCode,
+        obj: Any,
+        options: Mapping[CoapOption, OptionValue] | None = None,
+    ) -> CoapMessage:
+        """Returns a response with the object in the negotiated format."""
+
+        response_format = self.negotiate(request)
+        return construct_response(
+            request,
+            code,
+            content_format.encode(obj, response_format),
+            response_format,
+            options,
+        )
+
+    def represent(
+        self,
+        request: CoapMessage,
+        render: Callable[[ContentFormat], bytes],
+    ) -> CoapMessage:
+        """
+        Returns 2.05 Content response with the representation of the URI.
+
+        The payload returned by `render` for the negotiated format is cached
+        together with its ETag until `changed()` is called for the path, so
+        it's rendered again only if the objects have changed. If the ETag
+        sent by the client matches (clients may send several of them), 2.03
+        Valid is returned without payload.
+        """
+
+        response_format = self.negotiate(request)
+        version = self.version()
+        key = (request.uri, response_format)
+        uris = self.representations.setdefault(observed_path(request.uri), {})
+        representation = uris.get(key)
+        if representation is None or representation.version != version:
+            payload = render(response_format)
+            representation = Representation(
+                payload, zlib.crc32(payload).to_bytes(4, "big"), version
+            )
+            if len(uris) >= MAX_REPRESENTATIONS:
+                uris.clear()
+            uris[key] = representation
+
+        options = {CoapOption.ETAG: representation.etag}
+        if representation.etag in request.options.all(CoapOption.ETAG):
+            return construct_response(
+                request, CoapCode.VALID, b"", options=options
+            )
+        return construct_response(
+            request,
+            CoapCode.CONTENT,
+            representation.payload,
+            response_format,
+            options,
+        )
+
+    def stream(
+        self,
+        request: CoapMessage,
+        chunks: Callable[[ContentFormat], Iterator[bytes]],
+    ) -> CoapMessage:
+        """
+        Returns 2.05 Content response whose payload is produced by `chunks`.
+
+        Unlike `represent()`, the payload is never held in memory as a whole.
+        Only the block requested by the client is encoded when the response
+        is sent, so `chunks` may be called again for the following blocks.
+        """
+
+        response_format = self.negotiate(request)
+        response = construct_response(
+            request, CoapCode.CONTENT, b"", response_format
+        )
+        return replace(response, stream=lambda: chunks(response_format))
+
+    def create_object(self, obj: MutableMapping[str, str | int]) -> int:
+        """Stores a new object under the next free ID and returns the ID."""
+
+        create = getattr(self.objects, "create", None)
+        if create is not None:
+            # stores and shared objects allocate the ID under their lock
+            return create(obj)
+
+        with self.lock:
+            new_id = max(self.objects.keys(), default=0) + 1
+            self.objects[new_id] = obj
+        return new_id
+
+    def merge_objects(
+        self, patches: Mapping[int, MutableMapping[str, str | int]]
+    ) -> list[int]:
+        """
+        Merges every patch into the object with its ID, all or none.
+
+        Returns the IDs of missing objects, in which case nothing changes.
+        """
+
+        merge = getattr(self.objects, "merge", None)
+        if merge is not None:
+            # shared objects and stores apply the patches under their lock
+            return merge(patches)
+
+        with self.lock:
+            missing = [key for key in patches if key not in self.objects]
+            if not missing:
+                for key, patch in patches.items():
+                    self.objects[key] = {**self.objects[key], **patch}
+        return missing
 
     def get(self, request: CoapMessage) -> CoapMessage:
         raise NotImplementedError("GET method not implemented.")
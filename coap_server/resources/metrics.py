@@ -0,0 +1,30 @@
+from coap_server.metrics import Metrics
+from coap_server.resources.base_resource import BaseResource
+from coap_server.utils.constants import CoapCode, CoapMessage, ContentFormat
+from coap_server.utils.construct_response import construct_response
+
+
+class MetricsResource(BaseResource):
+    """
+    Read-only CoAP resource exposing the metrics of the server.
+
+    The metrics are returned as JSON, or in the Prometheus text format when
+    requested with `Accept: 0` (text/plain).
+    """
+
+    formats = (ContentFormat.JSON, ContentFormat.TEXT_PLAIN)
+
+    def __init__(self, metrics: Metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def get(self, request: CoapMessage) -> CoapMessage:
+        response_format = self.negotiate(request)
+        if response_format == ContentFormat.TEXT_PLAIN:
+            payload = self.metrics.to_prometheus()
+        else:
+            payload = self.metrics.to_json()
+
+        return construct_response(
+            request, CoapCode.CONTENT, payload, response_format
+        )
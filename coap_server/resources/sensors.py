@@ -1,21 +1,85 @@
-import json
-from typing import MutableMapping
-
+from enum import Enum
+from itertools import islice
+from typing import Any, Iterable, Iterator, MutableMapping
+
+from coap_server.history import (
+    MAX_TEMPERATURE,
+    MIN_TEMPERATURE,
+    RESOLUTION,
+    Aggregate,
+    History,
+)
 from coap_server.logger import logger
 from coap_server.resources.base_resource import BaseResource
-from coap_server.utils.constants import CoapCode, CoapMessage
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    ContentFormat,
+    Options,
+)
 from coap_server.utils.construct_response import construct_response
+from coap_server.utils.content_format import encode, encode_items
 from coap_server.utils.exceptions import (
     BadRequestError,
     MethodNotAllowedError,
     NotFoundError,
 )
 
+# Largest collection rendered (and cached) at once, larger ones are streamed
+MAX_RENDERED = 1000
+
+# Status of a valid update of a batch which was rejected due to other ones
+NOT_APPLIED = 0
+
+Sensor = MutableMapping[str, str | int]
+
+
+class SensorPath(str, Enum):
+    """Paths handled by `SensorsResource`, relative to its mount point."""
+
+    SENSORS = "/"
+    SENSOR = "/{id:int}"
+    TEMPERATURE = "/{id:int}/temperature"
+    BATCH = "/batch"
+    HISTORY = "/{id:int}/history"
+
+
+def valid_temperature(value: Any) -> bool:
+    """Returns whether the value is an integer in the range of the history."""
+
+    return (
+        isinstance(value, int)
+        and not isinstance(value, bool)
+        and MIN_TEMPERATURE <= value <= MAX_TEMPERATURE
+    )
+
+
+def status(code: CoapCode) -> int:
+    """Status of an update in a batch, the code as a number (2.04 is 204)."""
+
+    return int(code.value.replace(".", ""))
+
 
 class SensorsResource(BaseResource):
     """
     CoAP resource representing sensors which can measure temperature.
 
+    The collection at `/sensors` can be paginated and filtered with query
+    parameters `offset`, `limit` and `min_temp`, e.g.
+    `/sensors?min_temp=20&offset=100&limit=50`.
+
+    Temperatures of many sensors can be updated at once by POST to
+    `/sensors/batch` with an array of `[id, temperature]` pairs, see
+    `post_batch()`.
+
+    Every change of a temperature is recorded in `history`, served at
+    `/sensors/{id}/history?since=`, or aggregated with
+    `/sensors/{id}/history?since=&agg=min|max|avg&window=`.
+
+    Representations are JSON by default, or CBOR if requested with
+    `Accept: 60`; payloads of requests may be in either format as well.
+
     Example `objects` to be passed to constructor:
         objects = {
            1: {
@@ -26,200 +90,422 @@ class SensorsResource(BaseResource):
         }
     """
 
+    paths = tuple(SensorPath)
+    formats = (ContentFormat.JSON, ContentFormat.CBOR)
+
     def __init__(
-        self, objects: MutableMapping[int, MutableMapping[str, str | int]]
+        self,
+        objects: MutableMapping[int, MutableMapping[str, str | int]],
+        history: History | None = None,
     ):
+        super().__init__()
         self.objects = objects
+        self.history = History() if history is None else history
 
     def validate_data(self, data: dict) -> bool:
         """Validates the received sensor data."""
 
         keys = {"name", "temperature"}
-        valid = set(data.keys()) == keys and isinstance(
-            data["temperature"], int
+        # the payload may be decoded to any type, e.g. a list from CBOR or
+        # a name as a byte string, which can't be encoded to JSON
+        valid = (
+            isinstance(data, dict)
+            and set(data.keys()) == keys
+            and isinstance(data["name"], str)
+            and valid_temperature(data["temperature"])
         )
 
         if not valid:
-            logger.warning(f"Validation failed for data: {data}")
+            logger.warning("Validation failed for data: %s", data)
 
         return valid
 
-    def get(self, request: CoapMessage) -> CoapMessage:
-        logger.info(f"Received GET request for URI: {request.uri}")
-
-        match request.uri.strip("/").split("/"):
-            case ["sensors"]:
-                logger.debug("Returning all sensor data")
-                response = construct_response(
-                    request,
-                    CoapCode.CONTENT,
-                    json.dumps(self.objects).encode("ascii"),
-                )
+    def sensor_paths(self, sensor_id: int) -> tuple[str, ...]:
+        """Paths whose representation depends on the given sensor."""
 
-            case ["sensors", sensor_id_str]:
-                try:
-                    sensor_id = int(sensor_id_str)
-                    obj = self.objects[sensor_id]
-                    logger.debug(f"Returning data for sensor {sensor_id}")
-                except (ValueError, KeyError):
-                    logger.error(f"Sensor {sensor_id_str} not found")
-                    raise NotFoundError
+        return (
+            "/sensors",
+            f"/sensors/{sensor_id}",
+            f"/sensors/{sensor_id}/temperature",
+            f"/sensors/{sensor_id}/history",
+        )
 
-                response = construct_response(
-                    request,
-                    CoapCode.CONTENT,
-                    json.dumps(obj).encode("ascii"),
-                )
+    def parse_query(
+        self, request: CoapMessage
+    ) -> tuple[int, int | None, int | None]:
+        """Returns `offset`, `limit` and `min_temp` of the query."""
+
+        query = request.query
+        try:
+            offset = int(query.get("offset", 0))
+            limit = int(query["limit"]) if "limit" in query else None
+            min_temp = int(query["min_temp"]) if "min_temp" in query else None
+        except ValueError:
+            logger.error("Invalid query: %s", request.uri)
+            raise BadRequestError
+
+        if offset < 0 or (limit is not None and limit < 0):
+            logger.error("Invalid query: %s", request.uri)
+            raise BadRequestError
+        return offset, limit, min_temp
+
+    def parse_history_query(
+        self, request: CoapMessage
+    ) -> tuple[float, Aggregate | None, int]:
+        """Returns `since`, `agg` and `window` of a history query."""
+
+        query = request.query
+        try:
+            since = float(query.get("since", 0))
+            function = Aggregate(query["agg"]) if "agg" in query else None
+            window = int(query.get("window", RESOLUTION))
+        except ValueError:
+            logger.error("Invalid query: %s", request.uri)
+            raise BadRequestError
+
+        if window <= 0 or window % RESOLUTION:
+            # windows consist of whole buckets of the aggregates
+            logger.error("Invalid aggregation window: %s", request.uri)
+            raise BadRequestError
+        return since, function, window
+
+    def parse_batch(self, updates: Any) -> list[tuple[int, int] | None]:
+        """Returns (ID, temperature) of every update, None if invalid."""
+
+        if not isinstance(updates, list):
+            logger.error("Batch is not an array")
+            raise BadRequestError
+
+        return [
+            (update[0], update[1])
+            if isinstance(update, list)
+            and len(update) == 2
+            and isinstance(update[0], int)
+            and not isinstance(update[0], bool)
+            and valid_temperature(update[1])
+            else None
+            for update in updates
+        ]
+
+    def select(
+        self,
+        items: Iterable[tuple[int, Sensor | None]],
+        offset: int,
+        limit: int | None,
+        min_temp: int | None,
+    ) -> Iterator[tuple[int, Sensor]]:
+        """Filters and paginates sensors, skipping deleted ones (None)."""
+
+        selected = (
+            (key, obj)
+            for key, obj in items
+            if obj is not None
+            and (min_temp is None or int(obj["temperature"]) >= min_temp)
+        )
+        end = None if limit is None else offset + limit
+        return islice(selected, offset, end)
 
-            case ["sensors", sensor_id_str, "temperature"]:
-                try:
-                    sensor_id = int(sensor_id_str)
-                    obj = self.objects[sensor_id]
-                    value = obj["temperature"]
-                    logger.debug(
-                        f"Returning temperature for sensor {sensor_id}: {value}"
+    def get(self, request: CoapMessage) -> CoapMessage:
+        logger.info("Received GET request for URI: %s", request.uri)
+
+        match request.route:
+            case SensorPath.SENSORS:
+                offset, limit, min_temp = self.parse_query(request)
+
+                if len(self.objects) > MAX_RENDERED and (
+                    limit is None or limit > MAX_RENDERED
+                ):
+
+                    def chunks(
+                        response_format: ContentFormat,
+                    ) -> Iterator[bytes]:
+                        logger.debug("Streaming sensor data")
+                        # sensors are looked up one by one, so they may be
+                        # changed between the blocks
+                        keys = list(self.objects.keys())
+                        items = ((key, self.objects.get(key)) for key in keys)
+                        yield from encode_items(
+                            self.select(items, offset, limit, min_temp),
+                            response_format,
+                        )
+
+                    return self.stream(request, chunks)
+
+                def render(response_format: ContentFormat) -> bytes:
+                    logger.debug("Returning sensor data")
+                    items = list(self.objects.items())
+                    return b"".join(
+                        encode_items(
+                            self.select(items, offset, limit, min_temp),
+                            response_format,
+                        )
                     )
-                except (ValueError, KeyError):
-                    logger.error(f"Sensor {sensor_id_str} not found")
-                    raise NotFoundError
 
-                response = construct_response(
-                    request,
-                    CoapCode.CONTENT,
-                    str(value).encode("ascii"),
-                )
+            case SensorPath.SENSOR:
+                sensor_id = request.params["id"]
+
+                def render(response_format: ContentFormat) -> bytes:
+                    try:
+                        obj = self.objects[sensor_id]
+                        logger.debug("Returning data for sensor %s", sensor_id)
+                    except KeyError:
+                        logger.error("Sensor %s not found", sensor_id)
+                        raise NotFoundError
+
+                    return encode(obj, response_format)
+
+            case SensorPath.TEMPERATURE:
+                sensor_id = request.params["id"]
+
+                def render(response_format: ContentFormat) -> bytes:
+                    try:
+                        obj = self.objects[sensor_id]
+                        value = obj["temperature"]
+                        logger.debug(
+                            "Returning temperature for sensor %s: %s",
+                            sensor_id,
+                            value,
+                        )
+                    except KeyError:
+                        logger.error("Sensor %s not found", sensor_id)
+                        raise NotFoundError
+
+                    return encode(value, response_format)
+
+            case SensorPath.HISTORY:
+                sensor_id = request.params["id"]
+                since, function, window = self.parse_history_query(request)
+
+                def render(response_format: ContentFormat) -> bytes:
+                    if sensor_id not in self.objects:
+                        logger.error("Sensor %s not found", sensor_id)
+                        raise NotFoundError
+
+                    logger.debug("Returning history of sensor %s", sensor_id)
+                    if function is None:
+                        return encode(
+                            self.history.since(sensor_id, since),
+                            response_format,
+                        )
+                    aggregates = self.history.aggregate(
+                        sensor_id, since, window, function
+                    )
+                    return encode(aggregates, response_format)
+
+            case SensorPath.BATCH:
+                raise MethodNotAllowedError
 
             case _:
-                logger.error(f"Invalid GET request path: {request.uri}")
+                logger.error("Invalid GET request path: %s", request.uri)
                 raise NotFoundError
 
-        return response
+        # rendered only if the sensors have changed since the last request
+        return self.represent(request, render)
 
     def post(self, request: CoapMessage) -> CoapMessage:
-        logger.info(f"Received POST request for URI: {request.uri}")
+        logger.info("Received POST request for URI: %s", request.uri)
 
-        match request.uri.strip("/").split("/"):
-            case ["sensors"]:
-                try:
-                    obj = json.loads(request.payload.decode())
-                    logger.debug("Parsed request payload successfully")
-                except json.JSONDecodeError:
-                    logger.error("Invalid JSON in request payload")
-                    raise BadRequestError
+        match request.route:
+            case SensorPath.SENSORS:
+                # fails before anything is created, if it's going to
+                self.negotiate(request)
+                obj = self.decode_payload(request)
+                logger.debug("Parsed request payload successfully")
 
                 if not self.validate_data(obj):
                     raise BadRequestError
 
-                new_id = max(self.objects.keys(), default=0) + 1
-                self.objects[new_id] = obj
-
-                logger.debug(f"Created new sensor {new_id}: {obj}")
-
-                response = construct_response(
-                    request, CoapCode.CREATED, json.dumps(obj).encode("ascii")
+                new_id = self.create_object(obj)
+                try:
+                    self.history.record({new_id: int(obj["temperature"])})
+                finally:
+                    self.changed("/sensors")
+
+                logger.debug("Created new sensor %s: %s", new_id, obj)
+
+                # the URI of the new sensor, e.g. sensors/5
+                location = Options(
+                    (CoapOption.LOCATION_PATH, segment)
+                    for segment in [
+                        *request.options.all(CoapOption.URI_PATH),
+                        str(new_id).encode(),
+                    ]
+                )
+                response = self.encode_response(
+                    request, CoapCode.CREATED, obj, location
                 )
 
-            case ["sensors", _]:
-                raise MethodNotAllowedError
+            case SensorPath.BATCH:
+                response = self.post_batch(request)
 
-            case ["sensors", _, "temperature"]:
+            case (
+                SensorPath.SENSOR
+                | SensorPath.TEMPERATURE
+                | SensorPath.HISTORY
+            ):
                 raise MethodNotAllowedError
 
             case _:
-                logger.error(f"Invalid POST request path: {request.uri}")
+                logger.error("Invalid POST request path: %s", request.uri)
                 raise NotFoundError
 
         return response
 
+    def post_batch(self, request: CoapMessage) -> CoapMessage:
+        """
+        Updates temperatures of many sensors at once, all or none.
+
+        The response carries the status of every update: 204 if applied,
+        400 if invalid, 404 if the sensor doesn't exist, or 0 if valid but
+        not applied because of the other ones. Sensors are looked up only if
+        all the updates are valid.
+        """
+
+        self.negotiate(request)
+        updates = self.parse_batch(self.decode_payload(request))
+        valid = [update for update in updates if update is not None]
+        invalid = len(valid) < len(updates)
+
+        # later updates of the same sensor override earlier ones
+        patches: dict[int, Sensor] = {
+            sensor_id: {"temperature": temperature}
+            for sensor_id, temperature in valid
+        }
+        missing: set[int] = (
+            set() if invalid else set(self.merge_objects(patches))
+        )
+
+        if invalid or missing:
+            statuses = [
+                status(CoapCode.BAD_REQUEST)
+                if update is None
+                else status(CoapCode.NOT_FOUND)
+                if update[0] in missing
+                else NOT_APPLIED
+                for update in updates
+            ]
+            logger.warning("Rejected batch of %d updates", len(updates))
+            return self.encode_response(
+                request,
+                CoapCode.BAD_REQUEST if invalid else CoapCode.NOT_FOUND,
+                statuses,
+            )
+
+        paths = dict.fromkeys(
+            path
+            for sensor_id in patches
+            for path in self.sensor_paths(sensor_id)
+        )
+        try:
+            self.history.record(
+                {
+                    sensor_id: int(patch["temperature"])
+                    for sensor_id, patch in patches.items()
+                }
+            )
+        finally:
+            self.changed(*paths)
+        logger.debug("Updated %d sensors in a batch", len(patches))
+
+        statuses = [status(CoapCode.CHANGED)] * len(updates)
+        return self.encode_response(request, CoapCode.CHANGED, statuses)
+
     def put(self, request: CoapMessage) -> CoapMessage:
-        logger.info(f"Received PUT request for URI: {request.uri}")
+        logger.info("Received PUT request for URI: %s", request.uri)
 
-        match request.uri.strip("/").split("/"):
-            case ["sensors", sensor_id_str]:
-                try:
-                    sensor_id = int(sensor_id_str)
-                    obj = json.loads(request.payload.decode())
-                    logger.debug(
-                        f"Updating sensor {sensor_id} with data: {obj}"
-                    )
-                except json.JSONDecodeError:
-                    logger.error("Invalid JSON in request payload")
-                    raise BadRequestError
-                except ValueError:
-                    logger.error(f"Invalid sensor ID: {sensor_id_str}")
-                    raise NotFoundError
+        match request.route:
+            case SensorPath.SENSOR:
+                sensor_id = request.params["id"]
+                self.negotiate(request)
+                obj = self.decode_payload(request)
+                logger.debug(
+                    "Updating sensor %s with data: %s", sensor_id, obj
+                )
 
                 if not self.validate_data(obj):
                     raise BadRequestError
 
                 if sensor_id not in self.objects:
-                    logger.error(f"Sensor {sensor_id} not found for update")
+                    logger.error("Sensor %s not found for update", sensor_id)
                     raise NotFoundError
 
                 self.objects[sensor_id] = obj
-                logger.debug(f"Updated sensor {sensor_id}")
-
-                response = construct_response(
-                    request, CoapCode.CHANGED, json.dumps(obj).encode("ascii")
-                )
-
-            case ["sensors", sensor_id_str, "temperature"]:
                 try:
-                    sensor_id = int(sensor_id_str)
-                    new_temp = int(request.payload.decode())
-                    logger.debug(
-                        f"Updating temperature for sensor {sensor_id} to {new_temp}"
-                    )
-                except ValueError:
+                    self.history.record({sensor_id: int(obj["temperature"])})
+                finally:
+                    self.changed(*self.sensor_paths(sensor_id))
+                logger.debug("Updated sensor %s", sensor_id)
+
+                response = self.encode_response(request, CoapCode.CHANGED, obj)
+
+            case SensorPath.TEMPERATURE:
+                sensor_id = request.params["id"]
+                self.negotiate(request)
+                new_temp = self.decode_payload(request)
+                if not valid_temperature(new_temp):
                     logger.error("Invalid temperature update format")
                     raise BadRequestError
+                logger.debug(
+                    "Updating temperature for sensor %s to %s",
+                    sensor_id,
+                    new_temp,
+                )
 
                 if sensor_id not in self.objects:
-                    logger.error(f"Sensor {sensor_id} not found")
+                    logger.error("Sensor %s not found", sensor_id)
                     raise NotFoundError
 
-                self.objects[sensor_id]["temperature"] = new_temp
+                # objects are replaced as a whole, so the change is also
+                # visible when they are shared between processes
+                obj = {**self.objects[sensor_id], "temperature": new_temp}
+                self.objects[sensor_id] = obj
+                try:
+                    self.history.record({sensor_id: new_temp})
+                finally:
+                    self.changed(*self.sensor_paths(sensor_id))
                 logger.debug(
-                    f"Updated temperature for sensor {sensor_id}: {new_temp}"
+                    "Updated temperature for sensor %s: %s",
+                    sensor_id,
+                    new_temp,
                 )
 
-                response = construct_response(
-                    request,
-                    CoapCode.CHANGED,
-                    json.dumps(self.objects[sensor_id]).encode("ascii"),
-                )
+                response = self.encode_response(request, CoapCode.CHANGED, obj)
+
+            case SensorPath.BATCH | SensorPath.HISTORY:
+                raise MethodNotAllowedError
 
             case _:
-                logger.error(f"Invalid PUT request path: {request.uri}")
+                logger.error("Invalid PUT request path: %s", request.uri)
                 raise NotFoundError
 
         return response
 
     def delete(self, request: CoapMessage) -> CoapMessage:
-        logger.info(f"Received DELETE request for URI: {request.uri}")
-
-        match request.uri.strip("/").split("/"):
-            case ["sensors", sensor_id_str]:
-                try:
-                    sensor_id = int(sensor_id_str)
-                except ValueError:
-                    logger.error(f"Invalid sensor ID format: {sensor_id_str}")
-                    raise NotFoundError
+        logger.info("Received DELETE request for URI: %s", request.uri)
 
+        match request.route:
+            case SensorPath.SENSOR:
+                sensor_id = request.params["id"]
                 if sensor_id not in self.objects:
-                    logger.error(f"Sensor {sensor_id} not found for deletion")
+                    logger.error("Sensor %s not found for deletion", sensor_id)
                     raise NotFoundError
 
                 self.objects.pop(sensor_id)
-                logger.debug(f"Deleted sensor {sensor_id}")
+                self.history.forget(sensor_id)
+                self.changed(*self.sensor_paths(sensor_id))
+                logger.debug("Deleted sensor %s", sensor_id)
 
                 response = construct_response(request, CoapCode.DELETED, b"")
 
-            case ["sensors", sensor_id, "temperature"]:
+            case (
+                SensorPath.TEMPERATURE
+                | SensorPath.BATCH
+                | SensorPath.HISTORY
+            ):
                 raise MethodNotAllowedError
 
             case _:
-                logger.error(f"Invalid DELETE request path: {request.uri}")
+                logger.error("Invalid DELETE request path: %s", request.uri)
                 raise NotFoundError
 
         return response
@@ -0,0 +1,152 @@
+"""
+Module providing routing of requests to resources.
+
+Routes are compiled into a trie keyed by URI path segments, so resolving
+a request takes one dictionary lookup per segment, regardless of the number
+of routes. Segments of a route may be path parameters, e.g.
+`/sensors/{id:int}/temperature`, whose values are converted and passed to
+the resource in `CoapMessage.params`.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, MutableMapping, Sequence
+
+from coap_server.resources.base_resource import BaseResource
+from coap_server.utils.exceptions import NotFoundError
+
+
+def to_int(segment: str) -> int:
+    # int() would also accept e.g. " 1", "+1" or "1_000"
+    if not (segment.isascii() and segment.isdigit()):
+        raise ValueError(f"Not an integer: {segment}")
+    return int(segment)
+
+
+# Types of path parameters, `{name}` is the same as `{name:str}`
+CONVERTERS: dict[str, Callable[[str], Any]] = {
+    "int": to_int,
+    "str": str,
+}
+
+
+def split_path(path: str) -> list[str]:
+    """Split the path of an URI (without query) into segments."""
+
+    path = path.split("?", 1)[0].strip("/")
+    return path.split("/") if path else []
+
+
+@dataclass(frozen=True)
+class Route:
+    """Route resolved for a request."""
+
+    resource: BaseResource
+    # pattern as declared by the resource in `paths`
+    path: str
+    params: dict[str, Any]
+    # full pattern including the mount point, e.g. `/sensors/{id:int}`
+    pattern: str
+
+
+@dataclass
+class Node:
+    """Node of the routing trie, corresponding to a single path segment."""
+
+    static: dict[str, "Node"] = field(default_factory=dict)
+    # (name, converter, node) tried in order when no static segment matches
+    params: list[tuple[str, Callable[[str], Any], "Node"]] = field(
+        default_factory=list
+    )
+    # resource, its path pattern and the full one, if a route ends here
+    target: tuple[BaseResource, str, str] | None = None
+
+
+class Router:
+    """
+    Resolves request URIs to resources.
+
+    Every resource is mounted under its name in `routes` and registers the
+    path patterns listed in its `paths` attribute, relative to the mount
+    point. Static segments take precedence over path parameters.
+    """
+
+    def __init__(self, routes: MutableMapping[str, BaseResource]):
+        self.root = Node()
+        for name, resource in routes.items():
+            mount = "/" + name.strip("/")
+            for path in resource.paths:
+                self.add(mount + path.rstrip("/"), resource, path)
+
+    def add(self, pattern: str, resource: BaseResource, path: str):
+        """Adds a route, `path` is passed on to the resource as is."""
+
+        node = self.root
+        for segment in split_path(pattern):
+            if segment.startswith("{") and segment.endswith("}"):
+                name, _, kind = segment[1:-1].partition(":")
+                converter = CONVERTERS.get(kind or "str")
+                if converter is None:
+                    raise ValueError(f"Unknown parameter type in {pattern}")
+
+                for other, other_converter, child in node.params:
+                    if other == name and other_converter is converter:
+                        node = child
+                        break
+                else:
+                    child = Node()
+                    node.params.append((name, converter, child))
+                    node = child
+            else:
+                node = node.static.setdefault(segment, Node())
+
+        if node.target is not None:
+            raise ValueError(f"Route {pattern} is already registered")
+        node.target = (resource, path, "/" + "/".join(split_path(pattern)))
+
+    def resolve(self, uri: str) -> Route:
+        """Returns the route of the URI, raises NotFoundError if none."""
+
+        return self.resolve_path(split_path(uri))
+
+    def resolve_path(self, segments: Sequence[str]) -> Route:
+        """Returns the route of the path segments, e.g. `CoapMessage.path`."""
+
+        params: dict[str, Any] = {}
+        target = self.find(self.root, segments, 0, params)
+        if target is None:
+            raise NotFoundError
+
+        resource, path, pattern = target
+        return Route(resource, path, params, pattern)
+
+    def find(
+        self,
+        node: Node,
+        segments: Sequence[str],
+        index: int,
+        params: dict[str, Any],
+    ) -> tuple[BaseResource, str, str] | None:
+        """Walks the trie, backtracking if a parameter leads nowhere."""
+
+        if index == len(segments):
+            return node.target
+
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            target = self.find(child, segments, index + 1, params)
+            if target is not None:
+                return target
+
+        for name, converter, child in node.params:
+            try:
+                params[name] = converter(segment)
+            except ValueError:
+                continue
+
+            target = self.find(child, segments, index + 1, params)
+            if target is not None:
+                return target
+            del params[name]
+
+        return None
@@ -1,15 +1,150 @@
+import asyncio
+import select
 import signal
 import socket
-from typing import MutableMapping
+from enum import Enum
+from typing import MutableMapping, Sequence
 
+from coap_server.batch_io import BatchIO, batch_io
+from coap_server.cache import CACHE_SIZE
+from coap_server.executor import BoundedExecutor
 from coap_server.logger import logger
+from coap_server.messaging import MessageLayer
+from coap_server.multicast import (
+    check_group,
+    group_socket,
+    reply_address,
+    server_socket,
+)
+from coap_server.ratelimit import RateLimiter
 from coap_server.request_handler import RequestHandler
 from coap_server.resources.base_resource import BaseResource
+from coap_server.utils.constants import (
+    DEFAULT_LEISURE,
+    MAX_MESSAGE_SIZE,
+    Address,
+)
+
+# How often the asyncio mode checks for messages to retransmit, in seconds
+RETRANSMIT_INTERVAL = 0.25
+
+
+class ServerMode(str, Enum):
+    """Enum representing the I/O models supported by the server."""
+
+    SYNC = "sync"
+    ASYNCIO = "asyncio"
+    BATCH = "batch"
+
+
+class CoAPProtocol(asyncio.DatagramProtocol):
+    """
+    Asyncio datagram protocol used by the server in `ServerMode.ASYNCIO`.
+
+    Every received datagram is dispatched as a separate task, so a slow
+    (asynchronous) resource method doesn't delay responses to other clients.
+    """
+
+    def __init__(self, messaging: MessageLayer):
+        self.messaging = messaging
+        self.transport: asyncio.DatagramTransport | None = None
+        self.tasks: set[asyncio.Task] = set()
+        self.notifying: asyncio.Task | None = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr, group: bool = False):
+        logger.debug("Received data from %s", addr)
+
+        task = asyncio.ensure_future(self.respond(data, addr, group))
+        # keep a reference, otherwise the task may be garbage collected
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def error_received(self, exc):
+        logger.error("Server error: %s", exc)
+
+    def send(self, data: bytes, addr: Address):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.sendto(data, addr)
+            logger.debug("Sent response to %s", addr)
+
+    async def respond(self, data: bytes, addr: Address, group: bool):
+        try:
+            response = await self.messaging.receive_async(
+                data, addr, self.send, group
+            )
+        except Exception as e:
+            logger.error("Failed to handle request from %s: %r", addr, e)
+            return
+
+        if response is not None:
+            self.send(response, addr)
+
+        if self.messaging.handler.observers.pending and self.notifying is None:
+            # changes made by all the requests handled until the task starts
+            # are sent out together
+            self.notifying = asyncio.ensure_future(self.notify())
+
+    async def notify(self):
+        try:
+            for data, addr in await self.messaging.notifications_async():
+                self.send(data, addr)
+        finally:
+            self.notifying = None
+
+    async def retransmit(self):
+        """
+        Periodically resend unacknowledged confirmable messages and send
+        the deferred responses to group requests.
+        """
+
+        while True:
+            await asyncio.sleep(RETRANSMIT_INTERVAL)
+            for data, addr in self.messaging.due():
+                self.send(data, addr)
+
+
+class GroupProtocol(asyncio.DatagramProtocol):
+    """
+    Asyncio datagram protocol receiving the requests sent to a group.
+
+    Requests are handled by the unicast `protocol`, which sends the
+    responses as well.
+    """
+
+    def __init__(self, protocol: CoAPProtocol, family: int):
+        self.protocol = protocol
+        self.family = family
+
+    def datagram_received(self, data: bytes, addr):
+        self.protocol.datagram_received(
+            data, reply_address(self.family, addr), group=True
+        )
+
+    def error_received(self, exc):
+        logger.error("Server error: %s", exc)
 
 
 class CoAPServer:
     """
     A simple CoAP server for handling CoAP requests and responses.
+
+    The socket is bound in the constructor, so datagrams sent after the server
+    has been created are queued by the kernel until `start()` is called.
+
+    With an `executor`, blocking resource methods run in its threads while
+    the event loop keeps receiving datagrams. It's supported by the asyncio
+    mode only: the other modes handle one request at a time, so they would
+    still wait for every method and the queue would never fill. A `limiter`
+    rejects requests of clients exceeding their rate. Responses are cached
+    up to `cache_size` bytes, see `RequestHandler`.
+
+    The host may be an IPv6 address, `::` accepts both IPv4 and IPv6
+    clients. The server joins the multicast `groups` (e.g. the ones returned
+    by `all_coap_nodes()`) on the given `interface`, and answers requests
+    sent to them within `leisure` seconds, see `MessageLayer`.
     """
 
     def __init__(
@@ -17,30 +152,95 @@ class CoAPServer:
         routes: MutableMapping[str, BaseResource],
         host="127.0.0.1",
         port=5683,
+        mode: ServerMode = ServerMode.SYNC,
+        reuse_port: bool = False,
+        executor: BoundedExecutor | None = None,
+        limiter: RateLimiter | None = None,
+        cache_size: int = CACHE_SIZE,
+        groups: Sequence[str] = (),
+        interface: str | None = None,
+        leisure: float = DEFAULT_LEISURE,
     ):
+        if executor is not None and mode != ServerMode.ASYNCIO:
+            raise ValueError("An executor requires the asyncio mode")
+
         self.host = host
         self.port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.mode = mode
+        for group in groups:
+            check_group(host, group)
+        self.sock = server_socket(host, port, reuse_port, bool(groups))
+        self.groups = list(groups)
+        self.group_socks: list[socket.socket] = []
+        try:
+            for group in groups:
+                self.group_socks.append(group_socket(group, port, interface))
+        except BaseException:
+            self.close()
+            raise
         self.routes = routes
-        self.handler = RequestHandler(self.routes)
+        self.executor = executor
+        self.handler = RequestHandler(self.routes, executor, cache_size)
+        self.messaging = MessageLayer(
+            self.handler, limiter=limiter, leisure=leisure
+        )
         self.running = False
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.stopped: asyncio.Event | None = None
 
         signal.signal(signal.SIGTERM, self.handle_sigterm)
 
     def start(self):
         self.running = True
-        self.sock.bind((self.host, self.port))
+        logger.info(
+            "CoAP Server started on %s:%s (%s mode)",
+            self.host,
+            self.port,
+            self.mode.value,
+        )
+        if self.groups:
+            logger.info("Joined groups %s", ", ".join(self.groups))
+
+        if self.mode == ServerMode.ASYNCIO:
+            try:
+                asyncio.run(self.serve_async())
+            except KeyboardInterrupt:
+                logger.info("Received Ctrl+C, shutting down...")
+                self.shutdown()
+        elif self.mode == ServerMode.BATCH:
+            self.serve_batch()
+        else:
+            self.serve()
+
+    def serve(self):
+        """Blocking receive loop, handling one datagram at a time."""
+
         self.sock.settimeout(1)
-        logger.info(f"CoAP Server started on {self.host}:{self.port}")
 
         while self.running:
             try:
-                data, addr = self.sock.recvfrom(1024)
-                logger.debug(f"Received data from {addr}")
+                # retransmissions and notifications about changes made by
+                # the previous request
+                for data, addr in self.messaging.due():
+                    self.sock.sendto(data, addr)
+                for data, addr in self.messaging.notifications():
+                    self.sock.sendto(data, addr)
+
+                if self.group_socks:
+                    sock = self.readable()
+                    if sock is not self.sock:
+                        self.receive_group(sock)
+                        continue
+
+                data, addr = self.sock.recvfrom(MAX_MESSAGE_SIZE)
+                logger.debug("Received data from %s", addr)
+
+                response = self.messaging.receive(data, addr)
+                if response is None:
+                    continue
 
-                response = self.handler.handle_request(data)
                 self.sock.sendto(response, addr)
-                logger.debug(f"Sent response to {addr}")
+                logger.debug("Sent response to %s", addr)
 
             except socket.timeout:
                 continue
@@ -52,9 +252,118 @@ class CoAPServer:
             except OSError as e:
                 # ignore errors caused by closing the socket after SIGTERM
                 if self.running:
-                    logger.error(f"Server error: {e}")
+                    logger.error("Server error: %s", e)
                     self.shutdown()
 
+    def readable(self) -> socket.socket | None:
+        """
+        Waits up to a second for a datagram on any of the sockets.
+
+        Returns the socket to receive from, None on timeout. Group sockets
+        come first, since their requests are answered only after a delay.
+        """
+
+        readable, _, _ = select.select(
+            [self.sock, *self.group_socks], [], [], 1
+        )
+        for sock in self.group_socks:
+            if sock in readable:
+                return sock
+        return self.sock if readable else None
+
+    def receive_group(self, sock: socket.socket | None):
+        """Handles a request sent to a group, received on the socket."""
+
+        if sock is None:
+            return
+
+        data, addr = sock.recvfrom(MAX_MESSAGE_SIZE)
+        addr = reply_address(self.sock.family, addr)
+        logger.debug("Received group request from %s", addr)
+        self.messaging.receive(data, addr, group=True)
+
+    def serve_batch(self):
+        """
+        Receive loop handling all the queued datagrams at once.
+
+        Datagrams are received and the responses sent in bulk (with
+        recvmmsg() and sendmmsg() where available), see `batch_io`.
+        """
+
+        io = batch_io(self.sock)
+        # requests sent to groups are few, they don't need recvmmsg()
+        group_ios = [BatchIO(sock) for sock in self.group_socks]
+
+        while self.running:
+            try:
+                if self.group_socks:
+                    readable, _, _ = select.select(
+                        [self.sock, *self.group_socks], [], [], 1
+                    )
+                else:
+                    readable = [self.sock] if io.wait(1) else []
+                if not readable:
+                    io.send(self.messaging.due())
+                    continue
+
+                for group_io in group_ios:
+                    if group_io.sock not in readable:
+                        continue
+                    for data, addr in group_io.receive():
+                        addr = reply_address(self.sock.family, addr)
+                        self.messaging.receive(data, addr, group=True)
+
+                outgoing = []
+                for data, addr in io.receive():
+                    response = self.messaging.receive(data, addr)
+                    if response is not None:
+                        outgoing.append((response, addr))
+
+                outgoing += self.messaging.due()
+                outgoing += self.messaging.notifications()
+                io.send(outgoing)
+                logger.debug("Sent %s datagrams", len(outgoing))
+
+            except KeyboardInterrupt:
+                logger.info("Received Ctrl+C, shutting down...")
+                self.shutdown()
+
+            except (OSError, ValueError) as e:
+                # ignore errors caused by closing the socket after SIGTERM
+                if self.running:
+                    logger.error("Server error: %s", e)
+                    self.shutdown()
+
+    async def serve_async(self):
+        """Serve requests on the running event loop until shutdown."""
+
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: CoAPProtocol(self.messaging), sock=self.sock
+        )
+        group_transports = []
+        for sock in self.group_socks:
+            group_transport, _ = await loop.create_datagram_endpoint(
+                lambda: GroupProtocol(protocol, self.sock.family), sock=sock
+            )
+            group_transports.append(group_transport)
+        retransmit = asyncio.ensure_future(protocol.retransmit())
+        self.stopped = asyncio.Event()
+        self.loop = loop
+        if not self.running:
+            # shutdown() was called before the event loop was set up
+            self.stopped.set()
+
+        try:
+            await self.stopped.wait()
+        finally:
+            retransmit.cancel()
+            # closing the transport closes the underlying socket as well
+            transport.close()
+            for group_transport in group_transports:
+                group_transport.close()
+            self.loop = None
+
     def handle_sigterm(self, signum, frame):
         """Handle SIGTERM signal by shutting down the server gracefully."""
 
@@ -63,5 +372,21 @@ class CoAPServer:
 
     def shutdown(self):
         self.running = False
-        self.sock.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+        loop, stopped = self.loop, self.stopped
+        if loop is not None and stopped is not None:
+            # wake up the event loop, which may be running in another thread
+            loop.call_soon_threadsafe(stopped.set)
+        else:
+            self.close()
+
         logger.info("CoAP Server stopped")
+
+    def close(self):
+        """Closes the unicast socket and the sockets of the groups."""
+
+        self.sock.close()
+        for sock in self.group_socks:
+            sock.close()
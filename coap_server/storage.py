@@ -0,0 +1,654 @@
+"""
+Module providing persistent stores of resource objects.
+
+Stores are mutable mappings which can be passed to resources in place of
+a dictionary:
+- `LogStore` keeps the objects in memory and appends every change to
+  a write-ahead log, which is periodically compacted into a snapshot,
+- `SQLiteStore` keeps the objects in a SQLite database, so they don't have
+  to fit into memory,
+- `SensorStore` keeps sensors in memory only, in a compact columnar layout.
+
+Writes are group-committed: a background thread writes and syncs all the
+changes made since the last commit every `commit_interval` seconds, so a
+request never waits for the disk. Changes acknowledged less than
+`commit_interval` before a crash may be lost; `flush()` commits right away.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+from array import array
+from collections.abc import ItemsView, Iterator, Mapping, MutableMapping
+from enum import Enum
+from pathlib import Path
+
+from coap_server.history import MAX_TEMPERATURE, MIN_TEMPERATURE
+from coap_server.logger import logger
+
+Object = MutableMapping[str, str | int]
+
+# Seconds between group commits
+COMMIT_INTERVAL = 0.01
+
+# Records logged by `LogStore` before the log is compacted into a snapshot
+SNAPSHOT_EVERY = 10000
+
+# Largest distance of an ID set in `SensorStore` from the last one
+MAX_ID_GAP = 1 << 16
+
+
+class StorageKind(str, Enum):
+    """Enum representing the supported kinds of object storage."""
+
+    MEMORY = "memory"
+    COMPACT = "compact"
+    WAL = "wal"
+    SQLITE = "sqlite"
+
+
+class Store(MutableMapping[int, Object]):
+    """
+    Base class of persistent stores.
+
+    Child classes implement the mapping methods and `commit()`, which is
+    called periodically by the committer thread started by `start()`.
+    Every change increments `version()`, like with `SharedObjects`.
+    """
+
+    def __init__(self, commit_interval: float = COMMIT_INTERVAL):
+        self.commit_interval = commit_interval
+        self.changes = 0
+        # guards the objects, held only for a short time by every access
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.committer = threading.Thread(
+            target=self.run_committer, name="committer", daemon=True
+        )
+
+    def start(self) -> "Store":
+        self.committer.start()
+        return self
+
+    def run_committer(self):
+        while not self.stopped.wait(self.commit_interval):
+            try:
+                self.commit()
+            except Exception as e:
+                logger.critical("Committing changes failed: %r", e)
+
+    def commit(self):
+        """Makes the changes done since the last commit durable."""
+
+        raise NotImplementedError
+
+    def flush(self):
+        self.commit()
+
+    def close(self):
+        """Stops the committer thread and commits the remaining changes."""
+
+        self.stopped.set()
+        if self.committer.is_alive():
+            self.committer.join()
+        self.commit()
+
+    def version(self) -> int:
+        return self.changes
+
+    def create(self, obj: Object) -> int:
+        """Stores a new object under the next free ID and returns the ID."""
+
+        with self.lock:
+            new_id = max(self.keys_locked(), default=0) + 1
+            self.put_locked(new_id, obj)
+        return new_id
+
+    def merge(self, patches: Mapping[int, Object]) -> list[int]:
+        """
+        Merges every patch into the object with its key, all or none.
+
+        Returns the keys of missing objects, in which case nothing changes.
+        The changes are committed together.
+        """
+
+        with self.lock:
+            current: dict[int, Object] = {}
+            missing = []
+            for key in patches:
+                obj = self.get_locked(key)
+                if obj is None:
+                    missing.append(key)
+                else:
+                    current[key] = obj
+            if not missing:
+                for key, patch in patches.items():
+                    self.put_locked(key, {**current[key], **patch})
+        return missing
+
+    def rows(self) -> list[tuple[int, Object]]:
+        """Returns all the (key, object) pairs, e.g. to pass to a proxy."""
+
+        return list(self.items())
+
+    def keys_locked(self) -> list[int]:
+        raise NotImplementedError
+
+    def get_locked(self, key: int) -> Object | None:
+        raise NotImplementedError
+
+    def put_locked(self, key: int, value: Object):
+        raise NotImplementedError
+
+    def __setitem__(self, key: int, value: Object):
+        with self.lock:
+            self.put_locked(key, value)
+
+
+class LogStore(Store):
+    """
+    Objects kept in memory and persisted with a write-ahead log.
+
+    Every change is appended to `wal.log` in `directory` as a JSON line
+    `[sequence, key, value]` (value is null for deletions). Once the log
+    has `snapshot_every` records, the objects are written to
+    `snapshot.json` and the log starts over. On startup, the snapshot is
+    loaded and the records which aren't in it are replayed; a record torn
+    by a crash ends the log.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        commit_interval: float = COMMIT_INTERVAL,
+        snapshot_every: int = SNAPSHOT_EVERY,
+    ):
+        super().__init__(commit_interval)
+        self.directory = Path(directory)
+        self.snapshot_every = snapshot_every
+        self.snapshot_path = self.directory / "snapshot.json"
+        self.log_path = self.directory / "wal.log"
+        # log being replaced by a snapshot, if it was interrupted
+        self.old_log_path = self.directory / "wal.old"
+
+        self.objects: dict[int, Object] = {}
+        # sequence number of the last change
+        self.sequence = 0
+        # encoded records not committed yet
+        self.pending: list[bytes] = []
+        # records in the current log
+        self.logged = 0
+        # serializes commits, so a slow sync doesn't block the objects
+        self.commit_lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.load()
+        self.log = open(self.log_path, "ab")
+
+    def load(self):
+        """Loads the snapshot and replays the logs."""
+
+        snapshot_sequence = 0
+        if self.snapshot_path.exists():
+            snapshot = json.loads(self.snapshot_path.read_bytes())
+            snapshot_sequence = snapshot["sequence"]
+            self.objects = {key: value for key, value in snapshot["objects"]}
+        self.sequence = snapshot_sequence
+
+        for path in (self.old_log_path, self.log_path):
+            if path.exists():
+                self.logged = self.replay(path, snapshot_sequence)
+
+        if self.old_log_path.exists():
+            # writing of the snapshot was interrupted, the replayed records
+            # are kept only by the old log
+            self.save_snapshot(self.sequence, list(self.objects.items()))
+            self.old_log_path.unlink()
+
+        logger.info(
+            "Loaded %d objects from %s", len(self.objects), self.directory
+        )
+
+    def replay(self, path: Path, after: int) -> int:
+        """Applies records of the log newer than `after`, returns count."""
+
+        data = path.read_bytes()
+        offset = 0
+        count = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("Incomplete record")
+                sequence, key, value = json.loads(line)
+            except ValueError:
+                # torn by a crash, the following appends must not be lost
+                logger.warning("Truncating %s at %d", path, offset)
+                os.truncate(path, offset)
+                break
+
+            offset += len(line)
+            count += 1
+            if sequence <= after:
+                continue
+            if value is None:
+                self.objects.pop(key, None)
+            else:
+                self.objects[key] = value
+            self.sequence = sequence
+        return count
+
+    def append_locked(self, key: int, value: Object | None):
+        self.sequence += 1
+        self.changes += 1
+        self.pending.append(
+            json.dumps([self.sequence, key, value]).encode() + b"\n"
+        )
+
+    def commit(self):
+        with self.commit_lock:
+            if self.log.closed:
+                return
+
+            with self.lock:
+                pending, self.pending = self.pending, []
+                snapshot = None
+                if pending and self.logged + len(pending) >= (
+                    self.snapshot_every
+                ):
+                    # taken together with the pending records, so every
+                    # change is either in the snapshot or in the new log
+                    snapshot = self.sequence, list(self.objects.items())
+
+            if pending:
+                self.log.write(b"".join(pending))
+                self.log.flush()
+                os.fsync(self.log.fileno())
+                self.logged += len(pending)
+
+            if snapshot is not None:
+                self.write_snapshot(*snapshot)
+
+    def write_snapshot(self, sequence: int, objects: list[tuple[int, Object]]):
+        """Writes the snapshot and starts a new log."""
+
+        self.log.close()
+        os.replace(self.log_path, self.old_log_path)
+        self.log = open(self.log_path, "ab")
+        self.logged = 0
+
+        self.save_snapshot(sequence, objects)
+        self.old_log_path.unlink()
+        logger.debug("Written snapshot of %d objects", len(objects))
+
+    def save_snapshot(self, sequence: int, objects: list[tuple[int, Object]]):
+        temporary = self.snapshot_path.with_suffix(".tmp")
+        with open(temporary, "wb") as file:
+            file.write(
+                json.dumps({"sequence": sequence, "objects": objects}).encode()
+            )
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.snapshot_path)
+        sync_directory(self.directory)
+
+    def close(self):
+        super().close()
+        with self.commit_lock:
+            self.log.close()
+
+    def keys_locked(self) -> list[int]:
+        return list(self.objects)
+
+    def get_locked(self, key: int) -> Object | None:
+        return self.objects.get(key)
+
+    def put_locked(self, key: int, value: Object):
+        self.objects[key] = value
+        self.append_locked(key, value)
+
+    def __getitem__(self, key: int) -> Object:
+        return self.objects[key]
+
+    def __delitem__(self, key: int):
+        with self.lock:
+            del self.objects[key]
+            self.append_locked(key, None)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.objects
+
+    def __iter__(self) -> Iterator[int]:
+        with self.lock:
+            return iter(list(self.objects))
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+    def items(self) -> ItemsView[int, Object]:
+        with self.lock:
+            return dict(self.objects).items()
+
+
+class SQLiteItems(ItemsView[int, Object]):
+    """Items of `SQLiteStore` read with a single query."""
+
+    _mapping: "SQLiteStore"
+
+    def __iter__(self) -> Iterator[tuple[int, Object]]:
+        return iter(self._mapping.rows())
+
+
+class SQLiteStore(Store):
+    """
+    Objects kept in a SQLite database, serialized as JSON.
+
+    Changes are kept in memory until the committer thread writes all the
+    changes since the last commit in a single transaction, so a single sync
+    makes them durable. Requests read through a connection of their own,
+    which isn't blocked by the commit (the database is in WAL mode).
+    """
+
+    def __init__(
+        self, path: str | Path, commit_interval: float = COMMIT_INTERVAL
+    ):
+        super().__init__(commit_interval)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # changes not committed yet, None marks a deleted object
+        self.pending: dict[int, Object | None] = {}
+        # changes being committed, still visible to the reads
+        self.committing: dict[int, Object | None] = {}
+        # serializes commits, so a slow sync doesn't block the objects
+        self.commit_lock = threading.Lock()
+
+        # transactions are started explicitly by the commit
+        self.writer = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        self.writer.execute("PRAGMA synchronous=FULL")
+        self.writer.execute(
+            "CREATE TABLE IF NOT EXISTS objects "
+            "(id INTEGER PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        # used by the requests, under the lock
+        self.connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        logger.info("Opened %d objects in %s", len(self), self.path)
+
+    def execute(self, sql: str, *args) -> sqlite3.Cursor:
+        return self.connection.execute(sql, args)
+
+    def changed_locked(self) -> dict[int, Object | None]:
+        """Changes which aren't in the database yet, the newest last."""
+
+        return {**self.committing, **self.pending}
+
+    def commit(self):
+        with self.commit_lock:
+            with self.lock:
+                # changes of a failed commit are written again
+                self.committing.update(self.pending)
+                self.pending = {}
+                changes = dict(self.committing)
+            if not changes:
+                return
+
+            self.writer.execute("BEGIN")
+            try:
+                for key, value in changes.items():
+                    if value is None:
+                        self.writer.execute(
+                            "DELETE FROM objects WHERE id = ?", (key,)
+                        )
+                    else:
+                        self.writer.execute(
+                            "INSERT OR REPLACE INTO objects (id, value) "
+                            "VALUES (?, ?)",
+                            (key, json.dumps(value)),
+                        )
+                self.writer.commit()
+            except BaseException:
+                self.writer.rollback()
+                raise
+
+            with self.lock:
+                self.committing = {}
+
+    def close(self):
+        super().close()
+        with self.commit_lock, self.lock:
+            self.writer.close()
+            self.connection.close()
+
+    def keys_locked(self) -> list[int]:
+        changes = self.changed_locked()
+        rows = self.execute("SELECT id FROM objects ORDER BY id")
+        keys = {key for (key,) in rows if key not in changes}
+        keys.update(key for key, obj in changes.items() if obj is not None)
+        return sorted(keys)
+
+    def get_locked(self, key: int) -> Object | None:
+        changes = self.changed_locked()
+        if key in changes:
+            return changes[key]
+        row = self.execute(
+            "SELECT value FROM objects WHERE id = ?", key
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_locked(self, key: int, value: Object):
+        self.pending[key] = value
+        self.changes += 1
+
+    def create(self, obj: Object) -> int:
+        with self.lock:
+            (last,) = self.execute("SELECT max(id) FROM objects").fetchone()
+            new_id = max(last or 0, *self.changed_locked()) + 1
+            self.put_locked(new_id, obj)
+        return new_id
+
+    def rows(self) -> list[tuple[int, Object]]:
+        with self.lock:
+            changes = self.changed_locked()
+            rows = self.execute(
+                "SELECT id, value FROM objects ORDER BY id"
+            ).fetchall()
+        objects = {
+            key: json.loads(value) for key, value in rows if key not in changes
+        }
+        objects.update(
+            (key, obj) for key, obj in changes.items() if obj is not None
+        )
+        return sorted(objects.items())
+
+    def __getitem__(self, key: int) -> Object:
+        with self.lock:
+            obj = self.get_locked(key)
+        if obj is None:
+            raise KeyError(key)
+        return obj
+
+    def __delitem__(self, key: int):
+        with self.lock:
+            if self.get_locked(key) is None:
+                raise KeyError(key)
+            self.pending[key] = None
+            self.changes += 1
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, int):
+            return False
+        with self.lock:
+            return self.get_locked(key) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        with self.lock:
+            return iter(self.keys_locked())
+
+    def __len__(self) -> int:
+        with self.lock:
+            (count,) = self.execute("SELECT count(*) FROM objects").fetchone()
+            for key, obj in self.changed_locked().items():
+                stored = self.execute(
+                    "SELECT 1 FROM objects WHERE id = ?", key
+                ).fetchone()
+                count += (obj is not None) - (stored is not None)
+        return count
+
+    def items(self) -> ItemsView[int, Object]:
+        return SQLiteItems(self)
+
+
+class SensorStore(MutableMapping[int, Object]):
+    """
+    Sensors kept in columns instead of a dictionary per sensor.
+
+    The columns are indexed by sensor ID: names are interned (None marks
+    a deleted sensor) and temperatures are kept in an `array('i')`. Objects
+    returned by `store[id]` are new dictionaries, so a sensor has to be
+    replaced as a whole to change it.
+
+    IDs are allocated by `create()` at the end of the columns, so deleted
+    IDs are never reused and creating a sensor doesn't depend on the number
+    of sensors. Other IDs may be set directly, at most `MAX_ID_GAP` past
+    the last one.
+
+    Changes are guarded by a lock, since they may come from threads of an
+    executor or of the manager serving the workers.
+    """
+
+    def __init__(self, sensors: MutableMapping[int, Object] | None = None):
+        # ID 0 is never used
+        self.names: list[str | None] = [None]
+        self.temperatures = array("i", [0])
+        self.count = 0
+        self.changes = 0
+        # reentrant, `create()` and `merge()` assign the sensors
+        self.lock = threading.RLock()
+        if sensors:
+            self.update(sensors)
+
+    def version(self) -> int:
+        return self.changes
+
+    def create(self, obj: Object) -> int:
+        """Stores a new sensor under the next ID and returns the ID."""
+
+        with self.lock:
+            new_id = len(self.names)
+            self[new_id] = obj
+        return new_id
+
+    def merge(self, patches: Mapping[int, Object]) -> list[int]:
+        """Merges patches into the sensors, see `Store.merge()`."""
+
+        with self.lock:
+            missing = [key for key in patches if key not in self]
+            if not missing:
+                # all the sensors are checked before any of them is changed
+                columns = {
+                    key: self.columns({**self[key], **patch})
+                    for key, patch in patches.items()
+                }
+                for key, (name, temperature) in columns.items():
+                    self.names[key] = name
+                    self.temperatures[key] = temperature
+                self.changes += 1
+        return missing
+
+    def __getitem__(self, key: int) -> Object:
+        name = None
+        if isinstance(key, int) and 0 < key < len(self.names):
+            name = self.names[key]
+        if name is None:
+            raise KeyError(key)
+        return {"name": name, "temperature": self.temperatures[key]}
+
+    def columns(self, value: Object) -> tuple[str, int]:
+        """Returns the name and temperature of a sensor, as stored."""
+
+        if value.keys() != {"name", "temperature"}:
+            raise ValueError(f"Not a sensor: {value}")
+
+        temperature = int(value["temperature"])
+        if not MIN_TEMPERATURE <= temperature <= MAX_TEMPERATURE:
+            raise ValueError(f"Temperature out of range: {temperature}")
+        return sys.intern(str(value["name"])), temperature
+
+    def __setitem__(self, key: int, value: Object):
+        if not isinstance(key, int) or key <= 0:
+            raise KeyError(key)
+        name, temperature = self.columns(value)
+
+        with self.lock:
+            missing = key + 1 - len(self.names)
+            if missing > MAX_ID_GAP:
+                raise KeyError(key)
+            if missing > 0:
+                self.names.extend([None] * missing)
+                self.temperatures.frombytes(
+                    bytes(missing * self.temperatures.itemsize)
+                )
+
+            if self.names[key] is None:
+                self.count += 1
+            self.names[key] = name
+            self.temperatures[key] = temperature
+            self.changes += 1
+
+    def __delitem__(self, key: int):
+        with self.lock:
+            if key not in self:
+                raise KeyError(key)
+            self.names[key] = None
+            self.count -= 1
+            self.changes += 1
+
+    def __contains__(self, key: object) -> bool:
+        return (
+            isinstance(key, int)
+            and 0 < key < len(self.names)
+            and self.names[key] is not None
+        )
+
+    def __iter__(self) -> Iterator[int]:
+        names = self.names
+        return iter(
+            [key for key in range(len(names)) if names[key] is not None]
+        )
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def open_store(
+    kind: StorageKind,
+    directory: str | Path,
+    commit_interval: float = COMMIT_INTERVAL,
+) -> Store:
+    """Opens the store of the given kind in `directory` and starts it."""
+
+    match kind:
+        case StorageKind.WAL:
+            store: Store = LogStore(directory, commit_interval)
+        case StorageKind.SQLITE:
+            store = SQLiteStore(
+                Path(directory) / "objects.sqlite3", commit_interval
+            )
+        case _:
+            raise ValueError(f"Not a persistent storage: {kind.value}")
+    return store.start()
+
+
+def sync_directory(directory: Path):
+    """Makes renames of files in the directory durable."""
+
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
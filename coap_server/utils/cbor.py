@@ -0,0 +1,242 @@
+"""
+Minimal CBOR (RFC 8949) codec of the JSON data model.
+
+Integers, floats, text and byte strings, arrays, maps, booleans and null are
+supported, including indefinite-length items when decoding. Tags are
+ignored, the tagged item is decoded as is.
+"""
+
+import struct
+from collections.abc import Mapping
+from typing import Any, Iterable, Iterator
+
+# Approximate size of the chunks yielded by `encode_items()`
+CHUNK_SIZE = 1024
+
+# Deepest nesting of arrays and maps accepted by `loads()`
+MAX_DEPTH = 64
+
+BREAK = 0xFF
+
+FLOAT32 = struct.Struct(">f")
+
+
+class CBORDecodeError(ValueError):
+    """Raised when the data is not well-formed CBOR."""
+
+
+def encode_head(major: int, value: int) -> bytes:
+    """Encode the initial byte with the argument of a data item."""
+
+    if value < 24:
+        return bytes([major << 5 | value])
+    if value < 0x100:
+        return bytes([major << 5 | 24, value])
+    if value < 0x10000:
+        return bytes([major << 5 | 25]) + value.to_bytes(2, "big")
+    if value < 0x100000000:
+        return bytes([major << 5 | 26]) + value.to_bytes(4, "big")
+    if value < 0x10000000000000000:
+        return bytes([major << 5 | 27]) + value.to_bytes(8, "big")
+    raise ValueError(f"Integer too large for CBOR: {value}")
+
+
+def encode_into(obj: Any, out: bytearray):
+    if obj is None:
+        out.append(0xF6)
+    elif obj is False:
+        out.append(0xF4)
+    elif obj is True:
+        out.append(0xF5)
+    elif isinstance(obj, int):
+        if obj >= 0:
+            out += encode_head(0, obj)
+        else:
+            out += encode_head(1, -1 - obj)
+    elif isinstance(obj, float):
+        single = FLOAT32.pack(obj) if abs(obj) < 3.4e38 else b""
+        if single and FLOAT32.unpack(single)[0] == obj:
+            out += b"\xfa" + single
+        else:
+            out += b"\xfb" + struct.pack(">d", obj)
+    elif isinstance(obj, str):
+        encoded = obj.encode("utf-8")
+        out += encode_head(3, len(encoded))
+        out += encoded
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        out += encode_head(2, len(obj))
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        out += encode_head(4, len(obj))
+        for item in obj:
+            encode_into(item, out)
+    elif isinstance(obj, Mapping):
+        out += encode_head(5, len(obj))
+        for key, value in obj.items():
+            encode_into(key, out)
+            encode_into(value, out)
+    else:
+        raise TypeError(f"Cannot encode {type(obj).__name__} to CBOR")
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode the object into CBOR."""
+
+    out = bytearray()
+    encode_into(obj, out)
+    return bytes(out)
+
+
+def encode_items(
+    items: Iterable[tuple[Any, Any]], chunk_size: int = CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Encodes (key, value) pairs into an indefinite-length map, in chunks.
+
+    Counterpart of `json_stream.encode_items()`; the number of items doesn't
+    have to be known in advance.
+    """
+
+    out = bytearray(b"\xbf")
+    for key, value in items:
+        encode_into(key, out)
+        encode_into(value, out)
+        if len(out) >= chunk_size:
+            yield bytes(out)
+            out.clear()
+
+    out.append(BREAK)
+    yield bytes(out)
+
+
+def read_head(data: bytes, pos: int) -> tuple[int, int, int | None, int]:
+    """Decode the initial byte and argument as (major, info, value, pos)."""
+
+    if pos >= len(data):
+        raise CBORDecodeError("Unexpected end of data")
+
+    major, info = data[pos] >> 5, data[pos] & 0x1F
+    pos += 1
+    if info < 24:
+        return major, info, info, pos
+    if info <= 27:
+        size = 1 << (info - 24)
+        if pos + size > len(data):
+            raise CBORDecodeError("Unexpected end of data")
+        value = int.from_bytes(data[pos : pos + size], "big")
+        return major, info, value, pos + size
+    if info == 31 and major in (2, 3, 4, 5, 7):
+        # indefinite length, or the break of one
+        return major, info, None, pos
+    raise CBORDecodeError(f"Invalid additional information: {info}")
+
+
+def decode_string(
+    data: bytes, pos: int, major: int, length: int | None
+) -> tuple[bytes, int]:
+    if length is not None:
+        if pos + length > len(data):
+            raise CBORDecodeError("Unexpected end of data")
+        return bytes(data[pos : pos + length]), pos + length
+
+    # indefinite-length string consisting of definite-length chunks
+    chunks: list[bytes] = []
+    while True:
+        if pos < len(data) and data[pos] == BREAK:
+            return b"".join(chunks), pos + 1
+        chunk_major, _, chunk_length, pos = read_head(data, pos)
+        if chunk_major != major or chunk_length is None:
+            raise CBORDecodeError("Invalid chunk of indefinite string")
+        chunk, pos = decode_string(data, pos, major, chunk_length)
+        chunks.append(chunk)
+
+
+def at_end(data: bytes, pos: int, count: int | None, index: int) -> bool:
+    """Whether all the items of an array or map have been decoded."""
+
+    if count is not None:
+        return index >= count
+    if pos >= len(data):
+        raise CBORDecodeError("Unexpected end of data")
+    return data[pos] == BREAK
+
+
+def decode_item(data: bytes, pos: int, depth: int = 0) -> tuple[Any, int]:
+    """Decode a single data item starting at `pos`."""
+
+    if depth > MAX_DEPTH:
+        raise CBORDecodeError("Nesting too deep")
+
+    major, info, value, pos = read_head(data, pos)
+    match major:
+        case 0:
+            return value, pos
+
+        case 1:
+            assert value is not None
+            return -1 - value, pos
+
+        case 2:
+            return decode_string(data, pos, major, value)
+
+        case 3:
+            encoded, pos = decode_string(data, pos, major, value)
+            return encoded.decode("utf-8"), pos
+
+        case 4:
+            items: list[Any] = []
+            while not at_end(data, pos, value, len(items)):
+                item, pos = decode_item(data, pos, depth + 1)
+                items.append(item)
+            return items, pos + (value is None)
+
+        case 5:
+            mapping: dict[Any, Any] = {}
+            index = 0
+            while not at_end(data, pos, value, index):
+                key, pos = decode_item(data, pos, depth + 1)
+                mapping_value, pos = decode_item(data, pos, depth + 1)
+                try:
+                    mapping[key] = mapping_value
+                except TypeError:
+                    raise CBORDecodeError(f"Invalid map key: {key!r}")
+                index += 1
+            return mapping, pos + (value is None)
+
+        case 6:
+            return decode_item(data, pos, depth + 1)
+
+        case _:
+            return decode_simple(data, pos, info)
+
+
+def decode_simple(data: bytes, pos: int, info: int) -> tuple[Any, int]:
+    """Decode simple values and floats (major type 7)."""
+
+    match info:
+        case 20:
+            return False, pos
+        case 21:
+            return True, pos
+        case 22 | 23:
+            # null and undefined
+            return None, pos
+        case 25:
+            return struct.unpack(">e", data[pos - 2 : pos])[0], pos
+        case 26:
+            return struct.unpack(">f", data[pos - 4 : pos])[0], pos
+        case 27:
+            return struct.unpack(">d", data[pos - 8 : pos])[0], pos
+        case 31:
+            raise CBORDecodeError("Unexpected break")
+        case _:
+            raise CBORDecodeError(f"Unsupported simple value: {info}")
+
+
+def loads(data: bytes) -> Any:
+    """Decode a single CBOR data item, raises CBORDecodeError if invalid."""
+
+    obj, pos = decode_item(data, 0)
+    if pos != len(data):
+        raise CBORDecodeError("Trailing data")
+    return obj
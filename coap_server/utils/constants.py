@@ -1,5 +1,35 @@
-from dataclasses import dataclass
-from enum import Enum
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass, field, replace
+from enum import Enum, IntEnum
+from functools import cached_property
+from operator import itemgetter
+from typing import Any, Callable, Iterator
+
+# (host, port) for IPv4 and (host, port, flowinfo, scope_id) for IPv6
+Address = tuple[Any, ...]
+
+# Transmission parameters (RFC 7252, section 4.8), in seconds
+ACK_TIMEOUT = 2.0
+ACK_RANDOM_FACTOR = 1.5
+MAX_RETRANSMIT = 4
+EXCHANGE_LIFETIME = 247.0
+NON_LIFETIME = 145.0
+
+# Upper bound of the random delay of responses to group requests (RFC 7252,
+# section 8.2.1), in seconds
+DEFAULT_LEISURE = 5.0
+
+# Largest datagram received by the server; fits a 1024 B block with headers
+MAX_MESSAGE_SIZE = 1152
+
+
+class CoapType(IntEnum):
+    """Enum representing CoAP message types."""
+
+    CON = 0
+    NON = 1
+    ACK = 2
+    RST = 3
 
 
 class CoapCode(Enum):
@@ -33,6 +63,7 @@ class CoapCode(Enum):
     PRECONDITION_FAILED = "4.12"
     REQUEST_ENTITY_TOO_LARGE = "4.13"
     UNSUPPORTED_CONTENT_FORMAT = "4.15"
+    TOO_MANY_REQUESTS = "4.29"
 
     INTERNAL_SERVER_ERROR = "5.00"
     NOT_IMPLEMENTED = "5.01"
@@ -60,6 +91,7 @@ class CoapOption(Enum):
     URI_HOST = 3
     ETAG = 4
     IF_NONE_MATCH = 5
+    OBSERVE = 6
     URI_PORT = 7
     LOCATION_PATH = 8
     URI_PATH = 11
@@ -68,11 +100,145 @@ class CoapOption(Enum):
     URI_QUERY = 15
     ACCEPT = 17
     LOCATION_QUERY = 20
+    BLOCK2 = 23
+    BLOCK1 = 27
+    SIZE2 = 28
     PROXY_URI = 35
     PROXY_SCHEME = 39
     SIZE1 = 60
 
 
+OPTIONS_BY_NUMBER: dict[int, CoapOption] = {
+    option.value: option for option in CoapOption
+}
+
+OptionValue = bytes | memoryview
+
+
+def option_number(option: CoapOption | int) -> int:
+    # `_value_` is a plain attribute, unlike the `value` property
+    return option._value_ if isinstance(option, CoapOption) else option
+
+
+class Options(Mapping[CoapOption, OptionValue]):
+    """
+    Options of a message, ordered by their numbers.
+
+    Kept as a list of (number, value) pairs, so repeated options (e.g. the
+    segments of Uri-Path) are preserved. As a mapping, it returns the first
+    value of every option; `all()` returns all the values. Values are
+    decoded only when accessed with `uint()` or `string()`.
+    """
+
+    __slots__ = ("pairs", "index")
+
+    def __init__(
+        self,
+        pairs: Iterable[tuple[CoapOption | int, OptionValue]] = (),
+        index: dict[int, int] | None = None,
+    ):
+        if index is None:
+            numbered = [
+                (option_number(option), value) for option, value in pairs
+            ]
+            if len(numbered) > 1:
+                # sorting is stable, so repeated options keep their order
+                numbered.sort(key=itemgetter(0))
+            index = {}
+            for position, (number, _) in enumerate(numbered):
+                index.setdefault(number, position)
+            pairs = numbered
+
+        self.pairs: list[tuple[int, OptionValue]] = pairs  # type: ignore
+        # position of the first value of every option number
+        self.index = index
+
+    def __getitem__(self, option: CoapOption) -> OptionValue:
+        position = self.index.get(option._value_)
+        if position is None:
+            raise KeyError(option)
+        return self.pairs[position][1]
+
+    def get(self, option: CoapOption, default=None):  # type: ignore
+        position = self.index.get(option._value_)
+        return default if position is None else self.pairs[position][1]
+
+    def __contains__(self, option: object) -> bool:
+        return isinstance(option, CoapOption) and option._value_ in self.index
+
+    def __iter__(self) -> Iterator[CoapOption]:
+        for number in self.index:
+            if number in OPTIONS_BY_NUMBER:
+                yield OPTIONS_BY_NUMBER[number]
+
+    def __len__(self) -> int:
+        return sum(number in OPTIONS_BY_NUMBER for number in self.index)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Options):
+            return self.pairs == other.pairs
+        return super().__eq__(other)
+
+    def all(self, option: CoapOption) -> list[OptionValue]:
+        """Returns all the values of a (repeatable) option, in order."""
+
+        number = option._value_
+        position = self.index.get(number)
+        if position is None:
+            return []
+
+        values = []
+        for pair_number, value in self.pairs[position:]:
+            if pair_number != number:
+                break
+            values.append(value)
+        return values
+
+    def without(self, *options: CoapOption) -> "Options":
+        """Returns a copy of the options without the given ones."""
+
+        numbers = {option._value_ for option in options}
+        return Options([pair for pair in self.pairs if pair[0] not in numbers])
+
+    def updated(self, options: Mapping[CoapOption, OptionValue]) -> "Options":
+        """Returns a copy with the given options, replacing their values."""
+
+        return Options([*self.without(*options).pairs, *options.items()])
+
+    def uint(self, option: CoapOption, default: int | None = None):
+        """Returns the value of an uint option (empty value means 0)."""
+
+        value = self.get(option)
+        return default if value is None else int.from_bytes(value, "big")
+
+    def string(self, option: CoapOption, default: str | None = None):
+        """Returns the value of a string option, decoded from UTF-8."""
+
+        value = self.get(option)
+        return default if value is None else str(value, "utf-8")
+
+    def opaque(self, option: CoapOption, default: bytes | None = None):
+        """Returns the value of an opaque option as bytes (a copy)."""
+
+        value = self.get(option)
+        return default if value is None else bytes(value)
+
+    def __repr__(self) -> str:
+        pairs = ", ".join(
+            f"({number}, {bytes(value)!r})" for number, value in self.pairs
+        )
+        return f"Options([{pairs}])"
+
+
+class ContentFormat(IntEnum):
+    """Enum representing CoAP content formats (RFC 7252, section 12.3)."""
+
+    TEXT_PLAIN = 0
+    LINK_FORMAT = 40
+    JSON = 50
+    CBOR = 60
+
+
 @dataclass(frozen=True)
 class CoapMessage:
     """Data class representing CoAP message."""
@@ -83,20 +249,79 @@ class CoapMessage:
     header_code: CoapCode
     header_mid: int
     token: bytes
-    options: dict[CoapOption, bytes]
+    # parsed messages hold memoryviews into the received datagram; other
+    # mappings (e.g. dictionaries with a value per option) are converted
+    options: Options
     payload: bytes
+    # set by the router: path pattern of the resource and path parameters
+    route: str | None = None
+    params: dict[str, Any] = field(default_factory=dict)
+    # responses may produce the payload in chunks, when it's being sent
+    stream: Callable[[], Iterator[bytes]] | None = None
+
+    def __post_init__(self):
+        if not isinstance(self.options, Options):
+            options = self.options.items()
+            object.__setattr__(self, "options", Options(options))
+
+    @cached_property
+    def uri_parts(self) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        """
+        Path segments and query arguments of the URI (once per message).
+
+        Every Uri-Path option is a segment and every Uri-Query option an
+        argument. Clients may also send the whole path in a single option,
+        e.g. `/sensors/1?limit=10`, which is split on `/` and `?`.
+        """
+
+        segments: list[str] = []
+        arguments: list[str] = []
+        for value in self.options.all(CoapOption.URI_PATH):
+            segment = str(value, "utf-8")
+            if "/" in segment or "?" in segment:
+                segment, _, query = segment.partition("?")
+                segments += filter(None, segment.split("/"))
+                arguments += filter(None, query.split("&"))
+            elif segment:
+                segments.append(segment)
+
+        for value in self.options.all(CoapOption.URI_QUERY):
+            arguments.append(str(value, "utf-8"))
+        return tuple(segments), tuple(arguments)
 
     @property
+    def path(self) -> tuple[str, ...]:
+        """Segments of the URI path, e.g. `("sensors", "1")`."""
+
+        return self.uri_parts[0]
+
+    def routed(self, route: str, params: dict[str, Any]) -> "CoapMessage":
+        """Returns the request with the route matched by the router."""
+
+        request = replace(self, route=route, params=params)
+        # the URI is the same, so it doesn't have to be composed again
+        for name in ("uri_parts", "uri", "query"):
+            if name in self.__dict__:
+                request.__dict__[name] = self.__dict__[name]
+        return request
+
+    @cached_property
     def uri(self) -> str:
-        """Compose the URI from the options."""
-
-        value = ""
-        if CoapOption.URI_PATH in self.options:
-            value += "/".join(
-                self.options[CoapOption.URI_PATH].decode().split(",")
-            )
-        if CoapOption.URI_QUERY in self.options:
-            value += "?" + "&".join(
-                self.options[CoapOption.URI_QUERY].decode().split(",")
-            )
-        return value
+        """Compose the URI from the options (once per message)."""
+
+        segments, arguments = self.uri_parts
+        uri = "/" + "/".join(segments)
+        if arguments:
+            uri += "?" + "&".join(arguments)
+        return uri
+
+    @cached_property
+    def query(self) -> dict[str, str]:
+        """Parameters of the URI query, e.g. `?limit=10` (once per message)."""
+
+        params = {}
+        for argument in self.uri_parts[1]:
+            name, _, value = argument.partition("=")
+            if name:
+                params[name] = value
+        return params
@@ -1,13 +1,39 @@
-from coap_server.utils.constants import CoapCode, CoapMessage
+from collections.abc import Mapping
+
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    ContentFormat,
+    Options,
+    OptionValue,
+)
+from coap_server.utils.parser import encode_uint
 
 
 def construct_response(
-    request: CoapMessage, code: CoapCode, payload: bytes
+    request: CoapMessage,
+    code: CoapCode,
+    payload: bytes,
+    content_format: ContentFormat | None = None,
+    options: Mapping[CoapOption, OptionValue] | None = None,
 ) -> CoapMessage:
     """
     Function for convenient constructing response and to reduce duplicated code.
+
+    The Content-Format option is set if `content_format` is given, together
+    with other `options` of the response (all the values of repeated ones,
+    if given as `Options`).
     """
 
+    pairs: list[tuple[CoapOption, OptionValue]] = []
+    if content_format is not None:
+        pairs.append((CoapOption.CONTENT_FORMAT, encode_uint(content_format)))
+    if isinstance(options, Options):
+        pairs += options.pairs  # type: ignore
+    elif options:
+        pairs += options.items()
+
     return CoapMessage(
         header_version=request.header_version,
         header_type=request.header_type,
@@ -15,6 +41,6 @@ def construct_response(
         header_code=code,
         header_mid=request.header_mid,
         token=request.token,
-        options={},
+        options=Options(pairs),
         payload=payload,
     )
@@ -0,0 +1,49 @@
+"""Encoding and decoding of payloads in the supported content formats."""
+
+import json
+from typing import Any, Iterable, Iterator
+
+from coap_server.utils import cbor, json_stream
+from coap_server.utils.constants import ContentFormat
+
+
+def encode(obj: Any, content_format: ContentFormat) -> bytes:
+    """Encode the object into a payload of the given format."""
+
+    match content_format:
+        case ContentFormat.JSON:
+            return json.dumps(obj).encode("ascii")
+        case ContentFormat.CBOR:
+            return cbor.dumps(obj)
+        case ContentFormat.TEXT_PLAIN:
+            return str(obj).encode("utf-8")
+        case _:
+            raise ValueError(f"Unsupported content format: {content_format}")
+
+
+def decode(payload: bytes, content_format: ContentFormat) -> Any:
+    """Decode a payload of the given format, raises ValueError if invalid."""
+
+    match content_format:
+        case ContentFormat.JSON:
+            return json.loads(payload)
+        case ContentFormat.CBOR:
+            return cbor.loads(payload)
+        case ContentFormat.TEXT_PLAIN:
+            return payload.decode("utf-8")
+        case _:
+            raise ValueError(f"Unsupported content format: {content_format}")
+
+
+def encode_items(
+    items: Iterable[tuple[Any, Any]], content_format: ContentFormat
+) -> Iterator[bytes]:
+    """Encode (key, value) pairs into a map (object), yielded in chunks."""
+
+    match content_format:
+        case ContentFormat.JSON:
+            return json_stream.encode_items(items)
+        case ContentFormat.CBOR:
+            return cbor.encode_items(items)
+        case _:
+            raise ValueError(f"Unsupported content format: {content_format}")
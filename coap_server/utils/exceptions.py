@@ -1,5 +1,7 @@
 """Custom exceptions for handling CoAP requests errors."""
 
+from coap_server.utils.constants import CoapMessage
+
 
 class MethodNotAllowedError(Exception):
     pass
@@ -11,3 +13,42 @@ class BadRequestError(Exception):
 
 class NotFoundError(Exception):
     pass
+
+
+class NotAcceptableError(Exception):
+    """Raised when no representation in the Accept-ed format exists."""
+
+
+class UnsupportedContentFormatError(Exception):
+    """Raised when the request payload is in an unsupported format."""
+
+
+class MessageFormatError(ValueError):
+    """Raised when a datagram is not a well-formed CoAP message."""
+
+
+class BadOptionError(MessageFormatError):
+    """
+    Raised when a message contains an unrecognized critical option.
+
+    Carries the already decoded part of the message (header and token),
+    so that a 4.02 Bad Option response can be sent back.
+    """
+
+    def __init__(self, request: CoapMessage, option_number: int):
+        super().__init__(f"Unrecognized critical option: {option_number}")
+        self.request = request
+        self.option_number = option_number
+
+
+class ServiceUnavailableError(Exception):
+    """
+    Raised when the server is too busy to handle the request in time.
+
+    Answered with 5.03 Service Unavailable; `max_age` is the number of
+    seconds after which the client may retry.
+    """
+
+    def __init__(self, reason: str, max_age: int):
+        super().__init__(reason)
+        self.max_age = max_age
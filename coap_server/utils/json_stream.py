@@ -0,0 +1,38 @@
+"""Incremental JSON encoding of large collections."""
+
+import json
+from typing import Any, Iterable, Iterator
+
+# Approximate size of the chunks yielded by `encode_items()`
+CHUNK_SIZE = 1024
+
+encoder = json.JSONEncoder()
+
+
+def encode_items(
+    items: Iterable[tuple[Any, Any]], chunk_size: int = CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Encodes (key, value) pairs into a JSON object, yielded in chunks.
+
+    The result is the same as `json.dumps(dict(items))`, but only a chunk of
+    about `chunk_size` bytes is held in memory at a time.
+    """
+
+    parts = ["{"]
+    size = 1
+    separator = ""
+    for key, value in items:
+        part = (
+            f"{separator}{encoder.encode(str(key))}: {encoder.encode(value)}"
+        )
+        separator = ", "
+        parts.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(parts).encode("ascii")
+            parts = []
+            size = 0
+
+    parts.append("}")
+    yield "".join(parts).encode("ascii")
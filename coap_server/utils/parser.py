@@ -1,140 +1,358 @@
 """Module providing functions to decode and encode CoAP messages."""
 
-from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
+import struct
+
+from coap_server.utils.constants import (
+    OPTIONS_BY_NUMBER,
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    Options,
+    OptionValue,
+)
+from coap_server.utils.exceptions import BadOptionError, MessageFormatError
+
+# Lookup tables, so that codes don't have to be converted on every message
+CODES_BY_BYTE: dict[int, CoapCode] = {
+    int(code.value[0]) << 5 | int(code.value[2:]): code for code in CoapCode
+}
+BYTES_BY_CODE: dict[CoapCode, int] = {
+    code: byte for byte, code in CODES_BY_BYTE.items()
+}
+
+# Allowed lengths of option values (RFC 7252, 7641 and 7959), by number
+OPTION_LENGTHS: dict[int, range] = {
+    option.value: range(low, high + 1)
+    for option, low, high in [
+        (CoapOption.IF_MATCH, 0, 8),
+        (CoapOption.URI_HOST, 1, 255),
+        (CoapOption.ETAG, 1, 8),
+        (CoapOption.IF_NONE_MATCH, 0, 0),
+        (CoapOption.OBSERVE, 0, 3),
+        (CoapOption.URI_PORT, 0, 2),
+        (CoapOption.LOCATION_PATH, 0, 255),
+        (CoapOption.URI_PATH, 0, 255),
+        (CoapOption.CONTENT_FORMAT, 0, 2),
+        (CoapOption.MAX_AGE, 0, 4),
+        (CoapOption.URI_QUERY, 0, 255),
+        (CoapOption.ACCEPT, 0, 2),
+        (CoapOption.LOCATION_QUERY, 0, 255),
+        (CoapOption.BLOCK2, 0, 3),
+        (CoapOption.BLOCK1, 0, 3),
+        (CoapOption.SIZE2, 0, 4),
+        (CoapOption.PROXY_URI, 1, 1034),
+        (CoapOption.PROXY_SCHEME, 1, 255),
+        (CoapOption.SIZE1, 0, 4),
+    ]
+}
+
+# Options which may occur more than once in a message
+REPEATABLE_OPTIONS = frozenset(
+    option.value
+    for option in (
+        CoapOption.IF_MATCH,
+        CoapOption.ETAG,
+        CoapOption.LOCATION_PATH,
+        CoapOption.URI_PATH,
+        CoapOption.URI_QUERY,
+        CoapOption.LOCATION_QUERY,
+    )
+)
+
+HEADER = struct.Struct("!BBH")
+OPTION_EXT = struct.Struct("!H")
+PAYLOAD_MARKER = b"\xff"
+
+
+def encode_uint(value: int) -> bytes:
+    """Encode an uint option value using as few bytes as possible."""
+
+    return value.to_bytes((value.bit_length() + 7) // 8, "big")
+
+
+def decode_uint(value: bytes | memoryview) -> int:
+    """Decode an uint option value (empty value means 0)."""
+
+    return int.from_bytes(value, "big")
+
+
+def uri_options(uri: str) -> list[tuple[CoapOption, bytes]]:
+    """Split an URI path and query into Uri-Path and Uri-Query options."""
+
+    path, _, query = uri.partition("?")
+    return [
+        (CoapOption.URI_PATH, segment.encode("utf-8"))
+        for segment in path.split("/")
+        if segment
+    ] + [
+        (CoapOption.URI_QUERY, argument.encode("utf-8"))
+        for argument in query.split("&")
+        if argument
+    ]
+
+
+def read_extended(data: bytes, pos: int, nibble: int, field: str):
+    """
+    Decode an extended option delta or length (nibble 13 or 14).
+
+    Returns the decoded value and the position just after the extension.
+    """
+
+    if nibble == 13:
+        if pos >= len(data):
+            raise MessageFormatError(f"Truncated extended option {field}")
+        return data[pos] + 13, pos + 1
+
+    if nibble == 14:
+        if pos + 2 > len(data):
+            raise MessageFormatError(f"Truncated extended option {field}")
+        return ((data[pos] << 8) | data[pos + 1]) + 269, pos + 2
+
+    raise MessageFormatError(f"Invalid option {field}: 15 is reserved")
 
 
 def parse_message(data: bytes) -> CoapMessage:
     """
     Parse the CoAP message data and return a CoapMessage object.
+
+    The message is decoded in a single pass with an integer cursor. Option
+    values are memoryviews into `data`, so they are not copied until needed.
+
+    Raises `MessageFormatError` if the message is malformed and
+    `BadOptionError` if it contains an unrecognized critical option.
+    Like unknown options, options with a value of invalid length and
+    repeated options which aren't repeatable are unrecognized (RFC 7252,
+    section 5.4.5).
     """
 
+    size = len(data)
+    if size < 4:
+        raise MessageFormatError("Message shorter than its header")
+
     header_version = (0xC0 & data[0]) >> 6
     header_type = (0x30 & data[0]) >> 4
     header_token_length = (0x0F & data[0]) >> 0
-    header_class = (data[1] >> 5) & 0x07
-    header_code = (data[1] >> 0) & 0x1F
-    header_code_decoded = f"{header_class}.{header_code:02}"
     header_mid = (data[2] << 8) | data[3]
-    token = data[4 : 4 + header_token_length]
-    options = data[4 + header_token_length :]
-    options_parsed: dict[CoapOption, bytes] = {}
+
+    if header_version != 1:
+        raise MessageFormatError(f"Unsupported version: {header_version}")
+    if header_token_length > 8:
+        raise MessageFormatError("Invalid token length: 9-15 are reserved")
+
+    header_code = CODES_BY_BYTE.get(data[1])
+    if header_code is None:
+        raise MessageFormatError(
+            f"Unknown code: {data[1] >> 5}.{data[1] & 0x1F:02}"
+        )
+
+    pos = 4 + header_token_length
+    if pos > size:
+        raise MessageFormatError("Message shorter than its token")
+    token = data[4:pos]
+
+    view = memoryview(data)
+    pairs: list[tuple[int, OptionValue]] = []
+    index: dict[int, int] = {}
     option_code = 0
-    payload = b""
-    while options and options[0] != 0xFF:
-        delta, length = (options[0] & 0xF0) >> 4, options[0] & 0x0F
-        options = options[1:]
-
-        # Handle extended option delta
-        if delta == 13:
-            delta = options[0] + 13
-            options = options[1:]
-        elif delta == 14:
-            delta = (options[0] << 8) + options[1] + 269
-            options = options[2:]
-        elif delta == 15:
-            raise ValueError(
-                "Invalid option delta: 15 is reserved for payload marker"
-            )
+    while pos < size:
+        byte = data[pos]
+        pos += 1
+        if byte == 0xFF:
+            if pos == size:
+                raise MessageFormatError("Payload marker without payload")
+            break
 
-        # Handle extended option length
-        if length == 13:
-            length = options[0] + 13
-            options = options[1:]
-        elif length == 14:
-            length = (options[0] << 8) + options[1] + 269
-            options = options[2:]
-        elif length == 15:
-            raise ValueError("Invalid option length: 15 is reserved")
+        delta, length = byte >> 4, byte & 0x0F
 
-        option_code += delta
-        options_parsed[CoapOption(option_code)] = options[:length]
-        options = options[length:]
+        # Handle extended option delta and length
+        if delta >= 13:
+            delta, pos = read_extended(data, pos, delta, "delta")
+        if length >= 13:
+            length, pos = read_extended(data, pos, length, "length")
+
+        end = pos + length
+        if end > size:
+            raise MessageFormatError("Option value exceeds message")
 
-    if options:
-        if options[0] == 0xFF:
-            payload = options[1:]
-        else:
-            raise ValueError("Invalid message: missing payload marker")
+        option_code += delta
+        lengths = OPTION_LENGTHS.get(option_code)
+        if (
+            lengths is not None
+            and length in lengths
+            and (option_code not in index or option_code in REPEATABLE_OPTIONS)
+        ):
+            index.setdefault(option_code, len(pairs))
+            pairs.append((option_code, view[pos:end]))
+        elif option_code & 1:
+            # Unrecognized elective (even) options are silently ignored,
+            # but critical (odd) ones cause the message to be rejected
+            raise BadOptionError(
+                CoapMessage(
+                    header_version=header_version,
+                    header_type=header_type,
+                    header_token_length=header_token_length,
+                    header_code=header_code,
+                    header_mid=header_mid,
+                    token=token,
+                    options=Options(),
+                    payload=b"",
+                ),
+                option_code,
+            )
+        pos = end
 
     return CoapMessage(
         header_version=header_version,
         header_type=header_type,
         header_token_length=header_token_length,
-        header_code=CoapCode(header_code_decoded),
+        header_code=header_code,
         header_mid=header_mid,
         token=token,
-        options=options_parsed,
-        payload=payload,
+        options=Options(pairs, index),
+        payload=data[pos:],
     )
 
 
-def encode_message(message: CoapMessage) -> bytes:
+def option_nibble(value: int) -> int:
+    """4-bit option delta/length field for the value (13, 14 mean extended)."""
+
+    if value < 13:
+        return value
+    return 13 if value < 269 else 14
+
+
+def write_extended(
+    buffer: bytearray | memoryview, pos: int, value: int
+) -> int:
+    """Write an option delta/length extension and return the new position."""
+
+    if value < 13:
+        return pos
+    if value < 269:
+        buffer[pos] = value - 13
+        return pos + 1
+    OPTION_EXT.pack_into(buffer, pos, value - 269)
+    return pos + 2
+
+
+# Headers of options with a delta and length that don't need extensions
+OPTION_HEADERS = [
+    [bytes([delta << 4 | length]) for length in range(13)]
+    for delta in range(13)
+]
+
+
+def option_header(delta: int, length: int) -> bytes:
+    """Return the encoded option header (delta, length and extensions)."""
+
+    if delta < 13 and length < 13:
+        return OPTION_HEADERS[delta][length]
+
+    header = bytearray(5)
+    header[0] = option_nibble(delta) << 4 | option_nibble(length)
+    pos = write_extended(header, 1, delta)
+    pos = write_extended(header, pos, length)
+    return bytes(header[:pos])
+
+
+def message_parts(message: CoapMessage) -> list[bytes | memoryview]:
     """
-    Encode CoapMessage and return encoded CoAP message data.
+    Return the encoded message as a list of chunks.
+
+    Header bytes come from precomputed tables, while the token, option values
+    and payload are referenced without copying.
     """
 
-    data = bytes()
+    parts: list[bytes | memoryview] = [
+        # Version (2 bits), Type (2 bits), Token Length (4 bits),
+        # Class (3 bits), Code (5 bits) and Message ID (2 bytes)
+        HEADER.pack(
+            (message.header_version << 6)
+            | (message.header_type << 4)
+            | message.header_token_length,
+            BYTES_BY_CODE[message.header_code],
+            message.header_mid & 0xFFFF,
+        ),
+        message.token,
+    ]
 
-    # First byte: Version (2 bits), Type (2 bits), Token Length (4 bits)
-    first_byte = (
-        (message.header_version << 6)
-        | (message.header_type << 4)
-        | message.header_token_length
-    )
+    # Options, already ordered by their numbers
+    prev_option = 0
+    for number, value in message.options.pairs:
+        parts.append(option_header(number - prev_option, len(value)))
+        parts.append(value)
+        prev_option = number
 
-    # Second byte: Class (3 bits), Code (5 bits)
-    class_, code = message.header_code.value.split(".", 1)
-    second_byte = (int(class_) << 5) | int(code)
+    if message.payload:
+        parts.append(PAYLOAD_MARKER)
+        parts.append(message.payload)
 
-    # Message ID (2 bytes)
-    mid_high = (message.header_mid >> 8) & 0xFF
-    mid_low = message.header_mid & 0xFF
+    return parts
 
-    # Combine all parts of header
-    data += bytes([first_byte, second_byte, mid_high, mid_low]) + message.token
 
-    # Options
-    prev_option = 0
-    for option, value in sorted(message.options.items()):
-        option_delta = option.value - prev_option
-        option_length = len(value)
-
-        # Handle extended option delta
-        if option_delta >= 269:
-            data += bytes(
-                [14 << 4 | (option_length if option_length < 13 else 13)]
-            )
-            delta_ext = option_delta - 269
-            data += bytes([delta_ext >> 8, delta_ext & 0xFF])
-        elif option_delta >= 13:
-            data += bytes(
-                [13 << 4 | (option_length if option_length < 13 else 13)]
-            )
-            data += bytes([option_delta - 13])
-        else:
-            data += bytes(
-                [
-                    option_delta << 4
-                    | (option_length if option_length < 13 else 13)
-                ]
-            )
+def encode_message_into(
+    message: CoapMessage, buffer: bytearray, offset: int = 0
+) -> int:
+    """
+    Encode CoapMessage into a caller-supplied buffer, starting at `offset`.
+
+    Allows reusing a single buffer for many messages: the header and option
+    headers are packed in place and the token, option values and payload are
+    copied directly into the buffer. Returns the number of written bytes;
+    raises ValueError if the buffer is too small (its contents are undefined
+    then).
+    """
 
-        # Handle extended option length
-        if option_length >= 269:
-            if option_delta < 13:
-                data = data[:-1] + bytes([option_delta << 4 | 14])
-            length_ext = option_length - 269
-            data += bytes([length_ext >> 8, length_ext & 0xFF])
-        elif option_length >= 13:
-            if option_delta < 13:
-                data = data[:-1] + bytes([option_delta << 4 | 13])
-            data += bytes([option_length - 13])
+    # unlike the bytearray, a view can't grow when written past its end
+    view = memoryview(buffer)[offset:]
+    try:
+        HEADER.pack_into(
+            view,
+            0,
+            (message.header_version << 6)
+            | (message.header_type << 4)
+            | message.header_token_length,
+            BYTES_BY_CODE[message.header_code],
+            message.header_mid & 0xFFFF,
+        )
+        pos = HEADER.size + len(message.token)
+        view[HEADER.size : pos] = message.token
 
-        data += value
-        prev_option = option.value
+        prev_option = 0
+        for number, value in message.options.pairs:
+            delta, length = number - prev_option, len(value)
+            if delta < 13 and length < 13:
+                view[pos] = delta << 4 | length
+                pos += 1
+            else:
+                view[pos] = option_nibble(delta) << 4 | option_nibble(length)
+                pos = write_extended(view, pos + 1, delta)
+                pos = write_extended(view, pos, length)
+            view[pos : pos + length] = value
+            pos += length
+            prev_option = number
 
-    if message.payload:
-        data += bytes([0xFF])
-        data += message.payload
+        if message.payload:
+            view[pos] = PAYLOAD_MARKER[0]
+            pos += 1
+            view[pos : pos + len(message.payload)] = message.payload
+            pos += len(message.payload)
+    except (IndexError, ValueError, struct.error):
+        raise ValueError(
+            f"Buffer too small: {len(view)} bytes available"
+        ) from None
+    finally:
+        view.release()
+
+    return pos
+
+
+def encode_message(message: CoapMessage) -> bytes:
+    """
+    Encode CoapMessage and return encoded CoAP message data.
+
+    The chunks of `message_parts()` are joined in a single step, so the
+    token, option values and payload are copied only once, into the result.
+    """
 
-    return data
+    return b"".join(message_parts(message))
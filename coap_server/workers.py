@@ -0,0 +1,291 @@
+"""
+Module providing multi-process mode of the CoAP server.
+
+Every worker process runs its own `CoAPServer` bound to the same host:port
+with `SO_REUSEPORT`, so the kernel distributes incoming datagrams between
+them. Objects of the resources are kept in a single owner process (started
+by `SharedObjectsManager`) and accessed by the workers through proxies, so
+writes done by one worker are visible to all the others. Persistent stores
+and the temperature history are kept in the owner process as well.
+"""
+
+import multiprocessing
+import signal
+import threading
+from multiprocessing.managers import BaseManager, BaseProxy, DictProxy
+from typing import Mapping, MutableMapping, Sequence, cast
+
+from coap_server.cache import CACHE_SIZE
+from coap_server.executor import BoundedExecutor
+from coap_server.history import Aggregate, History
+from coap_server.logger import logger, shutdown_logging
+from coap_server.ratelimit import RateLimiter
+from coap_server.resources.base_resource import BaseResource
+from coap_server.server import CoAPServer, ServerMode
+from coap_server.storage import Object, SensorStore, open_store
+from coap_server.utils.constants import DEFAULT_LEISURE
+
+
+class SharedObjects(dict):
+    """
+    Dictionary of resource objects living in the owner process.
+
+    Each method call on a proxy is executed by the manager in the owner
+    process, in a thread serving the connection of the worker. Changes are
+    made under a lock, so `create()` allocates IDs atomically across all
+    workers. Every change increments `version()`, so that workers can tell
+    whether their cached representations are still valid.
+    """
+
+    changes = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # reentrant, `create()` and `merge()` change the objects
+        self.lock = threading.RLock()
+
+    def version(self) -> int:
+        return self.changes
+
+    def create(self, obj: MutableMapping[str, str | int]) -> int:
+        with self.lock:
+            new_id = max(self.keys(), default=0) + 1
+            self[new_id] = obj
+        return new_id
+
+    def merge(
+        self, patches: Mapping[int, MutableMapping[str, str | int]]
+    ) -> list[int]:
+        """Merges patches into the objects, see `Store.merge()`."""
+
+        with self.lock:
+            missing = [key for key in patches if key not in self]
+            if not missing:
+                # a single update, so other requests see all or none of them
+                self.update(
+                    {
+                        key: {**self[key], **patch}
+                        for key, patch in patches.items()
+                    }
+                )
+        return missing
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.changes += 1
+            super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.changes += 1
+            super().__delitem__(key)
+
+    def pop(self, *args):
+        with self.lock:
+            self.changes += 1
+            return super().pop(*args)
+
+    def popitem(self):
+        with self.lock:
+            self.changes += 1
+            return super().popitem()
+
+    def clear(self):
+        with self.lock:
+            self.changes += 1
+            super().clear()
+
+    def update(self, *args, **kwargs):
+        with self.lock:
+            self.changes += 1
+            super().update(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        with self.lock:
+            self.changes += 1
+            return super().setdefault(key, default)
+
+
+class SharedObjectsProxy(DictProxy):
+    """Proxy to `SharedObjects`, used by the worker processes."""
+
+    # generated by MakeProxyType, so unknown to the type stubs
+    _exposed_: tuple[str, ...] = DictProxy._exposed_ + (  # type: ignore
+        "create",
+        "merge",
+        "version",
+    )
+
+    def create(self, obj: MutableMapping[str, str | int]) -> int:
+        return cast(int, self._callmethod("create", (obj,)))
+
+    def merge(
+        self, patches: Mapping[int, MutableMapping[str, str | int]]
+    ) -> list[int]:
+        return cast(list[int], self._callmethod("merge", (patches,)))
+
+    def version(self) -> int:
+        return cast(int, self._callmethod("version"))
+
+
+class SharedObjectsManager(BaseManager):
+    """Manager starting the process which owns the shared objects."""
+
+    def start(self, initializer=None, initargs=()):
+        # the owner process shouldn't die on Ctrl+C before the workers do
+        if initializer is None:
+            initializer = signal.signal
+            initargs = (signal.SIGINT, signal.SIG_IGN)
+        super().start(initializer, initargs)
+
+
+class StoreProxy(SharedObjectsProxy):
+    """Proxy to a persistent store opened by `open_store()`."""
+
+    _exposed_ = SharedObjectsProxy._exposed_ + ("rows", "flush", "close")
+
+    def items(self) -> list[tuple[int, Object]]:  # type: ignore[override]
+        # items views of the stores can't be sent to other processes
+        return cast(list[tuple[int, Object]], self._callmethod("rows"))
+
+    def flush(self):
+        self._callmethod("flush")
+
+    def close(self):
+        self._callmethod("close")
+
+
+class HistoryProxy(BaseProxy):
+    """Proxy to `History`, shared by the worker processes."""
+
+    _exposed_ = ("record", "forget", "since", "aggregate")
+
+    def record(self, temperatures: Mapping[int, int]):
+        self._callmethod("record", (temperatures,))
+
+    def forget(self, key: int):
+        self._callmethod("forget", (key,))
+
+    def since(self, key: int, since: float) -> list[tuple[float, int]]:
+        return cast(
+            list[tuple[float, int]], self._callmethod("since", (key, since))
+        )
+
+    def aggregate(
+        self, key: int, since: float, window: int, function: Aggregate
+    ) -> list[tuple[float, float]]:
+        return cast(
+            list[tuple[float, float]],
+            self._callmethod("aggregate", (key, since, window, function)),
+        )
+
+
+SharedObjectsManager.register(
+    "SharedObjects", SharedObjects, SharedObjectsProxy
+)
+SharedObjectsManager.register("History", History, HistoryProxy)
+SharedObjectsManager.register("SensorStore", SensorStore, SharedObjectsProxy)
+SharedObjectsManager.register("Store", open_store, StoreProxy)
+
+
+class WorkerPool:
+    """
+    Runs `workers` server processes listening on the same host:port.
+
+    The sockets are created and bound before forking, so no datagram is lost
+    between starting the pool and the workers entering their receive loops.
+    Every worker gets its own copy of the `executor`, with its own threads,
+    and of the `limiter`, so the limits apply to every worker separately.
+    Only the first worker joins the multicast `groups`, otherwise every
+    worker would answer each group request.
+    """
+
+    def __init__(
+        self,
+        routes: MutableMapping[str, BaseResource],
+        host="127.0.0.1",
+        port=5683,
+        mode: ServerMode = ServerMode.SYNC,
+        workers: int = multiprocessing.cpu_count(),
+        executor: BoundedExecutor | None = None,
+        limiter: RateLimiter | None = None,
+        cache_size: int = CACHE_SIZE,
+        groups: Sequence[str] = (),
+        interface: str | None = None,
+        leisure: float = DEFAULT_LEISURE,
+    ):
+        self.servers = [
+            CoAPServer(
+                routes,
+                host,
+                port,
+                mode,
+                reuse_port=True,
+                executor=executor,
+                limiter=limiter,
+                cache_size=cache_size,
+                groups=groups if i == 0 else (),
+                interface=interface,
+                leisure=leisure,
+            )
+            for i in range(workers)
+        ]
+        self.context = multiprocessing.get_context("fork")
+        self.processes: list[multiprocessing.process.BaseProcess] = []
+
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+
+    def start(self):
+        for server in self.servers:
+            process = self.context.Process(
+                target=self.run_worker, args=(server,), daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+
+        # the sockets are owned by the workers from now on
+        for server in self.servers:
+            server.close()
+
+        logger.info("Started %s worker processes", len(self.processes))
+
+    def run_worker(self, server: CoAPServer):
+        for other in self.servers:
+            if other is not server:
+                other.close()
+
+        signal.signal(signal.SIGTERM, server.handle_sigterm)
+        try:
+            server.start()
+        except KeyboardInterrupt:
+            server.shutdown()
+        finally:
+            # workers exit without running atexit handlers
+            shutdown_logging()
+
+    def wait(self):
+        """Block until all the workers have exited."""
+
+        try:
+            for process in self.processes:
+                process.join()
+        except KeyboardInterrupt:
+            logger.info("Received Ctrl+C, waiting for workers to stop...")
+            for process in self.processes:
+                process.join()
+
+    def handle_sigterm(self, signum, frame):
+        """Forward SIGTERM to the workers, so they shut down gracefully."""
+
+        logger.info("Received SIGTERM signal, stopping workers...")
+        self.shutdown()
+
+    def shutdown(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+
+        for process in self.processes:
+            process.join()
+
+        logger.info("All workers stopped")
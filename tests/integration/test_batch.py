@@ -0,0 +1,126 @@
+import json
+
+import pytest
+
+from coap_server.request_handler import RequestHandler
+from coap_server.resources.sensors import SensorsResource
+from coap_server.storage import SensorStore
+from coap_server.utils import cbor
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    ContentFormat,
+)
+from coap_server.utils.parser import encode_message, encode_uint, parse_message
+
+
+def request(
+    handler: RequestHandler,
+    code: CoapCode,
+    payload: bytes = b"",
+    content_format: int | None = None,
+) -> CoapMessage:
+    options = {CoapOption.URI_PATH: b"/sensors/batch"}
+    if content_format is not None:
+        options[CoapOption.CONTENT_FORMAT] = encode_uint(content_format)
+
+    return parse_message(
+        handler.handle_request(
+            encode_message(
+                CoapMessage(
+                    header_version=1,
+                    header_type=0,
+                    header_token_length=4,
+                    header_code=code,
+                    header_mid=1337,
+                    token=b"1234",
+                    options=options,
+                    payload=payload,
+                )
+            )
+        )
+    )
+
+
+def test_success(sensors, routes):
+    handler = RequestHandler(routes)
+
+    response = request(handler, CoapCode.POST, b"[[1, 30], [2, -4], [1, 31]]")
+
+    assert response.header_code == CoapCode.CHANGED
+    assert json.loads(response.payload) == [204, 204, 204]
+    assert sensors == {
+        1: {"name": "sensor 1", "temperature": 31},
+        2: {"name": "sensor 2", "temperature": -4},
+    }
+
+
+def test_cbor(sensors):
+    store = SensorStore(sensors)
+    handler = RequestHandler({"sensors": SensorsResource(store)})
+
+    response = request(
+        handler,
+        CoapCode.POST,
+        cbor.dumps([[2, 40]]),
+        content_format=ContentFormat.CBOR,
+    )
+
+    assert response.header_code == CoapCode.CHANGED
+    assert store[2] == {"name": "sensor 2", "temperature": 40}
+
+
+@pytest.mark.parametrize(
+    "payload, code, statuses",
+    [
+        (b'[[1, 30], [2, "x"], [3]]', CoapCode.BAD_REQUEST, [0, 400, 400]),
+        (b"[[1, 30], [3, 31], [2, true]]", CoapCode.BAD_REQUEST, [0, 0, 400]),
+        (b"[[1, 30], [3, 31], [4, 32]]", CoapCode.NOT_FOUND, [0, 404, 404]),
+        # temperatures outside of int32 can't be recorded in the history
+        (b"[[1, 30], [2, 1099511627776]]", CoapCode.BAD_REQUEST, [0, 400]),
+    ],
+)
+def test_rejected(sensors, routes, payload, code, statuses):
+    handler = RequestHandler(routes)
+
+    response = request(handler, CoapCode.POST, payload)
+
+    assert response.header_code == code
+    assert json.loads(response.payload) == statuses
+    assert sensors[1]["temperature"] == 21
+
+
+@pytest.mark.parametrize("payload", [b'{"1": 30}', b"[1, 30", b""])
+def test_invalid(sensors, routes, payload):
+    handler = RequestHandler(routes)
+
+    response = request(handler, CoapCode.POST, payload)
+
+    assert response.header_code == CoapCode.BAD_REQUEST
+    assert sensors[1]["temperature"] == 21
+
+
+def test_invalidates_representations(sensors, routes):
+    handler = RequestHandler(routes)
+    resource = routes["sensors"]
+    changed = []
+    resource.listeners.append(lambda *paths: changed.extend(paths))
+
+    request(handler, CoapCode.POST, b"[[1, 30], [1, 31]]")
+
+    assert changed == [
+        "/sensors",
+        "/sensors/1",
+        "/sensors/1/temperature",
+        "/sensors/1/history",
+    ]
+
+
+@pytest.mark.parametrize("code", [CoapCode.GET, CoapCode.PUT, CoapCode.DELETE])
+def test_method_not_allowed(routes, code):
+    handler = RequestHandler(routes)
+
+    response = request(handler, code)
+
+    assert response.header_code == CoapCode.METHOD_NOT_ALLOWED
@@ -0,0 +1,64 @@
+import socket
+
+import pytest
+
+from coap_server.batch_io import (
+    BatchIO,
+    MultiMessageIO,
+    decode_sockaddr,
+    encode_sockaddr,
+    load_libc,
+)
+
+
+def make_batch_io(kind, sock, batch_size):
+    if kind is BatchIO:
+        return BatchIO(sock, batch_size)
+
+    libc = load_libc()
+    if libc is None:
+        pytest.skip("recvmmsg() and sendmmsg() are not available")
+    return MultiMessageIO(sock, libc, batch_size)
+
+
+@pytest.mark.parametrize(
+    "family, addr",
+    [
+        (socket.AF_INET, ("127.0.0.1", 5683)),
+        (socket.AF_INET6, ("fe80::1", 61616, 7, 2)),
+    ],
+)
+def test_sockaddr(family, addr):
+    assert decode_sockaddr(encode_sockaddr(family, addr)) == addr
+
+
+@pytest.mark.parametrize("kind", [BatchIO, MultiMessageIO])
+def test_receive_and_send_batch(kind):
+    with (
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server,
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client,
+    ):
+        server.bind(("127.0.0.1", 0))
+        client.bind(("127.0.0.1", 0))
+        client.settimeout(5)
+        io = make_batch_io(kind, server, batch_size=8)
+
+        for i in range(10):
+            client.sendto(b"datagram %d" % i, server.getsockname())
+
+        assert io.wait(5)
+        first = io.receive()
+        second = io.receive()
+
+        # the batch is limited, the rest is received by the next call
+        assert len(first) == 8
+        assert [data for data, _ in first + second] == [
+            b"datagram %d" % i for i in range(10)
+        ]
+        assert {addr for _, addr in first} == {client.getsockname()}
+        assert io.receive() == []
+
+        io.send([(b"reply %d" % i, client.getsockname()) for i in range(10)])
+
+        for i in range(10):
+            assert client.recv(1024) == b"reply %d" % i
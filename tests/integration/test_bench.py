@@ -0,0 +1,89 @@
+import asyncio
+from threading import Thread
+
+import pytest
+
+from coap_server.bench import LoadGenerator, Report, parse_mix, run_benchmark
+from coap_server.request_handler import RequestHandler
+from coap_server.server import CoAPServer, ServerMode
+from coap_server.utils.constants import CoapCode, CoapOption
+from coap_server.utils.parser import parse_message, uri_options
+
+
+def test_parse_mix():
+    assert parse_mix("get=3, PUT=1") == {CoapCode.GET: 3, CoapCode.PUT: 1}
+
+    for mix in ("GET", "GET=x", "FETCH=1", "GET=0"):
+        with pytest.raises(ValueError):
+            parse_mix(mix)
+
+
+def test_report():
+    report = Report(duration=2.0, sent=5, latencies=[0.4, 0.1, 0.3, 0.2])
+
+    assert report.throughput == 2.0
+    assert report.loss_rate == pytest.approx(0.2)
+    assert report.percentile(0.5) == 0.3
+    assert report.percentile(0.999) == 0.4
+
+
+def test_delete_created(routes):
+    generator = LoadGenerator()
+
+    # nothing created yet, the seed sensors must not be deleted
+    request = parse_message(generator.make_request(CoapCode.DELETE, 1, b""))
+    assert request.header_code == CoapCode.GET
+
+    handler = RequestHandler(routes)
+    response = handler.handle_request(
+        generator.make_request(CoapCode.POST, 2, b"")
+    )
+    generator.track(response)
+    assert list(generator.created) == [3]
+
+    request = parse_message(generator.make_request(CoapCode.DELETE, 3, b""))
+    assert request.header_code == CoapCode.DELETE
+    assert request.options.all(CoapOption.URI_PATH) == [
+        value for _, value in uri_options("/sensors/3")
+    ]
+    assert not generator.created
+
+
+def test_load_generator(routes):
+    server = CoAPServer(routes)
+    server_thread = Thread(target=server.start, daemon=True)
+    server_thread.start()
+
+    try:
+        generator = LoadGenerator(
+            mix=parse_mix("GET=1,POST=1,PUT=1,DELETE=1"),
+            concurrency=4,
+            sensors=2,
+        )
+        report = asyncio.run(generator.run(0.5))
+    finally:
+        server.shutdown()
+        server_thread.join()
+
+    assert report.sent > 0
+    assert report.loss_rate == 0
+    assert report.percentile(0.5) <= report.percentile(0.99)
+    assert set(report.codes) <= {
+        CoapCode.CONTENT,
+        CoapCode.CREATED,
+        CoapCode.CHANGED,
+        CoapCode.DELETED,
+        CoapCode.NOT_FOUND,
+    }
+    # the sensors queried by GET and PUT are never deleted
+    assert report.codes[CoapCode.CONTENT] > 0
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_benchmark(workers):
+    report = run_benchmark(
+        LoadGenerator(concurrency=2), 0.3, ServerMode.BATCH, workers
+    )
+
+    assert report.received > 0
+    assert report.loss_rate == 0
@@ -0,0 +1,244 @@
+import json
+
+import pytest
+
+from coap_server.blockwise import decode_block, encode_block
+from coap_server.request_handler import RequestHandler
+from coap_server.resources.sensors import MAX_RENDERED, SensorsResource
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    CoapType,
+)
+from coap_server.utils.parser import (
+    decode_uint,
+    encode_message,
+    parse_message,
+)
+
+CLIENT = ("127.0.0.1", 40000)
+
+
+@pytest.fixture
+def many_sensors():
+    return {
+        i: {"name": f"sensor {i}", "temperature": i} for i in range(1, 101)
+    }
+
+
+def make_request(code, uri, block=None, option=CoapOption.BLOCK2, payload=b""):
+    options = {CoapOption.URI_PATH: uri}
+    if block is not None:
+        options[option] = encode_block(*block)
+
+    return encode_message(
+        CoapMessage(
+            header_version=1,
+            header_type=CoapType.CON,
+            header_token_length=4,
+            header_code=code,
+            header_mid=1337,
+            token=b"1234",
+            options=options,
+            payload=payload,
+        )
+    )
+
+
+def test_large_response_is_split(many_sensors):
+    resource = SensorsResource(many_sensors)
+    handler = RequestHandler({"sensors": resource})
+    expected = json.dumps(many_sensors).encode()
+
+    response = parse_message(
+        handler.handle_request(make_request(CoapCode.GET, b"/sensors"), CLIENT)
+    )
+    assert response.header_code == CoapCode.CONTENT
+    assert decode_block(response.options[CoapOption.BLOCK2]) == (0, True, 6)
+    assert decode_uint(response.options[CoapOption.SIZE2]) == len(expected)
+    payload = response.payload
+
+    # the following blocks are served without rendering the resource again
+    resource.get = None
+    num, more = 1, True
+    while more:
+        response = parse_message(
+            handler.handle_request(
+                make_request(CoapCode.GET, b"/sensors", (num, False, 6)),
+                CLIENT,
+            )
+        )
+        block_num, more, szx = decode_block(
+            response.options[CoapOption.BLOCK2]
+        )
+        assert (block_num, szx) == (num, 6)
+        assert len(response.payload) == 1024 or not more
+        payload += response.payload
+        num += 1
+
+    assert payload == expected
+
+
+def test_smaller_block_size_requested(routes, sensors):
+    handler = RequestHandler(routes)
+
+    response = parse_message(
+        handler.handle_request(
+            make_request(CoapCode.GET, b"/sensors/1", (0, False, 0)), CLIENT
+        )
+    )
+
+    assert decode_block(response.options[CoapOption.BLOCK2]) == (0, True, 0)
+    assert response.payload == json.dumps(sensors[1]).encode()[:16]
+
+
+def test_small_response_is_not_split(routes):
+    handler = RequestHandler(routes)
+
+    response = parse_message(
+        handler.handle_request(make_request(CoapCode.GET, b"/sensors"), CLIENT)
+    )
+
+    assert CoapOption.BLOCK2 not in response.options
+
+
+def test_block_out_of_range(many_sensors):
+    handler = RequestHandler({"sensors": SensorsResource(many_sensors)})
+    handler.handle_request(make_request(CoapCode.GET, b"/sensors"), CLIENT)
+
+    response = parse_message(
+        handler.handle_request(
+            make_request(CoapCode.GET, b"/sensors", (100, False, 6)), CLIENT
+        )
+    )
+
+    assert response.header_code == CoapCode.BAD_OPTION
+
+
+def test_block1_upload(routes, sensors):
+    handler = RequestHandler(routes)
+    payload = json.dumps({"name": "sensor 3", "temperature": 30}).encode()
+    blocks = [payload[i : i + 16] for i in range(0, len(payload), 16)]
+
+    for num, block in enumerate(blocks[:-1]):
+        response = parse_message(
+            handler.handle_request(
+                make_request(
+                    CoapCode.POST,
+                    b"/sensors",
+                    (num, True, 0),
+                    CoapOption.BLOCK1,
+                    block,
+                ),
+                CLIENT,
+            )
+        )
+        assert response.header_code == CoapCode.CONTINUE
+        assert decode_block(response.options[CoapOption.BLOCK1]) == (
+            num,
+            True,
+            0,
+        )
+        assert 3 not in sensors
+
+    response = parse_message(
+        handler.handle_request(
+            make_request(
+                CoapCode.POST,
+                b"/sensors",
+                (len(blocks) - 1, False, 0),
+                CoapOption.BLOCK1,
+                blocks[-1],
+            ),
+            CLIENT,
+        )
+    )
+
+    assert response.header_code == CoapCode.CREATED
+    assert decode_block(response.options[CoapOption.BLOCK1]) == (
+        len(blocks) - 1,
+        False,
+        0,
+    )
+    assert sensors[3] == {"name": "sensor 3", "temperature": 30}
+
+
+def test_block1_missing_block(routes):
+    handler = RequestHandler(routes)
+
+    response = parse_message(
+        handler.handle_request(
+            make_request(
+                CoapCode.PUT,
+                b"/sensors/1",
+                (1, False, 0),
+                CoapOption.BLOCK1,
+                b"{}",
+            ),
+            CLIENT,
+        )
+    )
+
+    assert response.header_code == CoapCode.REQUEST_ENTITY_INCOMPLETE
+
+
+def test_large_collection_streamed():
+    sensors = {
+        i: {"name": f"sensor {i}", "temperature": i}
+        for i in range(1, MAX_RENDERED + 101)
+    }
+    resource = SensorsResource(sensors)
+    handler = RequestHandler({"sensors": resource})
+    expected = json.dumps(sensors).encode()
+
+    started = []
+    stream = resource.stream
+
+    def counted_stream(request, chunks):
+        return stream(request, lambda fmt: started.append(True) or chunks(fmt))
+
+    resource.stream = counted_stream
+
+    payload = b""
+    num, more = 0, True
+    while more:
+        response = parse_message(
+            handler.handle_request(
+                make_request(CoapCode.GET, b"/sensors", (num, False, 6)),
+                CLIENT,
+            )
+        )
+        assert response.header_code == CoapCode.CONTENT
+        # the size isn't known until the whole payload is encoded
+        assert CoapOption.SIZE2 not in response.options
+        block_num, more, _ = decode_block(response.options[CoapOption.BLOCK2])
+        assert block_num == num
+        payload += response.payload
+        num += 1
+
+    assert payload == expected
+    # the payload is encoded only once, by the stream of the first request
+    assert len(started) == 1
+    assert handler.blocks.streams == {}
+
+
+def test_streamed_collection_paginated():
+    sensors = {
+        i: {"name": f"sensor {i}", "temperature": i % 50}
+        for i in range(1, MAX_RENDERED + 101)
+    }
+    handler = RequestHandler({"sensors": SensorsResource(sensors)})
+
+    response = parse_message(
+        handler.handle_request(
+            make_request(CoapCode.GET, b"/sensors?min_temp=49&offset=2"),
+            CLIENT,
+        )
+    )
+
+    # the selected sensors fit into a single block
+    assert CoapOption.BLOCK2 not in response.options
+    assert json.loads(response.payload) == {
+        str(i): sensors[i] for i in range(149, MAX_RENDERED + 101, 50)
+    }
@@ -0,0 +1,207 @@
+import json
+
+import pytest
+
+from coap_server.request_handler import RequestHandler
+from coap_server.utils import cbor
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    ContentFormat,
+)
+from coap_server.utils.parser import encode_message, encode_uint, parse_message
+
+
+def request(
+    code: CoapCode,
+    uri: bytes,
+    payload: bytes = b"",
+    accept: int | None = None,
+    content_format: int | None = None,
+) -> bytes:
+    options = {CoapOption.URI_PATH: uri}
+    if accept is not None:
+        options[CoapOption.ACCEPT] = encode_uint(accept)
+    if content_format is not None:
+        options[CoapOption.CONTENT_FORMAT] = encode_uint(content_format)
+
+    return encode_message(
+        CoapMessage(
+            header_version=1,
+            header_type=0,
+            header_token_length=4,
+            header_code=code,
+            header_mid=1337,
+            token=b"1234",
+            options=options,
+            payload=payload,
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "uri, expected",
+    [
+        (b"/sensors", lambda sensors: sensors),
+        (b"/sensors/1", lambda sensors: sensors[1]),
+        (b"/sensors/1/temperature", lambda sensors: 21),
+    ],
+)
+def test_get_cbor(sensors, routes, uri, expected):
+    handler = RequestHandler(routes)
+
+    response = parse_message(
+        handler.handle_request(
+            request(CoapCode.GET, uri, accept=ContentFormat.CBOR)
+        )
+    )
+
+    assert response.header_code == CoapCode.CONTENT
+    assert response.options[CoapOption.CONTENT_FORMAT] == b"\x3c"
+    assert cbor.loads(response.payload) == expected(sensors)
+
+
+def test_cached_per_format(sensors, routes):
+    handler = RequestHandler(routes)
+
+    def get(accept=None):
+        return parse_message(
+            handler.handle_request(
+                request(CoapCode.GET, b"/sensors/1", accept=accept)
+            )
+        )
+
+    as_json, as_cbor = get(), get(ContentFormat.CBOR)
+
+    assert json.loads(as_json.payload) == sensors[1]
+    assert cbor.loads(as_cbor.payload) == sensors[1]
+    assert as_json.options[CoapOption.ETAG] != as_cbor.options[CoapOption.ETAG]
+    assert get().payload == as_json.payload
+    assert get(ContentFormat.CBOR).payload == as_cbor.payload
+
+
+def test_not_acceptable(routes):
+    handler = RequestHandler(routes)
+
+    response = parse_message(
+        handler.handle_request(
+            request(CoapCode.GET, b"/sensors", accept=ContentFormat.TEXT_PLAIN)
+        )
+    )
+
+    assert response.header_code == CoapCode.NOT_ACCEPTABLE
+
+
+def test_post_cbor(sensors, routes):
+    handler = RequestHandler(routes)
+    obj = {"name": "sensor 3", "temperature": 30}
+
+    response = parse_message(
+        handler.handle_request(
+            request(
+                CoapCode.POST,
+                b"/sensors",
+                cbor.dumps(obj),
+                accept=ContentFormat.CBOR,
+                content_format=ContentFormat.CBOR,
+            )
+        )
+    )
+
+    assert response.header_code == CoapCode.CREATED
+    assert response.options[CoapOption.CONTENT_FORMAT] == b"\x3c"
+    assert cbor.loads(response.payload) == obj
+    assert sensors[3] == obj
+
+
+def test_put_temperature_cbor(sensors, routes):
+    handler = RequestHandler(routes)
+
+    response = parse_message(
+        handler.handle_request(
+            request(
+                CoapCode.PUT,
+                b"/sensors/1/temperature",
+                cbor.dumps(-5),
+                content_format=ContentFormat.CBOR,
+            )
+        )
+    )
+
+    assert response.header_code == CoapCode.CHANGED
+    assert json.loads(response.payload) == {
+        "name": "sensor 1",
+        "temperature": -5,
+    }
+
+
+@pytest.mark.parametrize(
+    "payload, content_format",
+    [
+        (b"\xa1", ContentFormat.CBOR),
+        (cbor.dumps([1, 2]), ContentFormat.CBOR),
+        (b"{}", ContentFormat.CBOR),
+        # a byte string can't be encoded to JSON
+        (cbor.dumps({"name": b"x", "temperature": 1}), ContentFormat.CBOR),
+        (cbor.dumps({"name": "x", "temperature": True}), ContentFormat.CBOR),
+        (b'{"name": "x", "temperature": false}', ContentFormat.JSON),
+        (b'{"name": 1, "temperature": 1}', ContentFormat.JSON),
+    ],
+)
+def test_post_invalid(sensors, routes, payload, content_format):
+    handler = RequestHandler(routes)
+
+    response = parse_message(
+        handler.handle_request(
+            request(
+                CoapCode.POST,
+                b"/sensors",
+                payload,
+                content_format=content_format,
+            )
+        )
+    )
+
+    assert response.header_code == CoapCode.BAD_REQUEST
+    assert len(sensors) == 2
+    response = parse_message(
+        handler.handle_request(request(CoapCode.GET, b"/sensors"))
+    )
+    assert response.header_code == CoapCode.CONTENT
+
+
+def test_unsupported_content_format(sensors, routes):
+    handler = RequestHandler(routes)
+
+    response = parse_message(
+        handler.handle_request(
+            request(
+                CoapCode.PUT,
+                b"/sensors/1/temperature",
+                b"40",
+                content_format=ContentFormat.TEXT_PLAIN,
+            )
+        )
+    )
+
+    assert response.header_code == CoapCode.UNSUPPORTED_CONTENT_FORMAT
+    assert sensors[1]["temperature"] == 21
+
+
+def test_not_acceptable_before_change(sensors, routes):
+    handler = RequestHandler(routes)
+
+    response = parse_message(
+        handler.handle_request(
+            request(
+                CoapCode.POST,
+                b"/sensors",
+                b'{"name": "sensor 3", "temperature": 30}',
+                accept=ContentFormat.TEXT_PLAIN,
+            )
+        )
+    )
+
+    assert response.header_code == CoapCode.NOT_ACCEPTABLE
+    assert len(sensors) == 2
@@ -1,8 +1,22 @@
+import asyncio
 import json
 
+import pytest
+
+import coap_server.resources.sensors as sensors_module
 from coap_server.request_handler import RequestHandler
-from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
-from coap_server.utils.parser import encode_message, parse_message
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    Options,
+)
+from coap_server.utils.content_format import encode_items
+from coap_server.utils.parser import (
+    encode_message,
+    parse_message,
+    uri_options,
+)
 
 
 def test_list(sensors, routes):
@@ -31,7 +45,10 @@ def test_list(sensors, routes):
     assert response.header_code == CoapCode.CONTENT
     assert response.header_mid == 1337
     assert response.token == b"1234"
-    assert response.options == {}
+    assert response.options.keys() == {
+        CoapOption.ETAG,
+        CoapOption.CONTENT_FORMAT,
+    }
     assert response.payload == json.dumps(sensors).encode("ascii")
 
 
@@ -61,7 +78,10 @@ def test_retrieve(sensors, routes):
     assert response.header_code == CoapCode.CONTENT
     assert response.header_mid == 1337
     assert response.token == b"1234"
-    assert response.options == {}
+    assert response.options.keys() == {
+        CoapOption.ETAG,
+        CoapOption.CONTENT_FORMAT,
+    }
     assert response.payload == json.dumps(sensors[1]).encode("ascii")
 
 
@@ -91,7 +111,10 @@ def test_temperature(routes):
     assert response.header_code == CoapCode.CONTENT
     assert response.header_mid == 1337
     assert response.token == b"1234"
-    assert response.options == {}
+    assert response.options.keys() == {
+        CoapOption.ETAG,
+        CoapOption.CONTENT_FORMAT,
+    }
     assert response.payload == b"21"
 
 
@@ -185,3 +208,305 @@ def test_invalid_path(routes):
     assert (
         response.payload == b'{"error": "Not found: /sensors/1/temperature/1"}'
     )
+
+
+def get(handler, uri, etag=None):
+    options = {CoapOption.URI_PATH: uri}
+    if etag is not None:
+        options[CoapOption.ETAG] = etag
+
+    request = CoapMessage(
+        header_version=1,
+        header_type=0,
+        header_token_length=4,
+        header_code=CoapCode.GET,
+        header_mid=1337,
+        token=b"1234",
+        options=options,
+        payload=b"",
+    )
+    return parse_message(handler.handle_request(encode_message(request)))
+
+
+def test_etag_valid(sensors, routes):
+    handler = RequestHandler(routes)
+    etag = bytes(get(handler, b"/sensors/1").options[CoapOption.ETAG])
+
+    response = get(handler, b"/sensors/1", etag)
+
+    assert response.header_code == CoapCode.VALID
+    assert response.options == {CoapOption.ETAG: etag}
+    assert response.payload == b""
+
+    response = get(handler, b"/sensors/1", b"\x00\x00\x00\x00")
+
+    assert response.header_code == CoapCode.CONTENT
+    assert response.options == {
+        CoapOption.ETAG: etag,
+        CoapOption.CONTENT_FORMAT: b"\x32",
+    }
+    assert response.payload == json.dumps(sensors[1]).encode("ascii")
+
+
+def test_uri_options(sensors, routes):
+    handler = RequestHandler(routes)
+    response = get(handler, b"/sensors?min_temp=21")
+    etag = bytes(response.options[CoapOption.ETAG])
+
+    # Uri-Path and Uri-Query option per segment, and several ETags
+    options = Options(
+        [
+            *uri_options("/sensors?min_temp=21"),
+            (CoapOption.ETAG, b"\x00\x00\x00\x00"),
+            (CoapOption.ETAG, etag),
+        ]
+    )
+    request = CoapMessage(
+        header_version=1,
+        header_type=0,
+        header_token_length=4,
+        header_code=CoapCode.GET,
+        header_mid=1337,
+        token=b"1234",
+        options=options,
+        payload=b"",
+    )
+    response = parse_message(handler.handle_request(encode_message(request)))
+
+    assert response.header_code == CoapCode.VALID
+    assert response.options == {CoapOption.ETAG: etag}
+
+    request = CoapMessage(
+        header_version=1,
+        header_type=0,
+        header_token_length=4,
+        header_code=CoapCode.GET,
+        header_mid=1338,
+        token=b"1234",
+        options=Options(uri_options("/sensors/2/temperature")),
+        payload=b"",
+    )
+    response = parse_message(handler.handle_request(encode_message(request)))
+
+    assert response.header_code == CoapCode.CONTENT
+    assert response.payload == str(sensors[2]["temperature"]).encode()
+
+
+def test_representation_cached(routes, monkeypatch):
+    handler = RequestHandler(routes)
+    renders = []
+    monkeypatch.setattr(
+        sensors_module,
+        "encode_items",
+        lambda items, fmt: renders.append(items) or encode_items(items, fmt),
+    )
+
+    first = get(handler, b"/sensors")
+    second = get(handler, b"/sensors")
+
+    assert len(renders) == 1
+    assert first.payload == second.payload
+    assert first.options == second.options
+
+
+def test_representation_invalidated(routes):
+    handler = RequestHandler(routes)
+    etag = get(handler, b"/sensors").options[CoapOption.ETAG]
+
+    request = CoapMessage(
+        header_version=1,
+        header_type=0,
+        header_token_length=4,
+        header_code=CoapCode.PUT,
+        header_mid=1338,
+        token=b"1234",
+        options={CoapOption.URI_PATH: b"/sensors/2/temperature"},
+        payload=b"30",
+    )
+    handler.handle_request(encode_message(request))
+
+    response = get(handler, b"/sensors", etag)
+
+    assert response.header_code == CoapCode.CONTENT
+    assert response.options[CoapOption.ETAG] != etag
+    assert b'"temperature": 30' in response.payload
+
+
+@pytest.mark.parametrize(
+    "query, ids",
+    [
+        (b"offset=1", [2]),
+        (b"limit=1", [1]),
+        (b"offset=0&limit=0", []),
+        (b"min_temp=22", [2]),
+        (b"min_temp=30", []),
+        (b"min_temp=21&offset=1&limit=5", [2]),
+    ],
+)
+def test_list_query(sensors, routes, query, ids):
+    handler = RequestHandler(routes)
+
+    response = get(handler, b"/sensors?" + query)
+
+    assert response.header_code == CoapCode.CONTENT
+    assert response.payload == json.dumps({i: sensors[i] for i in ids}).encode(
+        "ascii"
+    )
+
+
+@pytest.mark.parametrize(
+    "query", [b"offset=-1", b"limit=x", b"min_temp=", b"limit=-2"]
+)
+def test_list_invalid_query(routes, query):
+    handler = RequestHandler(routes)
+
+    response = get(handler, b"/sensors?" + query)
+
+    assert response.header_code == CoapCode.BAD_REQUEST
+
+
+def test_response_cached(sensors, routes, monkeypatch):
+    handler = RequestHandler(routes)
+    calls = []
+    get_sensor = routes["sensors"].get
+    monkeypatch.setattr(
+        routes["sensors"],
+        "get",
+        lambda request: calls.append(request.uri) or get_sensor(request),
+    )
+
+    first = get(handler, b"/sensors/1")
+    second = get(handler, b"/sensors/1")
+
+    assert calls == ["/sensors/1"]
+    assert second == first
+    assert handler.metrics.requests == {
+        (CoapCode.GET, "/sensors/{id:int}", CoapCode.CONTENT): 2
+    }
+
+    # requests with an ETag are validated by the resource
+    etag = bytes(first.options[CoapOption.ETAG])
+    assert get(handler, b"/sensors/1", etag).header_code == CoapCode.VALID
+    assert len(calls) == 2
+
+    request = CoapMessage(
+        header_version=1,
+        header_type=0,
+        header_token_length=4,
+        header_code=CoapCode.PUT,
+        header_mid=1338,
+        token=b"1234",
+        options={CoapOption.URI_PATH: b"/sensors/1/temperature"},
+        payload=b"30",
+    )
+    handler.handle_request(encode_message(request))
+
+    response = get(handler, b"/sensors/1")
+
+    assert calls[-1] == "/sensors/1"
+    assert b'"temperature": 30' in response.payload
+
+
+def test_response_cache_disabled(routes, monkeypatch):
+    handler = RequestHandler(routes, cache_size=0)
+    calls = []
+    get_sensor = routes["sensors"].get
+    monkeypatch.setattr(
+        routes["sensors"],
+        "get",
+        lambda request: calls.append(request.uri) or get_sensor(request),
+    )
+
+    get(handler, b"/sensors/1")
+    get(handler, b"/sensors/1")
+
+    assert len(calls) == 2
+    assert handler.cache is None
+
+
+def test_single_flight(sensors, routes, monkeypatch):
+    handler = RequestHandler(routes, cache_size=0)
+    calls = []
+
+    async def get_sensor(request):
+        calls.append(request.uri)
+        await asyncio.sleep(0.05)
+        return routes["sensors"].represent(request, lambda fmt: b"21")
+
+    monkeypatch.setattr(routes["sensors"], "get", get_sensor)
+
+    def request(uri, mid, token):
+        return encode_message(
+            CoapMessage(
+                header_version=1,
+                header_type=0,
+                header_token_length=len(token),
+                header_code=CoapCode.GET,
+                header_mid=mid,
+                token=token,
+                options=Options(uri_options(uri)),
+                payload=b"",
+            )
+        )
+
+    async def main():
+        return await asyncio.gather(
+            handler.handle_request_async(request("/sensors/1", 1, b"a")),
+            handler.handle_request_async(request("/sensors/1", 2, b"bb")),
+            handler.handle_request_async(request("/sensors/2", 3, b"c")),
+            handler.handle_request_async(request("/sensors/1", 4, b"")),
+        )
+
+    responses = [parse_message(data) for data in asyncio.run(main())]
+
+    # identical requests are handled once, the others wait for the response
+    assert calls == ["/sensors/1", "/sensors/2"]
+    assert [(r.header_mid, r.token) for r in responses] == [
+        (1, b"a"),
+        (2, b"bb"),
+        (3, b"c"),
+        (4, b""),
+    ]
+    assert all(r.payload == b"21" for r in responses)
+    assert responses[1].options == responses[0].options
+    assert handler.inflight == {}
+    assert handler.metrics.requests == {
+        (CoapCode.GET, "/sensors/{id:int}", CoapCode.CONTENT): 4
+    }
+
+    # requests arriving after the response are handled again
+    asyncio.run(main())
+    assert len(calls) == 4
+
+
+def test_single_flight_error(routes, monkeypatch):
+    handler = RequestHandler(routes, cache_size=0)
+
+    async def get_sensor(request):
+        await asyncio.sleep(0.05)
+        raise KeyError("sensor")
+
+    monkeypatch.setattr(routes["sensors"], "get", get_sensor)
+    request = encode_message(
+        CoapMessage(
+            header_version=1,
+            header_type=0,
+            header_token_length=1,
+            header_code=CoapCode.GET,
+            header_mid=1,
+            token=b"a",
+            options={CoapOption.URI_PATH: b"/sensors/1"},
+            payload=b"",
+        )
+    )
+
+    async def main():
+        return await asyncio.gather(
+            handler.handle_request_async(request),
+            handler.handle_request_async(request),
+        )
+
+    first, second = asyncio.run(main())
+
+    assert first == second
+    assert parse_message(first).header_code == CoapCode.BAD_REQUEST
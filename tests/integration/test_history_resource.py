@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+from coap_server.history import History
+from coap_server.request_handler import RequestHandler
+from coap_server.resources.sensors import SensorsResource
+from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
+from coap_server.utils.parser import encode_message, parse_message
+
+
+class Clock:
+    def __init__(self, now: float = 6000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def handler(sensors, clock):
+    resource = SensorsResource(sensors, History(clock=clock))
+    return RequestHandler({"sensors": resource})
+
+
+def request(
+    handler: RequestHandler, code: CoapCode, uri: bytes, payload: bytes = b""
+) -> CoapMessage:
+    return parse_message(
+        handler.handle_request(
+            encode_message(
+                CoapMessage(
+                    header_version=1,
+                    header_type=0,
+                    header_token_length=4,
+                    header_code=code,
+                    header_mid=1337,
+                    token=b"1234",
+                    options={CoapOption.URI_PATH: uri},
+                    payload=payload,
+                )
+            )
+        )
+    )
+
+
+def test_recorded(handler, clock):
+    request(handler, CoapCode.PUT, b"/sensors/1/temperature", b"30")
+    clock.now += 30
+    request(
+        handler,
+        CoapCode.PUT,
+        b"/sensors/1",
+        b'{"name": "sensor 1", "temperature": 31}',
+    )
+    clock.now += 30
+    request(handler, CoapCode.POST, b"/sensors/batch", b"[[1, 35], [2, 5]]")
+
+    response = request(handler, CoapCode.GET, b"/sensors/1/history")
+
+    assert response.header_code == CoapCode.CONTENT
+    assert json.loads(response.payload) == [
+        [6000.0, 30],
+        [6030.0, 31],
+        [6060.0, 35],
+    ]
+
+    response = request(handler, CoapCode.GET, b"/sensors/1/history?since=6030")
+    assert json.loads(response.payload) == [[6030.0, 31], [6060.0, 35]]
+
+    response = request(
+        handler, CoapCode.GET, b"/sensors/1/history?agg=avg&window=60"
+    )
+    assert json.loads(response.payload) == [[6000, 30.5], [6060, 35.0]]
+
+    response = request(handler, CoapCode.GET, b"/sensors/1/history?agg=max")
+    assert json.loads(response.payload) == [[6000, 31], [6060, 35]]
+
+
+def test_created_and_deleted(handler):
+    response = request(
+        handler,
+        CoapCode.POST,
+        b"/sensors",
+        b'{"name": "sensor 3", "temperature": 30}',
+    )
+    assert response.header_code == CoapCode.CREATED
+
+    response = request(handler, CoapCode.GET, b"/sensors/3/history")
+    assert json.loads(response.payload) == [[6000.0, 30]]
+
+    request(handler, CoapCode.DELETE, b"/sensors/3")
+
+    response = request(handler, CoapCode.GET, b"/sensors/3/history")
+    assert response.header_code == CoapCode.NOT_FOUND
+
+
+def test_not_cached_after_change(handler):
+    response = request(handler, CoapCode.GET, b"/sensors/1/history")
+    assert json.loads(response.payload) == []
+
+    request(handler, CoapCode.PUT, b"/sensors/1/temperature", b"30")
+
+    response = request(handler, CoapCode.GET, b"/sensors/1/history")
+    assert json.loads(response.payload) == [[6000.0, 30]]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [b"since=x", b"agg=median", b"agg=avg&window=0", b"agg=avg&window=90"],
+)
+def test_invalid_query(handler, query):
+    response = request(handler, CoapCode.GET, b"/sensors/1/history?" + query)
+
+    assert response.header_code == CoapCode.BAD_REQUEST
+
+
+def test_not_found(handler):
+    response = request(handler, CoapCode.GET, b"/sensors/9/history")
+
+    assert response.header_code == CoapCode.NOT_FOUND
+
+
+@pytest.mark.parametrize(
+    "code", [CoapCode.POST, CoapCode.PUT, CoapCode.DELETE]
+)
+def test_method_not_allowed(handler, code):
+    response = request(handler, code, b"/sensors/1/history")
+
+    assert response.header_code == CoapCode.METHOD_NOT_ALLOWED
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from coap_server.request_handler import RequestHandler
+from coap_server.utils.constants import CoapCode
+from coap_server.utils.parser import parse_message
+
+
+def test_bad_option(routes):
+    handler = RequestHandler(routes)
+
+    # Uri-Path followed by unrecognized critical option 9
+    response_encoded = handler.handle_request(
+        b"D\x01\x0591234\xb8/sensors\xd1\x01x"
+    )
+    response = parse_message(response_encoded)
+
+    assert response.header_code == CoapCode.BAD_OPTION
+    assert response.header_mid == 1337
+    assert response.token == b"1234"
+    assert response.payload == (
+        b'{"error": "Unrecognized critical option: 25"}'
+    )
+
+
+def test_malformed_ignored(routes):
+    handler = RequestHandler(routes)
+
+    assert handler.handle_request(b"D\x01\x0591234\xb8/sen") is None
+
+
+# Uri-Path which isn't valid UTF-8, with Block1 and Block2 as well
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"\x50\x01\x00\x01\xb1\xff",
+        b"\x50\x03\x00\x01\xb1\xff\xd1\x03\x08",
+        b"\x50\x01\x00\x01\xb1\xff\xc1\x16",
+    ],
+)
+@pytest.mark.parametrize("observed", [False, True])
+def test_invalid_uri(routes, data, observed):
+    handler = RequestHandler(routes)
+    if observed:
+        # GET /sensors/1 with Observe 0 by another client
+        response = handler.handle_request(
+            b"\x50\x01\x00\x02\x60\x57sensors\x011", ("127.0.0.1", 40001)
+        )
+        assert parse_message(response).header_code == CoapCode.CONTENT
+        assert len(handler.observers) == 1
+
+    for response in (
+        handler.handle_request(data, ("127.0.0.1", 40000)),
+        asyncio.run(handler.handle_request_async(data, ("127.0.0.1", 40000))),
+    ):
+        assert parse_message(response).header_code == CoapCode.BAD_REQUEST
+    assert len(handler.observers) == observed
@@ -0,0 +1,261 @@
+import asyncio
+import json
+
+from coap_server.messaging import MessageLayer
+from coap_server.metrics import UNMATCHED
+from coap_server.ratelimit import RateLimiter
+from coap_server.request_handler import RequestHandler
+from coap_server.resources.base_resource import BaseResource
+from coap_server.utils.constants import (
+    MAX_RETRANSMIT,
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    CoapType,
+)
+from coap_server.utils.construct_response import construct_response
+from coap_server.utils.parser import encode_message, parse_message
+
+CLIENT = ("127.0.0.1", 40000)
+
+
+class SlowResource(BaseResource):
+    objects = {}
+
+    async def get(self, request: CoapMessage) -> CoapMessage:
+        await asyncio.sleep(0.2)
+        return construct_response(request, CoapCode.CONTENT, b"slow")
+
+
+def make_request(header_type, code=CoapCode.GET, uri=b"/sensors", payload=b""):
+    return encode_message(
+        CoapMessage(
+            header_version=1,
+            header_type=header_type,
+            header_token_length=4,
+            header_code=code,
+            header_mid=1337,
+            token=b"1234",
+            options={
+                CoapOption.URI_PATH: uri,
+            },
+            payload=payload,
+        )
+    )
+
+
+def test_piggybacked_ack(routes):
+    messaging = MessageLayer(RequestHandler(routes))
+
+    response = parse_message(
+        messaging.receive(make_request(CoapType.CON), CLIENT)
+    )
+
+    assert response.header_type == CoapType.ACK
+    assert response.header_code == CoapCode.CONTENT
+    assert response.header_mid == 1337
+    assert response.token == b"1234"
+
+
+def test_non_confirmable(routes):
+    messaging = MessageLayer(RequestHandler(routes))
+
+    response = parse_message(
+        messaging.receive(make_request(CoapType.NON), CLIENT)
+    )
+
+    assert response.header_type == CoapType.NON
+    assert response.header_code == CoapCode.CONTENT
+    assert response.header_mid != 1337
+    assert response.token == b"1234"
+
+
+def test_duplicate_post(sensors, routes):
+    messaging = MessageLayer(RequestHandler(routes))
+    request = make_request(
+        CoapType.CON,
+        CoapCode.POST,
+        payload=json.dumps({"name": "New", "temperature": 30}).encode(),
+    )
+
+    first = messaging.receive(request, CLIENT)
+    retransmitted = messaging.receive(request, CLIENT)
+
+    assert retransmitted == first
+    assert parse_message(first).header_code == CoapCode.CREATED
+    assert len(sensors) == 3
+
+    # the same message ID from another client is a different exchange
+    messaging.receive(request, ("127.0.0.1", 40001))
+    assert len(sensors) == 4
+
+
+def test_exchanges_bounded(routes):
+    messaging = MessageLayer(RequestHandler(routes), max_exchanges=10)
+
+    for port in range(100):
+        messaging.receive(make_request(CoapType.CON), ("127.0.0.1", port))
+
+    assert len(messaging.exchanges) == 10
+
+
+def test_ping(routes):
+    messaging = MessageLayer(RequestHandler(routes))
+
+    reply = messaging.receive(b"\x40\x00\x05\x39", CLIENT)
+
+    assert reply == b"\x70\x00\x05\x39"
+    assert messaging.receive(b"\x50\x00\x05\x39", CLIENT) is None
+
+
+def test_malformed_confirmable_rejected(routes):
+    messaging = MessageLayer(RequestHandler(routes))
+
+    reply = messaging.receive(b"D\x01\x0591234\xb8/sen", CLIENT)
+
+    assert reply == b"\x70\x00\x05\x39"
+
+
+def test_retransmission(routes):
+    messaging = MessageLayer(RequestHandler(routes))
+    timeouts = []
+    response = messaging.receive(make_request(CoapType.NON), CLIENT)
+
+    message = messaging.send_confirmable(
+        response, CLIENT, lambda: timeouts.append(True)
+    )
+    assert parse_message(message).header_type == CoapType.CON
+
+    now = messaging.schedule[0].next_at
+    assert messaging.due(now - 0.1) == []
+    for _ in range(MAX_RETRANSMIT):
+        assert messaging.due(now) == [(message, CLIENT)]
+        now = messaging.schedule[0].next_at
+
+    assert messaging.due(now) == []
+    assert timeouts == [True]
+
+    # acknowledged messages aren't retransmitted
+    message = messaging.send_confirmable(response, CLIENT)
+    mid = parse_message(message).header_mid
+    messaging.receive(bytes([0x60, 0, mid >> 8, mid & 0xFF]), CLIENT)
+    assert messaging.due(messaging.schedule[0].next_at) == []
+
+
+def test_separate_response(routes):
+    routes["slow"] = SlowResource()
+    messaging = MessageLayer(RequestHandler(routes), separate_after=0.05)
+    sent = []
+
+    response = asyncio.run(
+        messaging.receive_async(
+            make_request(CoapType.CON, uri=b"/slow"),
+            CLIENT,
+            lambda data, remote: sent.append(data),
+        )
+    )
+
+    # empty ACK is sent first, the response follows as a CON message
+    assert sent == [b"\x60\x00\x05\x39"]
+    response = parse_message(response)
+    assert response.header_type == CoapType.CON
+    assert response.header_mid != 1337
+    assert response.token == b"1234"
+    assert response.payload == b"slow"
+    assert len(messaging.transmissions) == 1
+
+
+def test_rate_limited(routes):
+    handler = RequestHandler(routes)
+    messaging = MessageLayer(
+        handler, limiter=RateLimiter(client_rate=1, client_burst=2)
+    )
+
+    for port in (40000, 40001):
+        response = parse_message(
+            messaging.receive(make_request(CoapType.CON), ("10.0.0.1", port))
+        )
+        assert response.header_code == CoapCode.CONTENT
+
+    # the client is limited regardless of its port
+    request = make_request(CoapType.CON)
+    response = parse_message(messaging.receive(request, ("10.0.0.1", 40002)))
+
+    assert response.header_type == CoapType.ACK
+    assert response.header_code == CoapCode.TOO_MANY_REQUESTS
+    assert response.header_mid == 1337
+    assert response.token == b"1234"
+    assert response.options.uint(CoapOption.MAX_AGE) == 1
+
+    # non-confirmable requests are dropped
+    request = make_request(CoapType.NON)
+    assert messaging.receive(request, ("10.0.0.1", 40003)) is None
+
+    # duplicates of admitted requests are still answered from the cache
+    request = make_request(CoapType.CON)
+    duplicate = messaging.receive(request, ("10.0.0.1", 40000))
+    assert parse_message(duplicate).header_code == CoapCode.CONTENT
+
+    # rejected requests aren't remembered, nor passed to the handler
+    assert len(messaging.exchanges) == 2
+    assert handler.metrics.rejections == {CoapCode.TOO_MANY_REQUESTS: 2}
+    assert sum(handler.metrics.requests.values()) == 2
+
+
+def test_group_request(routes, monkeypatch):
+    messaging = MessageLayer(RequestHandler(routes), leisure=2)
+    monkeypatch.setattr("random.uniform", lambda a, b: b / 2)
+
+    # the response is deferred by a random part of the leisure
+    request = make_request(CoapType.NON)
+    assert messaging.receive(request, CLIENT, group=True) is None
+    send_at = messaging.deferred[0].send_at
+    assert messaging.due(send_at - 0.1) == []
+
+    (data, remote), *rest = messaging.due(send_at)
+    response = parse_message(data)
+    assert rest == []
+    assert remote == CLIENT
+    assert response.header_type == CoapType.NON
+    assert response.header_code == CoapCode.CONTENT
+    assert response.token == b"1234"
+    assert messaging.due(send_at + 1) == []
+
+    # duplicates aren't answered again
+    assert messaging.receive(request, CLIENT, group=True) is None
+    assert messaging.deferred == []
+
+
+def test_group_request_errors_suppressed(routes):
+    messaging = MessageLayer(RequestHandler(routes), leisure=0)
+    client = ("10.0.0.1", 40000)
+
+    # error responses, e.g. from servers without the resource
+    request = make_request(CoapType.NON, uri=b"/missing")
+    assert messaging.receive(request, client, group=True) is None
+    assert messaging.due() == []
+
+    # confirmable requests and pings sent to a group are ignored, no RST
+    for request in (make_request(CoapType.CON), b"\x40\x00\x05\x39"):
+        assert messaging.receive(request, client, group=True) is None
+    assert messaging.due() == []
+    assert messaging.handler.metrics.requests == {
+        (CoapCode.GET, UNMATCHED, CoapCode.NOT_FOUND): 1
+    }
+
+
+def test_group_request_async(routes):
+    messaging = MessageLayer(RequestHandler(routes), leisure=0)
+
+    response = asyncio.run(
+        messaging.receive_async(
+            make_request(CoapType.NON),
+            CLIENT,
+            lambda data, remote: None,
+            group=True,
+        )
+    )
+
+    assert response is None
+    [(data, remote)] = messaging.due()
+    assert parse_message(data).header_code == CoapCode.CONTENT
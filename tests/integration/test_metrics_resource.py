@@ -0,0 +1,99 @@
+import json
+
+from coap_server.metrics import UNMATCHED
+from coap_server.request_handler import RequestHandler
+from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
+from coap_server.utils.parser import (
+    decode_uint,
+    encode_message,
+    encode_uint,
+    parse_message,
+)
+
+
+def request(uri: bytes, accept: int | None = None) -> bytes:
+    options = {CoapOption.URI_PATH: uri}
+    if accept is not None:
+        options[CoapOption.ACCEPT] = encode_uint(accept)
+
+    return encode_message(
+        CoapMessage(
+            header_version=1,
+            header_type=0,
+            header_token_length=4,
+            header_code=CoapCode.GET,
+            header_mid=1337,
+            token=b"1234",
+            options=options,
+            payload=b"",
+        )
+    )
+
+
+def test_requests_recorded(routes):
+    handler = RequestHandler(routes)
+    handler.handle_request(request(b"/sensors/1"))
+    handler.handle_request(request(b"/sensors/2"))
+    handler.handle_request(request(b"/sensors/3"))
+    handler.handle_request(request(b"/unknown/path"))
+    handler.handle_request(b"\x40")
+
+    metrics = handler.metrics
+    assert metrics.requests == {
+        (CoapCode.GET, "/sensors/{id:int}", CoapCode.CONTENT): 2,
+        (CoapCode.GET, "/sensors/{id:int}", CoapCode.NOT_FOUND): 1,
+        (CoapCode.GET, UNMATCHED, CoapCode.NOT_FOUND): 1,
+    }
+    assert metrics.parse_failures == 1
+
+
+def test_notifications_not_recorded(routes):
+    handler = RequestHandler(routes)
+    handler.process(parse_message(request(b"/sensors")))
+
+    assert handler.metrics.requests == {}
+
+
+def test_json(routes):
+    handler = RequestHandler(routes)
+    handler.handle_request(request(b"/sensors"))
+
+    response = parse_message(
+        handler.handle_request(request(b"/.well-known/metrics"))
+    )
+
+    assert response.header_code == CoapCode.CONTENT
+    assert decode_uint(response.options[CoapOption.CONTENT_FORMAT]) == 50
+    metrics = json.loads(response.payload)
+    assert metrics["requests"] == [
+        {"method": "GET", "route": "/sensors", "code": "2.05", "count": 1}
+    ]
+    assert metrics["parse_failures"] == 0
+    assert metrics["latency"][0]["count"] == 1
+    assert metrics["latency"][0]["buckets"]["+Inf"] == 1
+
+
+def test_prometheus(routes):
+    handler = RequestHandler(routes)
+    handler.handle_request(request(b"/sensors"))
+
+    response = parse_message(
+        handler.handle_request(request(b"/.well-known/metrics", accept=0))
+    )
+
+    assert response.header_code == CoapCode.CONTENT
+    assert response.options[CoapOption.CONTENT_FORMAT] == b""
+    assert (
+        'coap_requests_total{method="GET",route="/sensors",code="2.05"} 1'
+        in response.payload.decode().splitlines()
+    )
+
+
+def test_not_acceptable(routes):
+    handler = RequestHandler(routes)
+
+    response = parse_message(
+        handler.handle_request(request(b"/.well-known/metrics", accept=60))
+    )
+
+    assert response.header_code == CoapCode.NOT_ACCEPTABLE
@@ -0,0 +1,258 @@
+import json
+import socket
+from threading import Thread
+
+import pytest
+
+from coap_server.messaging import MessageLayer
+from coap_server.observe import CON_EVERY
+from coap_server.request_handler import RequestHandler
+from coap_server.server import CoAPServer, ServerMode
+from coap_server.utils import cbor
+from coap_server.utils.constants import (
+    MAX_RETRANSMIT,
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    CoapType,
+    ContentFormat,
+)
+from coap_server.utils.parser import encode_message, encode_uint, parse_message
+
+CLIENT = ("127.0.0.1", 40000)
+
+
+def make_request(
+    code, uri, token=b"1234", observe=None, payload=b"", mid=1337, accept=None
+):
+    options = {CoapOption.URI_PATH: uri}
+    if observe is not None:
+        options[CoapOption.OBSERVE] = bytes([observe]) if observe else b""
+    if accept is not None:
+        options[CoapOption.ACCEPT] = encode_uint(accept)
+
+    return encode_message(
+        CoapMessage(
+            header_version=1,
+            header_type=CoapType.CON,
+            header_token_length=len(token),
+            header_code=code,
+            header_mid=mid,
+            token=token,
+            options=options,
+            payload=payload,
+        )
+    )
+
+
+def test_register_and_notify(routes):
+    messaging = MessageLayer(RequestHandler(routes))
+
+    response = parse_message(
+        messaging.receive(
+            make_request(CoapCode.GET, b"/sensors/1/temperature", observe=0),
+            CLIENT,
+        )
+    )
+    assert response.header_code == CoapCode.CONTENT
+    assert response.options[CoapOption.OBSERVE] == b""
+    assert response.payload == b"21"
+    assert messaging.notifications() == []
+
+    messaging.receive(
+        make_request(
+            CoapCode.PUT,
+            b"/sensors/1/temperature",
+            token=b"5678",
+            payload=b"40",
+            mid=1,
+        ),
+        ("127.0.0.1", 40001),
+    )
+
+    [(data, remote)] = messaging.notifications()
+    notification = parse_message(data)
+    assert remote == CLIENT
+    assert notification.header_type == CoapType.NON
+    assert notification.header_code == CoapCode.CONTENT
+    assert notification.token == b"1234"
+    assert notification.options[CoapOption.OBSERVE] == b"\x01"
+    assert notification.payload == b"40"
+
+
+def test_batched_notifications(routes):
+    handler = RequestHandler(routes)
+    messaging = MessageLayer(handler)
+    renders = []
+    get = routes["sensors"].get
+    routes["sensors"].get = lambda request: renders.append(1) or get(request)
+
+    for port in range(50):
+        messaging.receive(
+            make_request(CoapCode.GET, b"/sensors/1/temperature", observe=0),
+            ("127.0.0.1", port),
+        )
+    renders.clear()
+
+    # several changes before the notifications are sent are coalesced
+    for temperature in (b"30", b"31", b"32"):
+        handler.handle_request(
+            make_request(
+                CoapCode.PUT, b"/sensors/1/temperature", payload=temperature
+            )
+        )
+
+    notifications = messaging.notifications()
+
+    assert len(renders) == 1
+    assert len(notifications) == 50
+    assert {remote for _, remote in notifications} == {
+        ("127.0.0.1", port) for port in range(50)
+    }
+    for data, _ in notifications:
+        assert parse_message(data).payload == b"32"
+
+
+def test_notifications_per_format(routes):
+    handler = RequestHandler(routes)
+    messaging = MessageLayer(handler)
+    cbor_client = ("127.0.0.1", 40001)
+
+    messaging.receive(
+        make_request(CoapCode.GET, b"/sensors/1", observe=0), CLIENT
+    )
+    messaging.receive(
+        make_request(
+            CoapCode.GET, b"/sensors/1", observe=0, accept=ContentFormat.CBOR
+        ),
+        cbor_client,
+    )
+    handler.handle_request(
+        make_request(CoapCode.PUT, b"/sensors/1/temperature", payload=b"40")
+    )
+
+    notifications = {
+        remote: parse_message(data)
+        for data, remote in messaging.notifications()
+    }
+
+    assert json.loads(notifications[CLIENT].payload)["temperature"] == 40
+    assert notifications[CLIENT].options[CoapOption.CONTENT_FORMAT] == (
+        encode_uint(ContentFormat.JSON)
+    )
+    assert cbor.loads(notifications[cbor_client].payload)["temperature"] == 40
+    assert notifications[cbor_client].options[CoapOption.CONTENT_FORMAT] == (
+        encode_uint(ContentFormat.CBOR)
+    )
+
+
+def test_deregister(routes):
+    handler = RequestHandler(routes)
+    messaging = MessageLayer(handler)
+    messaging.receive(
+        make_request(CoapCode.GET, b"/sensors/1", observe=0), CLIENT
+    )
+    assert len(handler.observers) == 1
+
+    messaging.receive(
+        make_request(CoapCode.GET, b"/sensors/1", observe=1, mid=2), CLIENT
+    )
+
+    assert len(handler.observers) == 0
+
+
+def test_deleted_resource(routes):
+    handler = RequestHandler(routes)
+    messaging = MessageLayer(handler)
+    messaging.receive(
+        make_request(CoapCode.GET, b"/sensors/1", observe=0), CLIENT
+    )
+
+    handler.handle_request(make_request(CoapCode.DELETE, b"/sensors/1"))
+    [(data, _)] = messaging.notifications()
+
+    # error notification ends the observation
+    assert parse_message(data).header_code == CoapCode.NOT_FOUND
+    assert CoapOption.OBSERVE not in parse_message(data).options
+    assert len(handler.observers) == 0
+
+
+def test_reset_removes_observer(routes):
+    handler = RequestHandler(routes)
+    messaging = MessageLayer(handler)
+    messaging.receive(
+        make_request(CoapCode.GET, b"/sensors/1", observe=0), CLIENT
+    )
+    handler.handle_request(
+        make_request(CoapCode.PUT, b"/sensors/1/temperature", payload=b"1")
+    )
+    [(data, _)] = messaging.notifications()
+
+    messaging.receive(b"\x70\x00" + data[2:4], CLIENT)
+
+    assert len(handler.observers) == 0
+
+
+def test_unacknowledged_observer_reaped(routes):
+    handler = RequestHandler(routes)
+    messaging = MessageLayer(handler)
+    messaging.receive(
+        make_request(CoapCode.GET, b"/sensors/1", observe=0), CLIENT
+    )
+
+    for temperature in range(CON_EVERY):
+        handler.handle_request(
+            make_request(
+                CoapCode.PUT,
+                b"/sensors/1/temperature",
+                payload=str(temperature).encode(),
+            )
+        )
+        [(data, _)] = messaging.notifications()
+
+    assert parse_message(data).header_type == CoapType.CON
+
+    for _ in range(MAX_RETRANSMIT + 1):
+        messaging.due(messaging.schedule[0].next_at)
+
+    assert len(handler.observers) == 0
+
+
+@pytest.mark.parametrize("mode", list(ServerMode))
+def test_server_sends_notifications(routes, mode):
+    server = CoAPServer(routes, mode=mode)
+    server_thread = Thread(target=server.start, daemon=True)
+    server_thread.start()
+
+    try:
+        with (
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as observer,
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as writer,
+        ):
+            observer.settimeout(5)
+            writer.settimeout(5)
+            address = ("127.0.0.1", 5683)
+
+            observer.sendto(
+                make_request(CoapCode.GET, b"/sensors/2", observe=0), address
+            )
+            assert (
+                CoapOption.OBSERVE
+                in parse_message(observer.recv(1024)).options
+            )
+
+            writer.sendto(
+                make_request(
+                    CoapCode.PUT, b"/sensors/2/temperature", payload=b"30"
+                ),
+                address,
+            )
+            assert writer.recv(1024)
+
+            notification = parse_message(observer.recv(1024))
+            assert notification.token == b"1234"
+            assert notification.options[CoapOption.OBSERVE] == b"\x01"
+            assert b'"temperature": 30' in notification.payload
+    finally:
+        server.shutdown()
+        server_thread.join()
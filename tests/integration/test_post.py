@@ -1,6 +1,8 @@
 import json
 
 from coap_server.request_handler import RequestHandler
+from coap_server.resources.sensors import SensorsResource
+from coap_server.storage import SensorStore
 from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
 from coap_server.utils.parser import encode_message, parse_message
 
@@ -35,7 +37,8 @@ def test_success(routes):
     assert response.header_code == CoapCode.CREATED
     assert response.header_mid == 1337
     assert response.token == b"1234"
-    assert response.options == {}
+    assert response.options[CoapOption.CONTENT_FORMAT] == b"\x32"
+    assert response.options.all(CoapOption.LOCATION_PATH)[-1] == b"3"
     assert response.payload == obj_encoded
 
     # Assert it was actually added
@@ -62,7 +65,10 @@ def test_success(routes):
     assert response.header_code == CoapCode.CONTENT
     assert response.header_mid == 1337
     assert response.token == b"1234"
-    assert response.options == {}
+    assert response.options.keys() == {
+        CoapOption.ETAG,
+        CoapOption.CONTENT_FORMAT,
+    }
     assert response.payload == obj_encoded
 
 
@@ -222,3 +228,38 @@ def test_invalid_path(routes):
     assert (
         response.payload == b'{"error": "Not found: /sensors/1/temperature/1"}'
     )
+
+
+def test_ids_not_reused(sensors):
+    objects = SensorStore(sensors)
+    handler = RequestHandler({"sensors": SensorsResource(objects)})
+
+    def request(code, uri, payload=b""):
+        return parse_message(
+            handler.handle_request(
+                encode_message(
+                    CoapMessage(
+                        header_version=1,
+                        header_type=0,
+                        header_token_length=4,
+                        header_code=code,
+                        header_mid=1337,
+                        token=b"1234",
+                        options={CoapOption.URI_PATH: uri},
+                        payload=payload,
+                    )
+                )
+            )
+        )
+
+    response = request(CoapCode.POST, b"/sensors", obj_encoded)
+    assert response.header_code == CoapCode.CREATED
+    assert objects[3] == json.loads(obj_encoded)
+
+    response = request(CoapCode.DELETE, b"/sensors/3")
+    assert response.header_code == CoapCode.DELETED
+
+    response = request(CoapCode.POST, b"/sensors", obj_encoded)
+    assert response.header_code == CoapCode.CREATED
+    assert 3 not in objects
+    assert objects[4] == json.loads(obj_encoded)
@@ -1,5 +1,7 @@
 import json
 
+import pytest
+
 from coap_server.request_handler import RequestHandler
 from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
 from coap_server.utils.parser import encode_message, parse_message
@@ -35,7 +37,7 @@ def test_success(routes):
     assert response.header_code == CoapCode.CHANGED
     assert response.header_mid == 1337
     assert response.token == b"1234"
-    assert response.options == {}
+    assert response.options == {CoapOption.CONTENT_FORMAT: b"\x32"}
     assert response.payload == obj_encoded
 
     # Check it was actually modified
@@ -62,7 +64,10 @@ def test_success(routes):
     assert response.header_code == CoapCode.CONTENT
     assert response.header_mid == 1337
     assert response.token == b"1234"
-    assert response.options == {}
+    assert response.options.keys() == {
+        CoapOption.ETAG,
+        CoapOption.CONTENT_FORMAT,
+    }
     assert response.payload == obj_encoded
 
 
@@ -212,7 +217,7 @@ def test_update_temperature(routes):
     assert response.header_code == CoapCode.CHANGED
     assert response.header_mid == 1337
     assert response.token == b"1234"
-    assert response.options == {}
+    assert response.options == {CoapOption.CONTENT_FORMAT: b"\x32"}
     assert response.payload == b'{"name": "sensor 1", "temperature": 40}'
 
     # Check it was actually modified
@@ -239,5 +244,63 @@ def test_update_temperature(routes):
     assert response.header_code == CoapCode.CONTENT
     assert response.header_mid == 1337
     assert response.token == b"1234"
-    assert response.options == {}
+    assert response.options.keys() == {
+        CoapOption.ETAG,
+        CoapOption.CONTENT_FORMAT,
+    }
     assert response.payload == b"40"
+
+
+def send(handler, code, uri, payload=b""):
+    request = CoapMessage(
+        header_version=1,
+        header_type=0,
+        header_token_length=4,
+        header_code=code,
+        header_mid=1337,
+        token=b"1234",
+        options={CoapOption.URI_PATH: uri},
+        payload=payload,
+    )
+    return parse_message(handler.handle_request(encode_message(request)))
+
+
+@pytest.mark.parametrize(
+    "code, uri, payload",
+    [
+        (CoapCode.PUT, b"/sensors/1", b'{"name": "x", "temperature": %d}'),
+        (CoapCode.PUT, b"/sensors/1/temperature", b"%d"),
+        (CoapCode.POST, b"/sensors", b'{"name": "x", "temperature": %d}'),
+    ],
+)
+@pytest.mark.parametrize("temperature", [1 << 31, -(1 << 31) - 1, 1 << 40])
+def test_temperature_out_of_range(
+    sensors, routes, code, uri, payload, temperature
+):
+    handler = RequestHandler(routes)
+    before = send(handler, CoapCode.GET, b"/sensors")
+
+    response = send(handler, code, uri, payload % temperature)
+
+    assert response.header_code == CoapCode.BAD_REQUEST
+    assert sensors == {
+        1: {"name": "sensor 1", "temperature": 21},
+        2: {"name": "sensor 2", "temperature": 25},
+    }
+    assert send(handler, CoapCode.GET, b"/sensors").payload == before.payload
+
+
+def test_changed_after_failed_history(sensors, routes, monkeypatch):
+    handler = RequestHandler(routes)
+    send(handler, CoapCode.GET, b"/sensors/1")
+
+    def record(temperatures):
+        raise OverflowError
+
+    monkeypatch.setattr(routes["sensors"].history, "record", record)
+    response = send(handler, CoapCode.PUT, b"/sensors/1/temperature", b"40")
+
+    # the sensor was changed, so cached representations are dropped anyway
+    assert response.header_code == CoapCode.BAD_REQUEST
+    response = send(handler, CoapCode.GET, b"/sensors/1")
+    assert json.loads(response.payload)["temperature"] == 40
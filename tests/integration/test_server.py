@@ -1,27 +1,66 @@
+import asyncio
+import math
 import socket
+import time
 from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
 import pytest
 
-from coap_server.server import CoAPServer
-from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
-from coap_server.utils.parser import encode_message, parse_message
+from coap_server.executor import BoundedExecutor
+from coap_server.multicast import ALL_COAP_NODES_IPV4, address_family
+from coap_server.resources.base_resource import BaseResource
+from coap_server.server import CoAPServer, ServerMode
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    CoapType,
+)
+from coap_server.utils.construct_response import construct_response
+from coap_server.utils.parser import (
+    decode_uint,
+    encode_message,
+    parse_message,
+)
 
 
-def client():
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        server_address = ("127.0.0.1", 5683)
+class SlowResource(BaseResource):
+    objects = {}
+
+    async def get(self, request: CoapMessage) -> CoapMessage:
+        await asyncio.sleep(0.5)
+        return construct_response(request, CoapCode.CONTENT, b"slow")
+
+
+class BlockingResource(BaseResource):
+    objects = {}
+
+    def get(self, request: CoapMessage) -> CoapMessage:
+        time.sleep(0.5)
+        return construct_response(request, CoapCode.CONTENT, b"blocking")
+
+
+def client(
+    uri=b"/sensors/1/temperature",
+    server_address=("127.0.0.1", 5683),
+    header_type=CoapType.CON,
+    timeout=3.0,
+):
+    with socket.socket(
+        address_family(server_address[0]), socket.SOCK_DGRAM
+    ) as sock:
+        sock.settimeout(timeout)
 
         request = CoapMessage(
             header_version=1,
-            header_type=0,
+            header_type=header_type,
             header_token_length=4,
             header_code=CoapCode.GET,
             header_mid=1337,
             token=b"1234",
             options={
-                CoapOption.URI_PATH: b"/sensors/1/temperature",
+                CoapOption.URI_PATH: uri,
             },
             payload=b"",
         )
@@ -33,8 +72,9 @@ def client():
         return response
 
 
-def test_get(routes):
-    server = CoAPServer(routes)
+@pytest.mark.parametrize("mode", list(ServerMode))
+def test_get(routes, mode):
+    server = CoAPServer(routes, mode=mode)
     server_thread = Thread(target=server.start, daemon=True)
     server_thread.start()
 
@@ -42,21 +82,25 @@ def test_get(routes):
         response = client()
 
         assert response.header_version == 1
-        assert response.header_type == 0
+        assert response.header_type == CoapType.ACK
         assert response.header_token_length == 4
         assert response.header_code == CoapCode.CONTENT
         assert response.header_mid == 1337
         assert response.token == b"1234"
-        assert response.options == {}
+        assert response.options.keys() == {
+            CoapOption.ETAG,
+            CoapOption.CONTENT_FORMAT,
+        }
         assert response.payload == b"21"
     finally:
         server.shutdown()
         server_thread.join()
 
 
+@pytest.mark.parametrize("mode", list(ServerMode))
 @pytest.mark.parametrize("num_clients", [3, 5, 10, 15])
-def test_multiple_requests(routes, num_clients):
-    server = CoAPServer(routes)
+def test_multiple_requests(routes, num_clients, mode):
+    server = CoAPServer(routes, mode=mode)
     server_thread = Thread(target=server.start, daemon=True)
     server_thread.start()
 
@@ -71,3 +115,178 @@ def test_multiple_requests(routes, num_clients):
     finally:
         server.shutdown()
         server_thread.join()
+
+
+def test_async_resource_does_not_block(routes):
+    routes["slow"] = SlowResource()
+    server = CoAPServer(routes, mode=ServerMode.ASYNCIO)
+    server_thread = Thread(target=server.start, daemon=True)
+    server_thread.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            slow = executor.submit(client, b"/slow")
+            fast = executor.submit(client)
+
+            # the fast request is answered while the slow one is pending
+            assert fast.result(timeout=0.4).payload == b"21"
+            assert not slow.done()
+            assert slow.result().payload == b"slow"
+    finally:
+        server.shutdown()
+        server_thread.join()
+
+
+@pytest.mark.parametrize(
+    "uri", [b"/sensorsX", b"/sensors/abc", b"/sensors/1/x"]
+)
+def test_not_found(routes, uri):
+    server = CoAPServer(routes)
+    server_thread = Thread(target=server.start, daemon=True)
+    server_thread.start()
+
+    try:
+        assert client(uri).header_code == CoapCode.NOT_FOUND
+    finally:
+        server.shutdown()
+        server_thread.join()
+
+
+def test_executor(routes):
+    routes["blocking"] = BlockingResource()
+    executor = BoundedExecutor(threads=2, queue_size=0, deadline=2)
+    server = CoAPServer(routes, mode=ServerMode.ASYNCIO, executor=executor)
+    server_thread = Thread(target=server.start, daemon=True)
+    server_thread.start()
+
+    try:
+        assert client().payload == b"21"
+        assert client(b"/blocking").payload == b"blocking"
+    finally:
+        server.shutdown()
+        server_thread.join()
+
+
+@pytest.mark.parametrize("mode", [ServerMode.SYNC, ServerMode.BATCH])
+def test_executor_requires_asyncio(routes, mode):
+    # requests are handled one at a time, they would wait for the threads
+    with pytest.raises(ValueError):
+        CoAPServer(routes, mode=mode, executor=BoundedExecutor())
+
+
+def test_blocking_resource_does_not_block(routes):
+    routes["blocking"] = BlockingResource()
+    server = CoAPServer(
+        routes, mode=ServerMode.ASYNCIO, executor=BoundedExecutor(threads=2)
+    )
+    server_thread = Thread(target=server.start, daemon=True)
+    server_thread.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            blocking = executor.submit(client, b"/blocking")
+            time.sleep(0.1)
+            fast = executor.submit(client)
+
+            assert fast.result(timeout=0.3).payload == b"21"
+            assert not blocking.done()
+            assert blocking.result().payload == b"blocking"
+    finally:
+        server.shutdown()
+        server_thread.join()
+
+
+@pytest.mark.parametrize(
+    "executor",
+    [
+        # no free thread nor place in the queue
+        BoundedExecutor(threads=1, queue_size=0),
+        # not handled in time
+        BoundedExecutor(threads=2, queue_size=0, deadline=0.2),
+    ],
+)
+def test_service_unavailable(routes, executor):
+    routes["blocking"] = BlockingResource()
+    server = CoAPServer(routes, mode=ServerMode.ASYNCIO, executor=executor)
+    server_thread = Thread(target=server.start, daemon=True)
+    server_thread.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            # different URIs, identical requests would share the response
+            first = pool.submit(client, b"/blocking?n=1")
+            time.sleep(0.1)
+            second = client(b"/blocking?n=2")
+
+            assert second.header_code == CoapCode.SERVICE_UNAVAILABLE
+            assert decode_uint(second.options[CoapOption.MAX_AGE]) == (
+                math.ceil(executor.deadline)
+            )
+            first.result()
+    finally:
+        server.shutdown()
+        server_thread.join()
+
+
+@pytest.mark.parametrize("mode", list(ServerMode))
+@pytest.mark.parametrize(
+    "host, address",
+    [
+        ("::1", "::1"),
+        # dual-stack socket accepting IPv4 clients as well
+        ("::", "::1"),
+        ("::", "127.0.0.1"),
+    ],
+)
+def test_ipv6(routes, mode, host, address):
+    server = CoAPServer(routes, host, mode=mode)
+    server_thread = Thread(target=server.start, daemon=True)
+    server_thread.start()
+
+    try:
+        response = client(server_address=(address, 5683))
+
+        assert response.header_code == CoapCode.CONTENT
+        assert response.payload == b"21"
+    finally:
+        server.shutdown()
+        server_thread.join()
+
+
+@pytest.mark.parametrize("mode", list(ServerMode))
+def test_group_request(routes, mode):
+    try:
+        server = CoAPServer(
+            routes,
+            "0.0.0.0",
+            mode=mode,
+            groups=[ALL_COAP_NODES_IPV4],
+            leisure=0.2,
+        )
+    except OSError as e:
+        pytest.skip(f"Multicast not available: {e}")
+    server_thread = Thread(target=server.start, daemon=True)
+    server_thread.start()
+    group = (ALL_COAP_NODES_IPV4, 5683)
+
+    try:
+        response = client(server_address=group, header_type=CoapType.NON)
+
+        assert response.header_type == CoapType.NON
+        assert response.header_code == CoapCode.CONTENT
+        assert response.payload == b"21"
+
+        # errors aren't sent back to groups
+        with pytest.raises(socket.timeout):
+            client(b"/missing", group, CoapType.NON, timeout=1.5)
+
+        # every group request is handled once, not by the unicast socket too
+        assert sum(server.handler.metrics.requests.values()) == 2
+
+        # the unicast socket still answers unicast requests right away
+        response = client()
+        assert response.header_type == CoapType.ACK
+        assert response.payload == b"21"
+    finally:
+        server.shutdown()
+        server_thread.join()
@@ -0,0 +1,179 @@
+import itertools
+import json
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from coap_server.resources.sensors import SensorsResource
+from coap_server.storage import LogStore, StorageKind
+from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
+from coap_server.utils.parser import encode_message, parse_message
+from coap_server.workers import SharedObjectsManager, WorkerPool
+
+# unique message IDs, a reused source port must not look like a duplicate
+MESSAGE_IDS = itertools.count(1337)
+
+
+def client(code, uri, payload=b""):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(5)
+        request = CoapMessage(
+            header_version=1,
+            header_type=0,
+            header_token_length=4,
+            header_code=code,
+            header_mid=next(MESSAGE_IDS),
+            token=b"1234",
+            options={
+                CoapOption.URI_PATH: uri,
+            },
+            payload=payload,
+        )
+
+        sock.sendto(encode_message(request), ("127.0.0.1", 5683))
+        return parse_message(sock.recv(1024))
+
+
+@pytest.fixture
+def shared_routes(sensors):
+    manager = SharedObjectsManager()
+    manager.start()
+    yield {"sensors": SensorsResource(manager.SharedObjects(sensors))}
+    manager.shutdown()
+
+
+def test_shared_objects(shared_routes):
+    pool = WorkerPool(shared_routes, workers=4)
+    pool.start()
+
+    try:
+        obj_encoded = json.dumps({"name": "New", "temperature": 30}).encode(
+            "ascii"
+        )
+        response = client(CoapCode.POST, b"/sensors", obj_encoded)
+        assert response.header_code == CoapCode.CREATED
+
+        response = client(CoapCode.PUT, b"/sensors/1/temperature", b"40")
+        assert response.header_code == CoapCode.CHANGED
+
+        # every client uses a new source port, so the requests are spread
+        # between the workers, which all have to see the changes
+        for _ in range(20):
+            response = client(CoapCode.GET, b"/sensors/3")
+            assert response.header_code == CoapCode.CONTENT
+            assert response.payload == obj_encoded
+
+            response = client(CoapCode.GET, b"/sensors/1/temperature")
+            assert response.payload == b"40"
+    finally:
+        pool.shutdown()
+
+
+def test_batch(shared_routes):
+    pool = WorkerPool(shared_routes, workers=4)
+    pool.start()
+    uri = b"/sensors/batch"
+
+    try:
+        response = client(CoapCode.POST, uri, b"[[1, 5], [2, 6]]")
+        assert response.header_code == CoapCode.CHANGED
+
+        response = client(CoapCode.POST, uri, b"[[1, 7], [9, 8]]")
+        assert response.header_code == CoapCode.NOT_FOUND
+
+        for _ in range(10):
+            response = client(CoapCode.GET, b"/sensors")
+            temperatures = {
+                key: obj["temperature"]
+                for key, obj in json.loads(response.payload).items()
+            }
+            assert temperatures == {"1": 5, "2": 6}
+    finally:
+        pool.shutdown()
+
+
+def test_shared_history(sensors):
+    manager = SharedObjectsManager()
+    manager.start()
+    resource = SensorsResource(
+        manager.SharedObjects(sensors), manager.History()
+    )
+    pool = WorkerPool({"sensors": resource}, workers=4)
+    pool.start()
+
+    try:
+        for temperature in range(10):
+            response = client(
+                CoapCode.PUT,
+                b"/sensors/1/temperature",
+                str(temperature).encode(),
+            )
+            assert response.header_code == CoapCode.CHANGED
+
+        response = client(CoapCode.GET, b"/sensors/1/history")
+        temperatures = [value for _, value in json.loads(response.payload)]
+        assert temperatures == list(range(10))
+    finally:
+        pool.shutdown()
+        manager.shutdown()
+
+
+def test_cached_representations(shared_routes):
+    pool = WorkerPool(shared_routes, workers=4)
+    pool.start()
+
+    try:
+        # let every worker cache the representation
+        for _ in range(20):
+            response = client(CoapCode.GET, b"/sensors/2/temperature")
+            assert response.payload == b"25"
+
+        response = client(CoapCode.PUT, b"/sensors/2/temperature", b"26")
+        assert response.header_code == CoapCode.CHANGED
+
+        # workers which didn't handle the PUT mustn't serve stale data
+        for _ in range(20):
+            response = client(CoapCode.GET, b"/sensors/2/temperature")
+            assert response.payload == b"26"
+    finally:
+        pool.shutdown()
+
+
+def test_create_concurrently(sensors):
+    manager = SharedObjectsManager()
+    manager.start()
+    try:
+        objects = manager.SharedObjects(sensors)
+        obj = {"name": "new", "temperature": 0}
+        # each thread is served by its own thread of the manager
+        with ThreadPoolExecutor(8) as executor:
+            ids = list(executor.map(lambda _: objects.create(obj), range(80)))
+        assert len(set(ids)) == 80
+        assert len(objects) == len(sensors) + 80
+    finally:
+        manager.shutdown()
+
+
+def test_persistent_store(sensors, tmp_path):
+    manager = SharedObjectsManager()
+    manager.start()
+    store = manager.Store(StorageKind.WAL, tmp_path)
+    store.update(sensors)
+    pool = WorkerPool({"sensors": SensorsResource(store)}, workers=4)
+    pool.start()
+
+    try:
+        response = client(CoapCode.PUT, b"/sensors/1/temperature", b"40")
+        assert response.header_code == CoapCode.CHANGED
+
+        response = client(CoapCode.GET, b"/sensors")
+        assert json.loads(response.payload)["1"]["temperature"] == 40
+    finally:
+        pool.shutdown()
+        store.close()
+        manager.shutdown()
+
+    store = LogStore(tmp_path)
+    assert store[1]["temperature"] == 40
+    store.close()
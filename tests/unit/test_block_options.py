@@ -0,0 +1,44 @@
+import pytest
+
+from coap_server.blockwise import (
+    Stream,
+    block_size,
+    decode_block,
+    encode_block,
+)
+
+
+@pytest.mark.parametrize(
+    "num, more, szx, encoded",
+    [
+        (0, False, 0, b""),
+        (0, True, 6, b"\x0e"),
+        (1, False, 2, b"\x12"),
+        (20, True, 6, b"\x01\x4e"),
+    ],
+)
+def test_block_option(num, more, szx, encoded):
+    assert encode_block(num, more, szx) == encoded
+    assert decode_block(memoryview(encoded)) == (num, more, szx)
+
+
+def test_block_size():
+    assert block_size(0) == 16
+    assert block_size(6) == 1024
+
+
+def test_stream_read():
+    payload = bytes(range(100)) * 10
+    chunks = [payload[i : i + 7] for i in range(0, len(payload), 7)]
+    stream = Stream(0.0, iter(chunks))
+
+    assert stream.read(0, 64) == (payload[:64], True)
+    # the same block again, e.g. after a lost response
+    assert stream.read(0, 64) == (payload[:64], True)
+    assert stream.read(64, 64) == (payload[64:128], True)
+    # blocks may be skipped
+    assert stream.read(960, 32) == (payload[960:992], True)
+    assert stream.read(992, 32) == (payload[992:], False)
+    assert stream.read(1024, 32) == (b"", False)
+    # only the current block is buffered
+    assert len(stream.buffer) <= 32 + 7
@@ -0,0 +1,194 @@
+import pytest
+
+from coap_server.cache import ResponseCache, cache_key, patch
+from coap_server.resources.base_resource import BaseResource
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    Options,
+)
+from coap_server.utils.construct_response import construct_response
+from coap_server.utils.parser import encode_message, parse_message, uri_options
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Objects(dict):
+    changes = 0
+
+    def version(self) -> int:
+        return self.changes
+
+
+class Items(BaseResource):
+    def __init__(self):
+        super().__init__()
+        self.objects = Objects()
+
+
+def make_request(uri="/items/1", *options, code=CoapCode.GET, token=b"1234"):
+    return CoapMessage(
+        header_version=1,
+        header_type=0,
+        header_token_length=len(token),
+        header_code=code,
+        header_mid=1337,
+        token=token,
+        options=Options([*uri_options(uri), *options]),
+        payload=b"",
+    )
+
+
+def make_response(request, code=CoapCode.CONTENT, options=None):
+    response = construct_response(
+        request,
+        code,
+        b"payload",
+        options={CoapOption.ETAG: b"1234", **(options or {})},
+    )
+    return response, encode_message(response)
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def cache(clock):
+    return ResponseCache(max_size=200, clock=clock)
+
+
+def put(cache, request, code=CoapCode.CONTENT, options=None):
+    key = cache_key(request)
+    miss = cache.miss(key, "/items/{id:int}", Items())
+    cache.put(miss, *make_response(request, code, options))
+    return key
+
+
+def test_cache_key():
+    assert cache_key(make_request("/items/1?a=1")) == ("/items/1?a=1", None)
+    assert cache_key(make_request("/items", (CoapOption.ACCEPT, b"<"))) == (
+        "/items",
+        b"<",
+    )
+
+    assert cache_key(make_request(code=CoapCode.PUT)) is None
+    assert cache_key(make_request("/", (CoapOption.ETAG, b"1"))) is None
+    assert cache_key(make_request("/", (CoapOption.OBSERVE, b""))) is None
+    assert cache_key(make_request("/", (CoapOption.BLOCK2, b"\x06"))) is None
+    # Uri-Path which isn't valid UTF-8
+    assert cache_key(parse_message(b"\x50\x01\x00\x01\xb1\xff")) is None
+
+
+def test_hit(cache):
+    key = put(cache, make_request())
+    entry = cache.get(key)
+
+    # NON request with another token and message ID
+    data = b"R\x01\x00\x07ab"
+    response = parse_message(patch(data, entry.code, entry.tail))
+
+    assert response.header_type == 1
+    assert response.header_code == CoapCode.CONTENT
+    assert response.header_mid == 7
+    assert response.token == b"ab"
+    assert response.options == {CoapOption.ETAG: b"1234"}
+    assert response.payload == b"payload"
+    assert entry.pattern == "/items/{id:int}"
+
+
+@pytest.mark.parametrize(
+    "code, options",
+    [
+        (CoapCode.NOT_FOUND, {}),
+        (CoapCode.CONTENT, {CoapOption.MAX_AGE: b""}),
+        (CoapCode.CONTENT, {CoapOption.OBSERVE: b"\x01"}),
+        (CoapCode.CONTENT, {CoapOption.BLOCK2: b"\x0e"}),
+    ],
+)
+def test_not_cacheable(cache, code, options):
+    key = put(cache, make_request(), code, options)
+
+    assert cache.get(key) is None
+
+
+def test_not_cacheable_without_etag(cache):
+    request = make_request()
+    key = cache_key(request)
+    response = construct_response(request, CoapCode.CONTENT, b"metrics")
+    cache.put(
+        cache.miss(key, "/", Items()), response, encode_message(response)
+    )
+
+    assert cache.get(key) is None
+
+
+def test_max_age(cache, clock):
+    default = put(cache, make_request("/items/1"))
+    short = put(
+        cache,
+        make_request("/items/2"),
+        options={CoapOption.MAX_AGE: b"\x05"},
+    )
+
+    clock.now += 5
+    assert cache.get(default) is not None
+    assert cache.get(short) is None
+
+    clock.now += 55
+    assert cache.get(default) is None
+    assert len(cache) == 0
+
+
+def test_changed(cache):
+    item = put(cache, make_request("/items/1"))
+    query = put(cache, make_request("/items/1?a=1"))
+    other = put(cache, make_request("/items/2"))
+
+    cache.changed("/items/1")
+
+    assert cache.get(item) is None
+    assert cache.get(query) is None
+    assert cache.get(other) is not None
+    assert list(cache.keys_by_path) == ["/items/2"]
+
+
+def test_changed_while_rendering(cache):
+    request = make_request()
+    key = cache_key(request)
+    miss = cache.miss(key, "/items/{id:int}", Items())
+
+    cache.changed("/items/2")
+    cache.put(miss, *make_response(request))
+
+    assert cache.get(key) is None
+
+
+def test_version_changed(cache):
+    request = make_request()
+    key = cache_key(request)
+    resource = Items()
+    cache.put(cache.miss(key, "/", resource), *make_response(request))
+
+    resource.objects.changes += 1
+
+    assert cache.get(key) is None
+    assert len(cache) == 0
+
+
+def test_size_bounded(cache):
+    keys = [put(cache, make_request(f"/items/{i}")) for i in range(20)]
+
+    assert cache.size <= cache.max_size
+    # the least recently used responses are evicted
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[-1]) is not None
+    assert len(cache) == cache.size // len(cache.entries[keys[-1]].tail)
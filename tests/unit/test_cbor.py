@@ -0,0 +1,92 @@
+import pytest
+
+from coap_server.utils import cbor
+
+OBJECTS = {
+    i: {"name": f"sensor é {i}", "temperature": -i} for i in range(1, 200)
+}
+
+
+@pytest.mark.parametrize(
+    "obj, encoded",
+    [
+        # examples from RFC 8949, appendix A
+        (0, "00"),
+        (23, "17"),
+        (24, "1818"),
+        (1000, "1903e8"),
+        (1000000, "1a000f4240"),
+        (18446744073709551615, "1bffffffffffffffff"),
+        (-1, "20"),
+        (-1000, "3903e7"),
+        (1.5, "fa3fc00000"),
+        (1.1, "fb3ff199999999999a"),
+        (False, "f4"),
+        (True, "f5"),
+        (None, "f6"),
+        ("", "60"),
+        ("ü", "62c3bc"),
+        (b"\x01\x02\x03\x04", "4401020304"),
+        ([1, [2, 3], [4, 5]], "8301820203820405"),
+        ({"a": 1, "b": [2, 3]}, "a26161016162820203"),
+    ],
+)
+def test_dumps(obj, encoded):
+    assert cbor.dumps(obj).hex() == encoded
+    assert cbor.loads(bytes.fromhex(encoded)) == obj
+
+
+@pytest.mark.parametrize(
+    "encoded, obj",
+    [
+        ("f93c00", 1.0),
+        ("5f42010243030405ff", b"\x01\x02\x03\x04\x05"),
+        ("7f657374726561646d696e67ff", "streaming"),
+        ("9f018202039f0405ffff", [1, [2, 3], [4, 5]]),
+        ("bf61610161629f0203ffff", {"a": 1, "b": [2, 3]}),
+        # tags are ignored
+        ("c11a514b67b0", 1363896240),
+    ],
+)
+def test_loads_only(encoded, obj):
+    assert cbor.loads(bytes.fromhex(encoded)) == obj
+
+
+@pytest.mark.parametrize(
+    "encoded",
+    [
+        "",
+        "19",
+        "1903",
+        "62c3",
+        "8201",
+        "bf6161",
+        "9f01",
+        "ff",
+        "1c",
+        "0001",
+        "a1800f",
+        "f0",
+        "81" * 100 + "00",
+    ],
+)
+def test_loads_invalid(encoded):
+    with pytest.raises(cbor.CBORDecodeError):
+        cbor.loads(bytes.fromhex(encoded))
+
+
+def test_dumps_unsupported():
+    with pytest.raises(TypeError):
+        cbor.dumps({1, 2})
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64, 1024, 1 << 20])
+def test_encode_items(chunk_size):
+    chunks = list(cbor.encode_items(OBJECTS.items(), chunk_size))
+
+    assert cbor.loads(b"".join(chunks)) == OBJECTS
+    assert len(chunks) > 1 or chunk_size > 1024
+
+
+def test_encode_items_empty():
+    assert b"".join(cbor.encode_items([])) == b"\xbf\xff"
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from coap_server.executor import BoundedExecutor
+from coap_server.utils.exceptions import ServiceUnavailableError
+
+
+@pytest.fixture
+def executor():
+    executor = BoundedExecutor(threads=1, queue_size=1, deadline=0.2)
+    yield executor
+    executor.shutdown()
+
+
+def test_call(executor):
+    assert executor.call(lambda x: x * 2, 21, time.perf_counter()) == 42
+    assert executor.threads[0].name == "resource-0"
+
+    with pytest.raises(ZeroDivisionError):
+        executor.call(lambda x: 1 / x, 0, None)
+
+
+def test_queue_full(executor):
+    release = threading.Event()
+    running = executor.submit(release.wait)
+    queued = executor.submit(lambda: None)
+
+    try:
+        with pytest.raises(ServiceUnavailableError) as e:
+            executor.submit(lambda: None)
+
+        assert e.value.max_age == 1
+    finally:
+        release.set()
+
+    assert running.result(1) is True
+    assert queued.result(1) is None
+
+
+def test_deadline(executor):
+    release = threading.Event()
+    executor.submit(release.wait)
+    calls = []
+
+    try:
+        with pytest.raises(ServiceUnavailableError):
+            executor.call(calls.append, 1, time.perf_counter())
+    finally:
+        release.set()
+
+    # the expired call is dropped instead of being run later
+    executor.call(calls.append, 2, None)
+    assert calls == [2]
+
+
+def test_deadline_passed_on_arrival(executor):
+    with pytest.raises(ServiceUnavailableError):
+        executor.call(lambda x: x, 1, time.perf_counter() - 1)
+
+
+def test_call_async(executor):
+    async def main():
+        first = executor.call_async(time.sleep, 0.1, time.perf_counter())
+        # the event loop isn't blocked while the first call runs
+        second = asyncio.sleep(0.05, "done")
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(main()) == [None, "done"]
+
+
+def test_call_async_deadline(executor):
+    async def main():
+        return await executor.call_async(time.sleep, 0.5, time.perf_counter())
+
+    with pytest.raises(ServiceUnavailableError):
+        asyncio.run(main())
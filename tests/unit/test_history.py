@@ -0,0 +1,120 @@
+import pytest
+
+from coap_server.history import Aggregate, History, Ring
+
+
+class Clock:
+    def __init__(self, now: float = 6000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ring():
+    ring = Ring(3, "i")
+    for value in range(5):
+        ring.append(value)
+
+    assert len(ring) == 3
+    assert [ring.columns[0][ring.index(i)] for i in range(3)] == [2, 3, 4]
+    assert ring.columns[0][ring.last()] == 4
+    assert ring.bisect(0, 3) == 1
+    assert ring.bisect(0, 5) == 3
+
+
+def test_ring_grows():
+    ring = Ring(1000, "d", "i")
+    ring.append(1.5, 2)
+
+    assert len(ring.columns[0]) == 1
+    assert ring.columns[1][ring.last()] == 2
+
+
+def test_since():
+    clock = Clock()
+    history = History(size=4, clock=clock)
+    for temperature in range(6):
+        history.record({1: temperature, 2: -temperature})
+        clock.now += 10
+
+    assert history.since(1, 0) == [
+        (6020.0, 2),
+        (6030.0, 3),
+        (6040.0, 4),
+        (6050.0, 5),
+    ]
+    assert history.since(2, 6045) == [(6050.0, -5)]
+    assert history.since(3, 0) == []
+
+
+def test_clock_backwards():
+    clock = Clock()
+    history = History(clock=clock)
+    history.record({1: 20})
+    clock.now -= 100
+    history.record({1: 21})
+
+    assert history.since(1, 0) == [(6000.0, 20), (6000.0, 21)]
+
+
+@pytest.mark.parametrize(
+    "function, window, expected",
+    [
+        (Aggregate.MIN, 60, [(6000, 0), (6060, 6), (6120, 12)]),
+        (Aggregate.MAX, 60, [(6000, 5), (6060, 11), (6120, 13)]),
+        (Aggregate.AVG, 60, [(6000, 2.5), (6060, 8.5), (6120, 12.5)]),
+        (Aggregate.AVG, 120, [(6000, 5.5), (6120, 12.5)]),
+        (Aggregate.MAX, 3600, [(3600, 13)]),
+    ],
+)
+def test_aggregate(function, window, expected):
+    clock = Clock()
+    history = History(size=2, clock=clock)
+    for temperature in range(14):
+        history.record({1: temperature})
+        clock.now += 10
+
+    assert history.aggregate(1, 0, window, function) == expected
+
+
+def test_aggregate_since():
+    clock = Clock()
+    history = History(clock=clock)
+    for temperature in range(14):
+        history.record({1: temperature})
+        clock.now += 10
+
+    # rounded down to the start of the bucket
+    assert history.aggregate(1, 6070, 60, Aggregate.MIN) == [
+        (6060, 6),
+        (6120, 12),
+    ]
+
+
+def test_aggregate_buckets_bounded():
+    clock = Clock()
+    history = History(buckets=2, clock=clock)
+    for temperature in range(3):
+        history.record({1: temperature})
+        clock.now += 60
+
+    assert history.aggregate(1, 0, 60, Aggregate.MAX) == [
+        (6060, 1),
+        (6120, 2),
+    ]
+
+
+@pytest.mark.parametrize("window", [0, -60, 90])
+def test_aggregate_invalid_window(window):
+    with pytest.raises(ValueError):
+        History().aggregate(1, 0, window, Aggregate.AVG)
+
+
+def test_forget():
+    history = History()
+    history.record({1: 20})
+    history.forget(1)
+    history.forget(2)
+
+    assert history.since(1, 0) == []
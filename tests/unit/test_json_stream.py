@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from coap_server.utils.json_stream import encode_items
+
+OBJECTS = {
+    i: {"name": f"sensor é {i}", "temperature": -i} for i in range(1, 200)
+}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64, 1024, 1 << 20])
+def test_same_as_dumps(chunk_size):
+    chunks = list(encode_items(OBJECTS.items(), chunk_size))
+
+    assert b"".join(chunks) == json.dumps(OBJECTS).encode("ascii")
+
+
+def test_empty():
+    assert b"".join(encode_items([])) == b"{}"
+
+
+def test_chunk_size():
+    chunks = list(encode_items(OBJECTS.items(), 256))
+
+    assert len(chunks) > 1
+    # a chunk ends with the item which crossed the size
+    assert all(len(chunk) < 256 + 64 for chunk in chunks)
+
+
+def test_lazy():
+    def items():
+        yield 1, {"temperature": 1}
+        raise AssertionError("consumed too early")
+
+    chunks = encode_items(items(), chunk_size=1)
+    assert next(chunks) == b'{"1": {"temperature": 1}'
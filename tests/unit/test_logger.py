@@ -0,0 +1,57 @@
+import io
+import logging
+import subprocess
+import sys
+
+import pytest
+
+from coap_server.logger import configure_logging, logger, shutdown_logging
+
+
+@pytest.fixture
+def reset_logging():
+    yield
+    shutdown_logging()
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.NOTSET)
+    logger.propagate = True
+
+
+def test_import_has_no_side_effects():
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import logging, coap_server.logger; "
+            "print(logging.getLogger().handlers)",
+        ],
+        text=True,
+    )
+
+    assert output.strip() == "[]"
+
+
+@pytest.mark.parametrize("use_queue", [False, True])
+def test_configure_logging(reset_logging, use_queue):
+    stream = io.StringIO()
+    configure_logging(logging.INFO, use_queue=use_queue, stream=stream)
+
+    logger.debug("hidden %s", "debug")
+    logger.info("Request to %s handled", "/sensors")
+    shutdown_logging()
+
+    output = stream.getvalue()
+    assert "[INFO] Request to /sensors handled" in output
+    assert "hidden" not in output
+
+
+def test_disabled_messages_are_not_formatted(reset_logging):
+    class Expensive:
+        def __repr__(self):
+            raise AssertionError("formatted")
+
+    configure_logging(logging.WARNING, stream=io.StringIO())
+
+    logger.debug("Handling request: %r", Expensive())
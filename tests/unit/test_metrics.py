@@ -0,0 +1,63 @@
+from coap_server.metrics import LATENCY_BUCKETS, Metrics, format_labels
+from coap_server.utils.constants import CoapCode
+
+
+def test_record():
+    metrics = Metrics()
+    metrics.record(CoapCode.GET, "/items/{id:int}", CoapCode.CONTENT, 0.0002)
+    metrics.record(CoapCode.GET, "/items/{id:int}", CoapCode.CONTENT, 0.003)
+    metrics.record(CoapCode.GET, "/items/{id:int}", CoapCode.NOT_FOUND, 2.0)
+
+    assert metrics.requests == {
+        (CoapCode.GET, "/items/{id:int}", CoapCode.CONTENT): 2,
+        (CoapCode.GET, "/items/{id:int}", CoapCode.NOT_FOUND): 1,
+    }
+
+    histogram = metrics.latencies[CoapCode.GET, "/items/{id:int}"]
+    assert histogram.count == 3
+    assert histogram.sum == 0.0002 + 0.003 + 2.0
+    buckets = dict(histogram.cumulative())
+    assert buckets["0.0001"] == 0
+    assert buckets["0.00025"] == 1
+    assert buckets["0.0025"] == 1
+    assert buckets["0.005"] == 2
+    assert buckets[str(LATENCY_BUCKETS[-1])] == 2
+    assert buckets["+Inf"] == 3
+
+
+def test_bucket_bounds_inclusive():
+    metrics = Metrics()
+    metrics.record(CoapCode.PUT, "/items", CoapCode.CHANGED, 0.001)
+
+    buckets = dict(metrics.latencies[CoapCode.PUT, "/items"].cumulative())
+    assert buckets["0.0005"] == 0
+    assert buckets["0.001"] == 1
+
+
+def test_prometheus():
+    metrics = Metrics()
+    metrics.record(CoapCode.GET, "/items", CoapCode.CONTENT, 0.0002)
+    metrics.parse_failed()
+    metrics.rejected(CoapCode.TOO_MANY_REQUESTS)
+
+    lines = metrics.to_prometheus().decode().splitlines()
+
+    assert (
+        'coap_requests_total{method="GET",route="/items",code="2.05"} 1'
+        in lines
+    )
+    assert "coap_parse_failures_total 1" in lines
+    assert 'coap_rejected_total{code="4.29"} 1' in lines
+    assert (
+        'coap_request_duration_seconds_bucket{method="GET",route="/items",'
+        'le="+Inf"} 1' in lines
+    )
+    assert (
+        'coap_request_duration_seconds_count{method="GET",route="/items"} 1'
+        in lines
+    )
+    assert "# TYPE coap_request_duration_seconds histogram" in lines
+
+
+def test_format_labels_escaped():
+    assert format_labels(route='/a"b\\c\n') == 'route="/a\\"b\\\\c\\n"'
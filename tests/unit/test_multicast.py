@@ -0,0 +1,101 @@
+import socket
+
+import pytest
+
+from coap_server.multicast import (
+    ALL_COAP_NODES_IPV4,
+    address_family,
+    all_coap_nodes,
+    check_group,
+    needs_interface,
+    reply_address,
+    server_socket,
+)
+
+
+def test_address_family():
+    assert address_family("127.0.0.1") == socket.AF_INET
+    assert address_family("0.0.0.0") == socket.AF_INET
+    assert address_family("::") == socket.AF_INET6
+    assert address_family("fe80::1") == socket.AF_INET6
+
+
+@pytest.mark.parametrize(
+    "group, expected",
+    [("ff01::fd", True), ("ff02::fd", True), ("ff03::fd", False)],
+)
+def test_needs_interface(group, expected):
+    assert needs_interface(group) == expected
+
+
+def test_all_coap_nodes():
+    assert all_coap_nodes("0.0.0.0") == [ALL_COAP_NODES_IPV4]
+    assert all_coap_nodes("::1") == ["ff03::fd", "ff05::fd"]
+    assert all_coap_nodes("::") == [
+        ALL_COAP_NODES_IPV4,
+        "ff03::fd",
+        "ff05::fd",
+    ]
+    assert all_coap_nodes("::", "eth0") == [
+        ALL_COAP_NODES_IPV4,
+        "ff02::fd",
+        "ff03::fd",
+        "ff05::fd",
+    ]
+
+
+def test_check_group():
+    check_group("0.0.0.0", "224.0.1.187")
+    check_group("::", "224.0.1.187")
+    check_group("::", "ff05::fd")
+
+    with pytest.raises(ValueError):
+        check_group("0.0.0.0", "ff05::fd")
+    with pytest.raises(ValueError):
+        check_group("::1", "224.0.1.187")
+
+
+def test_reply_address():
+    assert reply_address(socket.AF_INET, ("10.0.0.1", 5683)) == (
+        "10.0.0.1",
+        5683,
+    )
+    assert reply_address(socket.AF_INET6, ("10.0.0.1", 5683)) == (
+        "::ffff:10.0.0.1",
+        5683,
+        0,
+        0,
+    )
+    assert reply_address(socket.AF_INET6, ("fe80::1", 5683, 0, 2)) == (
+        "fe80::1",
+        5683,
+        0,
+        2,
+    )
+
+
+@pytest.mark.parametrize(
+    "host, client, v6only",
+    [
+        ("::1", ("::1", socket.AF_INET6), 1),
+        ("::", ("127.0.0.1", socket.AF_INET), 0),
+        ("::", ("::1", socket.AF_INET6), 0),
+    ],
+)
+def test_server_socket(host, client, v6only):
+    with server_socket(host, 0) as sock:
+        assert sock.family == socket.AF_INET6
+        assert (
+            sock.getsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY) == v6only
+        )
+
+        address, family = client
+        with socket.socket(family, socket.SOCK_DGRAM) as peer:
+            peer.sendto(b"ping", (address, sock.getsockname()[1]))
+            sock.settimeout(1)
+            data, addr = sock.recvfrom(16)
+
+        assert data == b"ping"
+        if family == socket.AF_INET:
+            # IPv4 clients of a dual-stack socket
+            assert addr[0] == "::ffff:127.0.0.1"
@@ -1,5 +1,20 @@
-from coap_server.utils.constants import CoapCode, CoapMessage, CoapOption
-from coap_server.utils.parser import encode_message, parse_message
+import pytest
+
+from coap_server.utils.constants import (
+    CoapCode,
+    CoapMessage,
+    CoapOption,
+    Options,
+)
+from coap_server.utils.exceptions import BadOptionError, MessageFormatError
+from coap_server.utils.parser import (
+    decode_uint,
+    encode_message,
+    encode_message_into,
+    encode_uint,
+    parse_message,
+    uri_options,
+)
 
 
 def test_encode_message():
@@ -35,3 +50,246 @@ def test_parse_message():
         CoapOption.URI_PATH: b"/sensors",
     }
     assert response.payload == b""
+
+
+def test_parse_options_are_views():
+    response = parse_message(b"D\x01\x0591234\xb8/sensors\xffpayload")
+
+    assert isinstance(response.options[CoapOption.URI_PATH], memoryview)
+    assert response.options[CoapOption.URI_PATH] == b"/sensors"
+    assert response.payload == b"payload"
+
+
+def test_parse_extended_option_length():
+    # Uri-Path values are at most 255 bytes long, Proxy-Uri ones 1034
+    uri = b"coap://example.com/" + b"a" * 282
+    response_encoded = b"D\x01\x0591234\xde\x16\x00\x20" + uri
+
+    response = parse_message(response_encoded)
+
+    assert response.options == {CoapOption.PROXY_URI: uri}
+    assert response.payload == b""
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"D\x01\x05",  # truncated header
+        b"\x84\x01\x0591234",  # unsupported version
+        b"I\x01\x0591234",  # reserved token length
+        b"D\x01\x0512",  # truncated token
+        b"D\x01\x0591234\xb8/sen",  # option value exceeds message
+        b"D\x01\x0591234\xd1",  # truncated extended delta
+        b"D\x01\x0591234\xbf",  # reserved option length
+        b"D\x01\x0591234\xff",  # payload marker without payload
+    ],
+)
+def test_parse_malformed(data):
+    with pytest.raises(MessageFormatError):
+        parse_message(data)
+
+
+def test_parse_unknown_options():
+    # Elective (even) option 2 is ignored, critical (odd) option 9 is not
+    response = parse_message(b"D\x01\x0591234\x21x")
+    assert response.options == {}
+
+    with pytest.raises(BadOptionError) as e:
+        parse_message(b"D\x01\x0591234\x91x")
+
+    assert e.value.option_number == 9
+    assert e.value.request.header_mid == 1337
+    assert e.value.request.token == b"1234"
+
+
+@pytest.mark.parametrize(
+    "options, number",
+    [
+        # Uri-Host is critical and not repeatable
+        (b"\x31h\x01h", 3),
+        # Uri-Port is at most 2 bytes long
+        (b"\x73abc", 7),
+        # If-Match is at most 8 bytes long
+        (b"\x19" + b"x" * 9, 1),
+    ],
+)
+def test_parse_invalid_critical_options(options, number):
+    with pytest.raises(BadOptionError) as e:
+        parse_message(b"D\x01\x0591234" + options)
+
+    assert e.value.option_number == number
+
+
+def test_parse_invalid_elective_options():
+    # Max-Age of 5 bytes and a repeated Content-Format are ignored
+    response = parse_message(b"D\x01\x0591234\xc1\x32\x01\x3c\x25abcde")
+
+    assert response.options.all(CoapOption.CONTENT_FORMAT) == [b"\x32"]
+    assert CoapOption.MAX_AGE not in response.options
+
+
+def test_parse_repeated_options():
+    # Uri-Path "sensors", "1" and Uri-Query "a=1", "b"
+    response = parse_message(b"D\x01\x0591234\xb7sensors\x011\x43a=1\x01b")
+
+    assert response.options.all(CoapOption.URI_PATH) == [b"sensors", b"1"]
+    assert response.options[CoapOption.URI_PATH] == b"sensors"
+    assert response.options.keys() == {
+        CoapOption.URI_PATH,
+        CoapOption.URI_QUERY,
+    }
+    assert response.path == ("sensors", "1")
+    assert response.uri == "/sensors/1?a=1&b"
+    assert response.query == {"a": "1", "b": ""}
+
+
+def test_encode_repeated_options():
+    request = CoapMessage(
+        header_version=1,
+        header_type=0,
+        header_token_length=4,
+        header_code=CoapCode.GET,
+        header_mid=1337,
+        token=b"1234",
+        options=Options(uri_options("/sensors/1?a=1&b")),
+        payload=b"",
+    )
+
+    encoded = encode_message(request)
+
+    assert encoded == b"D\x01\x0591234\xb7sensors\x011\x43a=1\x01b"
+    assert parse_message(encoded).options == request.options
+
+
+def test_options():
+    options = Options(
+        [
+            (CoapOption.URI_QUERY, b"a"),
+            (CoapOption.MAX_AGE, b"\x01\x00"),
+            (CoapOption.URI_PATH, "ü".encode()),
+            (CoapOption.URI_QUERY, b"b"),
+        ]
+    )
+
+    # sorted by option numbers, repeated options keep their order
+    assert options.pairs == [
+        (11, "ü".encode()),
+        (14, b"\x01\x00"),
+        (15, b"a"),
+        (15, b"b"),
+    ]
+    assert options.uint(CoapOption.MAX_AGE) == 256
+    assert options.string(CoapOption.URI_PATH) == "ü"
+    assert options.opaque(CoapOption.URI_QUERY) == b"a"
+    assert options.uint(CoapOption.ACCEPT, 60) == 60
+    assert options.all(CoapOption.URI_QUERY) == [b"a", b"b"]
+    assert options.all(CoapOption.ETAG) == []
+    assert options.without(CoapOption.URI_QUERY) == Options(options.pairs[:2])
+    assert options != Options(options.pairs[:3])
+    # repeated options are kept, the given ones replaced
+    assert options.updated({CoapOption.MAX_AGE: b"\x05"}).pairs == [
+        (11, "ü".encode()),
+        (14, b"\x05"),
+        (15, b"a"),
+        (15, b"b"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "value, path, uri",
+    [
+        # the whole URI in a single option
+        (b"/sensors/1?limit=10", ("sensors", "1"), "/sensors/1?limit=10"),
+        (b"sensors//1/", ("sensors", "1"), "/sensors/1"),
+        (b"", (), "/"),
+    ],
+)
+def test_single_uri_path_option(value, path, uri):
+    request = CoapMessage(
+        header_version=1,
+        header_type=0,
+        header_token_length=0,
+        header_code=CoapCode.GET,
+        header_mid=1,
+        token=b"",
+        options={CoapOption.URI_PATH: value},
+        payload=b"",
+    )
+
+    assert request.path == path
+    assert request.uri == uri
+
+
+def test_encode_multiple_extended_options():
+    uri = b"coap://example.com/" + b"a" * 281
+    request = CoapMessage(
+        header_version=1,
+        header_type=1,
+        header_token_length=0,
+        header_code=CoapCode.CONTENT,
+        header_mid=1,
+        token=b"",
+        options={
+            CoapOption.PROXY_URI: uri,
+            CoapOption.URI_PATH: b"x" * 20,
+        },
+        payload=b"data",
+    )
+
+    request_encoded = encode_message(request)
+
+    assert request_encoded == (
+        b"\x50\x45\x00\x01"
+        + b"\xbd\x07"
+        + b"x" * 20
+        + b"\xde\x0b\x00\x1f"
+        + uri
+        + b"\xffdata"
+    )
+    assert parse_message(request_encoded) == request
+
+
+def test_encode_message_into():
+    request = parse_message(b"D\x01\x0591234\xb8/sensors")
+    buffer = bytearray(32)
+
+    size = encode_message_into(request, buffer, offset=2)
+
+    assert size == 17
+    assert buffer[2 : 2 + size] == b"D\x01\x0591234\xb8/sensors"
+
+    buffer = bytearray(16)
+    with pytest.raises(ValueError):
+        encode_message_into(request, buffer)
+    assert len(buffer) == 16
+
+
+def test_encode_message_into_extended():
+    # extended option deltas and lengths, and a payload
+    message = CoapMessage(
+        header_version=1,
+        header_type=0,
+        header_token_length=2,
+        header_code=CoapCode.CONTENT,
+        header_mid=7,
+        token=b"ab",
+        options={
+            CoapOption.URI_PATH: b"x" * 20,
+            CoapOption.SIZE1: b"y" * 300,
+        },
+        payload=b"payload",
+    )
+    encoded = encode_message(message)
+    buffer = bytearray(len(encoded) + 1)
+
+    assert encode_message_into(message, buffer, offset=1) == len(encoded)
+    assert buffer[1:] == encoded
+
+
+@pytest.mark.parametrize(
+    "value, encoded",
+    [(0, b""), (1, b"\x01"), (255, b"\xff"), (256, b"\x01\x00")],
+)
+def test_uint_option_values(value, encoded):
+    assert encode_uint(value) == encoded
+    assert decode_uint(memoryview(encoded)) == value
@@ -0,0 +1,105 @@
+import pytest
+
+from coap_server.ratelimit import RateLimiter, rejection
+from coap_server.utils.constants import CoapCode, CoapOption, CoapType
+from coap_server.utils.parser import parse_message
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_client_rate(clock):
+    limiter = RateLimiter(client_rate=2, client_burst=3, clock=clock)
+
+    assert [limiter.admit("10.0.0.1") for _ in range(3)] == [None] * 3
+    assert limiter.admit("10.0.0.1") == (CoapCode.TOO_MANY_REQUESTS, 1)
+    # other clients have their own buckets
+    assert limiter.admit("10.0.0.2") is None
+
+    clock.now += 0.5
+    assert limiter.admit("10.0.0.1") is None
+    assert limiter.admit("10.0.0.1") is not None
+
+    # the bucket doesn't fill above the burst
+    clock.now += 60
+    assert [limiter.admit("10.0.0.1") for _ in range(4)] == [None] * 3 + [
+        (CoapCode.TOO_MANY_REQUESTS, 1)
+    ]
+
+
+def test_retry_after(clock):
+    limiter = RateLimiter(client_rate=0.1, clock=clock)
+
+    assert limiter.admit("10.0.0.1") is None
+    assert limiter.admit("10.0.0.1") == (CoapCode.TOO_MANY_REQUESTS, 10)
+
+    clock.now += 4.5
+    assert limiter.admit("10.0.0.1") == (CoapCode.TOO_MANY_REQUESTS, 6)
+
+
+def test_global_rate(clock):
+    limiter = RateLimiter(client_rate=10, global_rate=2, clock=clock)
+
+    assert limiter.admit("10.0.0.1") is None
+    assert limiter.admit("10.0.0.2") is None
+    assert limiter.admit("10.0.0.3") == (CoapCode.SERVICE_UNAVAILABLE, 1)
+
+
+def test_no_limits(clock):
+    limiter = RateLimiter(clock=clock)
+
+    assert all(limiter.admit("10.0.0.1") is None for _ in range(1000))
+    assert not limiter.clients
+
+
+def test_clients_bounded(clock):
+    limiter = RateLimiter(client_rate=1, max_clients=100, clock=clock)
+
+    for i in range(10000):
+        limiter.admit(f"10.0.{i // 256}.{i % 256}")
+    assert len(limiter.clients) == 100
+
+    # the least recently seen client is evicted first
+    limiter.admit("10.0.38.172")
+    limiter.admit("10.1.0.0")
+    assert "10.0.38.172" in limiter.clients
+    assert "10.0.38.173" not in limiter.clients
+    assert "10.0.38.174" in limiter.clients
+
+
+def test_rejection():
+    # CON GET with token "1234" and Uri-Path "sensors"
+    data = b"D\x01\x0591234\xb7sensors"
+
+    reply = rejection(data, CoapCode.TOO_MANY_REQUESTS, 300)
+    response = parse_message(reply)
+
+    assert response.header_type == CoapType.ACK
+    assert response.header_code == CoapCode.TOO_MANY_REQUESTS
+    assert response.header_mid == 1337
+    assert response.token == b"1234"
+    assert response.options.uint(CoapOption.MAX_AGE) == 300
+    assert response.payload == b""
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        # NON request
+        b"T\x01\x0591234",
+        # token longer than the datagram
+        b"D\x01\x05912",
+    ],
+)
+def test_no_rejection(data):
+    assert rejection(data, CoapCode.SERVICE_UNAVAILABLE, 1) is None
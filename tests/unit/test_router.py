@@ -0,0 +1,88 @@
+import pytest
+
+from coap_server.resources.base_resource import BaseResource
+from coap_server.router import Router
+from coap_server.utils.exceptions import NotFoundError
+
+
+class Items(BaseResource):
+    objects = {}
+    paths = ("/", "/latest", "/{id:int}", "/{id:int}/{field}")
+
+
+class Users(BaseResource):
+    objects = {}
+
+
+@pytest.fixture
+def router():
+    return Router({"items": Items(), "users": Users()})
+
+
+@pytest.mark.parametrize(
+    "uri, path, params",
+    [
+        ("/items", "/", {}),
+        ("items/", "/", {}),
+        ("/items?limit=1", "/", {}),
+        ("/items/latest", "/latest", {}),
+        ("/items/12", "/{id:int}", {"id": 12}),
+        ("/items/12/name", "/{id:int}/{field}", {"id": 12, "field": "name"}),
+    ],
+)
+def test_resolve(router, uri, path, params):
+    route = router.resolve(uri)
+
+    assert isinstance(route.resource, Items)
+    assert route.path == path
+    assert route.params == params
+    assert route.pattern == "/items" + path.rstrip("/")
+
+
+def test_resolve_path(router):
+    route = router.resolve_path(("items", "12", "name"))
+
+    assert isinstance(route.resource, Items)
+    assert route.path == "/{id:int}/{field}"
+    assert route.params == {"id": 12, "field": "name"}
+
+
+def test_resolve_default_path(router):
+    route = router.resolve("/users")
+
+    assert isinstance(route.resource, Users)
+    assert route.pattern == "/users"
+
+
+@pytest.mark.parametrize(
+    "uri",
+    ["/", "/itemsX", "/items/abc", "/items/+1", "/items/1/name/x", "/users/1"],
+)
+def test_resolve_not_found(router, uri):
+    with pytest.raises(NotFoundError):
+        router.resolve(uri)
+
+
+def test_backtracking():
+    class Files(BaseResource):
+        objects = {}
+        paths = ("/{name}/raw", "/latest/meta")
+
+    router = Router({"files": Files()})
+
+    # static segment matches first, but only the parameter leads to a route
+    route = router.resolve("/files/latest/raw")
+    assert route.path == "/{name}/raw"
+    assert route.params == {"name": "latest"}
+
+
+def test_invalid_routes():
+    class Unknown(BaseResource):
+        objects = {}
+        paths = ("/{id:float}",)
+
+    with pytest.raises(ValueError):
+        Router({"unknown": Unknown()})
+
+    with pytest.raises(ValueError):
+        Router({"items": Items(), "/items/": Items()})
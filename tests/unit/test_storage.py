@@ -0,0 +1,297 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from coap_server.storage import (
+    MAX_ID_GAP,
+    LogStore,
+    SensorStore,
+    SQLiteStore,
+    StorageKind,
+    open_store,
+)
+
+
+def sensor(temperature):
+    return {"name": "Sensor", "temperature": temperature}
+
+
+@pytest.fixture(params=[StorageKind.WAL, StorageKind.SQLITE])
+def kind(request):
+    return request.param
+
+
+def test_mapping(kind, tmp_path):
+    store = open_store(kind, tmp_path)
+    store[1] = sensor(20)
+    store[2] = sensor(21)
+    store[1] = sensor(22)
+
+    assert store[1] == sensor(22)
+    assert 2 in store and 3 not in store
+    assert len(store) == 2
+    assert list(store) == [1, 2]
+    assert dict(store.items()) == {1: sensor(22), 2: sensor(21)}
+    assert store.rows() == [(1, sensor(22)), (2, sensor(21))]
+    assert store.version() == 3
+
+    del store[2]
+    with pytest.raises(KeyError):
+        store[2]
+    with pytest.raises(KeyError):
+        del store[2]
+    store.close()
+
+
+def test_create(kind, tmp_path):
+    store = open_store(kind, tmp_path)
+    store[3] = sensor(20)
+
+    assert store.create(sensor(21)) == 4
+    assert store[4] == sensor(21)
+    store.close()
+
+
+def test_merge(kind, tmp_path):
+    store = open_store(kind, tmp_path)
+    store[1] = sensor(20)
+    store[2] = sensor(21)
+
+    assert store.merge({1: {"temperature": 30}, 3: {"temperature": 31}}) == [3]
+    assert store[1] == sensor(20)
+
+    assert store.merge({1: {"temperature": 30}, 2: {"temperature": 31}}) == []
+    assert store.rows() == [(1, sensor(30)), (2, sensor(31))]
+    store.close()
+
+    store = open_store(kind, tmp_path)
+    assert store[2] == sensor(31)
+    store.close()
+
+
+def test_persisted(kind, tmp_path):
+    store = open_store(kind, tmp_path)
+    for i in range(1, 101):
+        store[i] = sensor(i)
+    del store[50]
+    store.close()
+
+    store = open_store(kind, tmp_path)
+    assert len(store) == 99
+    assert 50 not in store
+    assert store[100] == sensor(100)
+    store.close()
+
+
+def test_group_commit(tmp_path):
+    store = LogStore(tmp_path, commit_interval=60).start()
+    store[1] = sensor(20)
+    store[2] = sensor(21)
+
+    # nothing is written until the commit
+    assert (tmp_path / "wal.log").read_bytes() == b""
+
+    store.flush()
+    assert (tmp_path / "wal.log").read_bytes().count(b"\n") == 2
+    store.close()
+
+
+def test_snapshot(tmp_path):
+    store = LogStore(tmp_path, snapshot_every=10)
+    for i in range(1, 11):
+        store[i] = sensor(i)
+    store.flush()
+    store[11] = sensor(11)
+    store.close()
+
+    snapshot = json.loads((tmp_path / "snapshot.json").read_bytes())
+    assert snapshot["sequence"] == 10
+    assert len(snapshot["objects"]) == 10
+    assert (tmp_path / "wal.log").read_bytes().count(b"\n") == 1
+    assert not (tmp_path / "wal.old").exists()
+
+    store = LogStore(tmp_path)
+    assert len(store) == 11
+    store.close()
+
+
+def test_interrupted_snapshot(tmp_path):
+    store = LogStore(tmp_path)
+    store[1] = sensor(20)
+    store[2] = sensor(21)
+    store.close()
+    # crash after the log was moved away, before the snapshot was written
+    (tmp_path / "wal.log").rename(tmp_path / "wal.old")
+    (tmp_path / "wal.log").write_bytes(b"")
+
+    store = LogStore(tmp_path)
+    assert dict(store.items()) == {1: sensor(20), 2: sensor(21)}
+    assert not (tmp_path / "wal.old").exists()
+    store.close()
+
+    store = LogStore(tmp_path)
+    assert len(store) == 2
+    store.close()
+
+
+def test_torn_record(tmp_path):
+    store = LogStore(tmp_path)
+    store[1] = sensor(20)
+    store.close()
+    with open(tmp_path / "wal.log", "ab") as log:
+        log.write(b'[2, 2, {"name": "Sen')
+
+    store = LogStore(tmp_path)
+    assert list(store) == [1]
+    store[3] = sensor(22)
+    store.close()
+
+    store = LogStore(tmp_path)
+    assert list(store) == [1, 3]
+    store.close()
+
+
+def test_sqlite_items_single_query(tmp_path):
+    store = SQLiteStore(tmp_path / "objects.sqlite3")
+    store[1] = sensor(20)
+    store[2] = sensor(21)
+
+    statements = []
+    store.connection.set_trace_callback(statements.append)
+    assert dict(store.items()) == {1: sensor(20), 2: sensor(21)}
+    assert len(statements) == 1
+    store.close()
+
+
+def test_sqlite_commit_doesnt_block(tmp_path):
+    store = SQLiteStore(tmp_path / "objects.sqlite3")
+    store[1] = sensor(20)
+    del store[1]
+    store[2] = sensor(21)
+
+    syncing, synced = threading.Event(), threading.Event()
+
+    def trace(statement):
+        if statement == "COMMIT":
+            syncing.set()
+            synced.wait(5)
+
+    store.writer.set_trace_callback(trace)
+    committer = threading.Thread(target=store.commit)
+    committer.start()
+    assert syncing.wait(5)
+
+    # the changes being committed are visible, new ones can be made
+    assert 1 not in store
+    assert store[2] == sensor(21)
+    store[3] = sensor(22)
+    assert store.rows() == [(2, sensor(21)), (3, sensor(22))]
+    assert len(store) == 2
+    assert store.create(sensor(23)) == 4
+
+    synced.set()
+    committer.join()
+    store.writer.set_trace_callback(None)
+    assert list(store) == [2, 3, 4]
+    store.close()
+
+    store = SQLiteStore(tmp_path / "objects.sqlite3")
+    assert store.rows() == [
+        (2, sensor(21)),
+        (3, sensor(22)),
+        (4, sensor(23)),
+    ]
+    store.close()
+
+
+def test_sensor_store():
+    store = SensorStore({1: sensor(20), 2: sensor(21)})
+    store[2] = {"name": "", "temperature": -5}
+
+    assert store[1] == sensor(20)
+    assert store[2] == {"name": "", "temperature": -5}
+    assert list(store) == [1, 2]
+    assert len(store) == 2
+    assert store.version() == 3
+
+    del store[1]
+    assert 1 not in store
+    with pytest.raises(KeyError):
+        store[1]
+    with pytest.raises(KeyError):
+        del store[1]
+    assert list(store) == [2]
+    assert len(store) == 1
+
+
+def test_sensor_store_merge():
+    store = SensorStore({1: sensor(20), 2: sensor(21)})
+
+    assert store.merge({2: {"temperature": 30}, 4: {"temperature": 31}}) == [4]
+    assert store[2] == sensor(21)
+
+    assert store.merge({2: {"temperature": 30}}) == []
+    assert store[2] == sensor(30)
+
+
+def test_sensor_store_create_concurrently():
+    store = SensorStore()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        ids = list(pool.map(lambda i: store.create(sensor(i)), range(2000)))
+
+    assert sorted(ids) == list(range(1, 2001))
+    assert len(store) == 2000
+
+
+def test_sensor_store_ids_not_reused():
+    store = SensorStore({1: sensor(20), 5: sensor(21)})
+    assert store.create(sensor(22)) == 6
+
+    del store[6]
+    assert store.create(sensor(23)) == 7
+    assert list(store) == [1, 5, 7]
+
+
+@pytest.mark.parametrize(
+    "key, value",
+    [
+        (0, sensor(20)),
+        ("1", sensor(20)),
+        (MAX_ID_GAP + 2, sensor(20)),
+    ],
+)
+def test_sensor_store_invalid_key(key, value):
+    store = SensorStore()
+
+    with pytest.raises(KeyError):
+        store[key] = value
+    assert key not in store
+
+
+def test_sensor_store_invalid_sensor():
+    store = SensorStore()
+
+    with pytest.raises(ValueError):
+        store[1] = {"name": "Sensor"}
+    assert len(store) == 0
+
+
+@pytest.mark.parametrize("temperature", [1 << 31, -(1 << 31) - 1, 1 << 40])
+def test_sensor_store_temperature_out_of_range(temperature):
+    store = SensorStore({1: sensor(20)})
+
+    # nothing is changed, neither a new sensor nor an existing one
+    with pytest.raises(ValueError):
+        store.create(sensor(temperature))
+    with pytest.raises(ValueError):
+        store[1] = sensor(temperature)
+    with pytest.raises(ValueError):
+        store.merge({1: {"temperature": temperature}})
+
+    assert dict(store) == {1: sensor(20)}
+    assert len(store) == 1
+    assert store.version() == 1
+    assert store.create(sensor(21)) == 2